@@ -0,0 +1,92 @@
+"""Per-browser transfer history, stored in the HistoryEntry table.
+
+The session only holds a random owner id, written once, so sends and receives
+no longer grow and rewrite the session blob. Pages are read newest first
+through the (owner, id) index with a `before` cursor. Entries older than
+HISTORY_MAX_AGE are dropped by the transfer expiry sweeper.
+"""
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import HistoryEntry
+
+SESSION_KEY = 'history_owner'
+# Where older releases kept the history: a list of dicts in the session
+LEGACY_SESSION_KEY = 'transfer_history'
+PAGE_SIZE = 50
+
+
+def _import_legacy(owner, legacy):
+    entries = []
+    for item in reversed(legacy):
+        entries.append(HistoryEntry(
+            owner=owner, kind=item.get('type', HistoryEntry.SENT),
+            filename=item.get('filename', '')[:255], size=item.get('size') or 0,
+        ))
+    created = HistoryEntry.objects.bulk_create(entries)
+    # auto_now_add stamped them all with "now"; keep the original dates
+    for entry, item in zip(created, reversed(legacy)):
+        date = parse_datetime(item.get('date') or '')
+        if date and entry.pk:
+            HistoryEntry.objects.filter(pk=entry.pk).update(created_at=date)
+
+
+def history_owner(request, create=True):
+    """Returns this browser's history id, creating it (or None if `create` is False) when missing.
+
+    A history still kept in the session by an older release is moved into the table.
+    """
+    owner = request.session.get(SESSION_KEY)
+    if owner is None and (create or LEGACY_SESSION_KEY in request.session):
+        owner = request.session[SESSION_KEY] = secrets.token_hex(16)
+        legacy = request.session.pop(LEGACY_SESSION_KEY, None)
+        if legacy:
+            _import_legacy(owner, legacy)
+    return owner
+
+
+def record(request, kind, transfer):
+    HistoryEntry.objects.create(
+        owner=history_owner(request), kind=kind,
+        filename=transfer.original_filename, size=transfer.file_size,
+    )
+
+
+async def arecord(request, kind, transfer):
+    owner = await request.session.aget(SESSION_KEY)
+    if owner is None:
+        owner = await sync_to_async(history_owner)(request)
+    await HistoryEntry.objects.acreate(
+        owner=owner, kind=kind, filename=transfer.original_filename, size=transfer.file_size,
+    )
+
+
+def history_page(owner, kind=None, before=None, limit=None):
+    """Returns (entries, next_before) for one page, newest first; next_before is None on the last page."""
+    limit = limit or PAGE_SIZE
+    if owner is None:
+        return [], None
+    entries = HistoryEntry.objects.filter(owner=owner).order_by('-id')
+    if kind:
+        entries = entries.filter(kind=kind)
+    if before:
+        entries = entries.filter(id__lt=before)
+    entries = list(entries[:limit + 1])
+    if len(entries) > limit:
+        return entries[:limit], entries[limit - 1].id
+    return entries, None
+
+
+def prune_history(now=None):
+    """Deletes entries older than HISTORY_MAX_AGE and returns how many went."""
+    cutoff = (now or timezone.now()) - settings.HISTORY_MAX_AGE
+    deleted, _ = HistoryEntry.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def clear_history(owner):
+    HistoryEntry.objects.filter(owner=owner).delete()
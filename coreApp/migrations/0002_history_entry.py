@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreApp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(max_length=32)),
+                ('kind', models.CharField(choices=[('sent', 'Sent'), ('received', 'Received')], max_length=8)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField(help_text='Size in bytes')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-id'], name='history_owner_id_idx'), models.Index(fields=['created_at'], name='history_created_at_idx')],
+            },
+        ),
+    ]
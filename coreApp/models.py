@@ -7,4 +7,31 @@ class Feedback(models.Model):
     submitted_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Feedback from {self.name or 'Anonymous'} - {self.submitted_at.strftime('%Y-%m-%d')}"
\ No newline at end of file
+        return f"Feedback from {self.name or 'Anonymous'} - {self.submitted_at.strftime('%Y-%m-%d')}"
+
+class HistoryEntry(models.Model):
+    """One send or receive, shown on the history page of the browser that made it.
+
+    Rows are keyed by a random id kept in the session (see coreApp.history), so
+    recording a transfer never rewrites the session itself.
+    """
+    SENT = 'sent'
+    RECEIVED = 'received'
+    KIND_CHOICES = [(SENT, 'Sent'), (RECEIVED, 'Received')]
+
+    owner = models.CharField(max_length=32)
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text="Size in bytes")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Every history read is "this owner's newest rows before id X"
+            models.Index(fields=['owner', '-id'], name='history_owner_id_idx'),
+            # Lets the expiry sweeper drop old rows without a full table scan
+            models.Index(fields=['created_at'], name='history_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.filename}"
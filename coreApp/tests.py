@@ -1,3 +1,75 @@
+import datetime
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from . import history
+from .models import HistoryEntry
+
+
+class FakeTransfer:
+    def __init__(self, name, size=10):
+        self.original_filename = name
+        self.file_size = size
+
+
+class HistoryTests(TestCase):
+    def record(self, kind, name):
+        # Any view will do: it only needs the client's session
+        response = self.client.get('/core/history/')
+        request = response.wsgi_request
+        history.record(request, kind, FakeTransfer(name))
+        request.session.save()
+        self.client.cookies['sessionid'] = request.session.session_key
+
+    def test_recording_leaves_the_session_alone(self):
+        self.record('sent', 'first.jpg')
+        session_data = self.client.session.session_key, dict(self.client.session)
+        self.record('received', 'second.jpg')
+        self.record('sent', 'third.jpg')
+        self.assertEqual((self.client.session.session_key, dict(self.client.session)), session_data)
+        self.assertEqual(list(self.client.session.keys()), [history.SESSION_KEY])
+        self.assertEqual(HistoryEntry.objects.filter(owner=session_data[1][history.SESSION_KEY]).count(), 3)
+
+    def test_pages_are_newest_first_and_filtered(self):
+        for n in range(5):
+            self.record('sent' if n % 2 else 'received', f'file{n}.jpg')
+        with mock.patch.object(history, 'PAGE_SIZE', 2):
+            response = self.client.get('/core/history/')
+            self.assertEqual([entry.filename for entry in response.context['transfer_history']],
+                             ['file4.jpg', 'file3.jpg'])
+            response = self.client.get(f"/core/history/?before={response.context['next_before']}")
+            self.assertEqual([entry.filename for entry in response.context['transfer_history']],
+                             ['file2.jpg', 'file1.jpg'])
+            response = self.client.get('/core/history/?kind=sent')
+            self.assertEqual([entry.filename for entry in response.context['transfer_history']],
+                             ['file3.jpg', 'file1.jpg'])
+            self.assertIsNone(response.context['next_before'])
+
+    def test_other_browsers_see_nothing(self):
+        self.record('sent', 'mine.jpg')
+        self.client.cookies.clear()
+        response = self.client.get('/core/history/')
+        self.assertEqual(response.context['transfer_history'], [])
+
+    def test_legacy_session_history_is_imported(self):
+        session = self.client.session
+        session['transfer_history'] = [
+            {'type': 'received', 'filename': 'new.jpg', 'size': 2, 'date': '2026-01-02T00:00:00+00:00'},
+            {'type': 'sent', 'filename': 'old.jpg', 'size': 1, 'date': '2026-01-01T00:00:00+00:00'},
+        ]
+        session.save()
+        response = self.client.get('/core/history/')
+        self.assertEqual([entry.filename for entry in response.context['transfer_history']], ['new.jpg', 'old.jpg'])
+        self.assertEqual(response.context['transfer_history'][1].created_at.day, 1)
+        self.assertNotIn('transfer_history', self.client.session)
+
+    def test_clear_and_prune(self):
+        self.record('sent', 'a.jpg')
+        self.client.post('/core/history/clear/')
+        self.assertFalse(HistoryEntry.objects.exists())
 
-# Create your tests here.
+        self.record('sent', 'b.jpg')
+        self.assertEqual(history.prune_history(), 0)
+        self.assertEqual(history.prune_history(now=timezone.now() + datetime.timedelta(days=15)), 1)
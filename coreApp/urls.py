@@ -7,6 +7,7 @@ app_name = 'coreApp'
 urlpatterns = [
     # 2. FIXED: Changed 'views.history' to 'views.history_view' to match your views.py
     path('history/', views.history_view, name='history'),
+    path('history/clear/', views.clear_history_view, name='clear_history'),
 
     # 3. This is your feedback form
     path('submit-feedback/', views.submit_feedback, name='submit_feedback'),
@@ -1,17 +1,36 @@
 
-from django.shortcuts import render
+from django.shortcuts import redirect, render
+from django.views.decorators.http import require_POST
+
+from .history import clear_history, history_owner, history_page
+from .models import HistoryEntry
 
 def history_view(request):
     # In a real "no-logs" scenario, history might be stored in the client's
     # browser localstorage and rendered via JS.
-    # If server-side session history is required:
-    transfer_history = request.session.get('transfer_history', [])
-    
+    # Server-side history lives in HistoryEntry, keyed by an id in the session (see history.py)
+    kind = request.GET.get('kind')
+    if kind not in (HistoryEntry.SENT, HistoryEntry.RECEIVED):
+        kind = None
+    before = request.GET.get('before', '')
+    transfer_history, next_before = history_page(
+        history_owner(request, create=False), kind=kind, before=int(before) if before.isdigit() else None,
+    )
+
     context = {
-        'transfer_history': transfer_history
+        'transfer_history': transfer_history,
+        'kind': kind,
+        'next_before': next_before,
     }
     # Using the template shown in Image 1 & 5
     return render(request, 'history.html', context)
+
+@require_POST
+def clear_history_view(request):
+    owner = history_owner(request, create=False)
+    if owner:
+        clear_history(owner)
+    return redirect('coreApp:history')
 #feedback logic
 from django.http import JsonResponse
 from .forms import FeedbackForm
@@ -0,0 +1,12 @@
+"""Streaming ZIP export of locker files (see transferApp.zipstream)."""
+from django.utils import timezone
+
+from transferApp.utils import decrypt_field_file
+
+from .utils import file_data_key
+
+
+def locker_zip_entries(locker_files, master_key):
+    for locker_file in locker_files:
+        date_time = timezone.localtime(locker_file.uploaded_at).timetuple()[:6]
+        yield locker_file.filename, date_time, decrypt_field_file(locker_file.file, file_data_key(locker_file, master_key))
@@ -0,0 +1,54 @@
+"""Keyset pagination over a user's locker files.
+
+Pages are ordered newest first by (uploaded_at, id) and walked with an opaque
+cursor holding the last row's position, so every page is one range scan of the
+(user, uploaded_at, id) index however deep the user has scrolled.
+"""
+import base64
+import datetime
+
+from django.db.models import Count, Max, Q
+
+from .models import LockerFile
+
+PAGE_SIZE = 48
+# What the dashboard and the JSON listing need; the legacy `key` column is never loaded
+LISTING_FIELDS = ('id', 'filename', 'uploaded_at', 'blob__size', 'blob__thumbnail')
+
+
+def encode_cursor(locker_file):
+    position = f'{locker_file.uploaded_at.isoformat()}|{locker_file.id}'
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (uploaded_at, id) for a cursor. Raises ValueError if it is malformed."""
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        uploaded_at, file_id = position.split('|')
+        return datetime.datetime.fromisoformat(uploaded_at), int(file_id)
+    except (UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def files_page(user_id, cursor=None, limit=None):
+    """Returns (files, next_cursor) for one page; next_cursor is None on the last page."""
+    limit = limit or PAGE_SIZE
+    files = (
+        LockerFile.objects.filter(user_id=user_id)
+        .select_related('blob').only(*LISTING_FIELDS)
+        .order_by('-uploaded_at', '-id')
+    )
+    if cursor:
+        uploaded_at, file_id = decode_cursor(cursor)
+        files = files.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=file_id))
+    files = list(files[:limit + 1])
+    if len(files) > limit:
+        return files[:limit], encode_cursor(files[limit - 1])
+    return files, None
+
+
+def listing_version(user_id):
+    """A value that changes whenever files are added to or removed from the user's locker."""
+    totals = LockerFile.objects.filter(user_id=user_id).aggregate(count=Count('id'), last=Max('id'))
+    return f"{totals['count']}-{totals['last'] or 0}"
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from lockerApp.models import LockerBlob
+from lockerApp.utils import dedup_stats
+
+
+class Command(BaseCommand):
+    help = "Reports how much locker storage content deduplication saves."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help="Only report this locker")
+
+    def handle(self, *args, **options):
+        blobs = LockerBlob.objects.all()
+        if options['email']:
+            blobs = blobs.filter(user__email=options['email'])
+        stats = dedup_stats(blobs)
+        self.stdout.write(
+            f"Logical {stats['logical_bytes']} bytes, stored {stats['stored_bytes']} bytes, "
+            f"saved {stats['bytes_saved']} bytes (dedup ratio {stats['ratio']:.2f}x)"
+        )
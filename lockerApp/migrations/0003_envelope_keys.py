@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lockerApp', '0002_lockerfile_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lockerfile',
+            name='wrapped_key',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lockeruser',
+            name='kdf_params',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lockeruser',
+            name='kdf_salt',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lockeruser',
+            name='wrapped_master_key',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
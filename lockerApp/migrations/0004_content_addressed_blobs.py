@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lockerApp', '0003_envelope_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LockerBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('file', models.FileField(upload_to='locker_files/%Y/%m/')),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blobs', to='lockerApp.lockeruser')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='lockerfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='lockerApp.lockerblob'),
+        ),
+        migrations.AddConstraint(
+            model_name='lockerblob',
+            constraint=models.UniqueConstraint(fields=('user', 'content_hash'), name='unique_locker_blob'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lockerApp', '0004_content_addressed_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lockerblob',
+            name='image_format',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='lockerblob',
+            name='thumbnail',
+            field=models.FileField(blank=True, upload_to='locker_files/%Y/%m/'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lockerApp', '0005_blob_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lockerfile',
+            index=models.Index(fields=['user', '-uploaded_at', '-id'], name='lockerfile_user_uploaded_idx'),
+        ),
+    ]
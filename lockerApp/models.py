@@ -2,16 +2,53 @@ from django.db import models
 
 class LockerUser(models.Model):
     email = models.EmailField(unique=True)
-    # Store the PIN hash (securely), not the plain text PIN
+    # Store the PIN hash (securely), not the plain text PIN.
+    # With kdf_params set this is the KDF verifier rather than a Django password hash.
     pin_hash = models.CharField(max_length=128)
+    kdf_salt = models.BinaryField(blank=True, null=True)
+    kdf_params = models.JSONField(blank=True, null=True)
+    # The user's master key, wrapped by the PIN-derived key; it wraps every file's data key
+    wrapped_master_key = models.BinaryField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.email
 
+class LockerBlob(models.Model):
+    """One encrypted copy of a piece of content, shared by all of a user's LockerFiles with that content."""
+    user = models.ForeignKey(LockerUser, on_delete=models.CASCADE, related_name='blobs')
+    # Keyed hash of the plaintext (see lockerApp.utils.content_fingerprint)
+    content_hash = models.CharField(max_length=64)
+    file = models.FileField(upload_to='locker_files/%Y/%m/')
+    # Plaintext bytes
+    size = models.PositiveBigIntegerField()
+    # Small preview encrypted under the same data key (see transferApp.images)
+    thumbnail = models.FileField(upload_to='locker_files/%Y/%m/', blank=True)
+    # Format the image stage re-encoded the upload to ('' if stored as uploaded)
+    image_format = models.CharField(max_length=10, blank=True)
+    # Number of LockerFiles pointing at this blob; the blob is deleted when it drops to 0
+    ref_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_hash'], name='unique_locker_blob'),
+        ]
+
 class LockerFile(models.Model):
     user = models.ForeignKey(LockerUser, on_delete=models.CASCADE, related_name='files')
     file = models.FileField(upload_to='locker_files/%Y/%m/')
     filename = models.CharField(max_length=255)
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    key = models.CharField(max_length=255, blank=True)
\ No newline at end of file
+    # Legacy plaintext data key; emptied once the file is moved to wrapped_key
+    key = models.CharField(max_length=255, blank=True)
+    # Data key wrapped by the owner's master key
+    wrapped_key = models.BinaryField(blank=True, null=True)
+    # Shared ciphertext; `file` names the same blob. Files uploaded before dedup have none
+    blob = models.ForeignKey(LockerBlob, on_delete=models.PROTECT, related_name='files', blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the dashboard (lockerApp.listing)
+            models.Index(fields=['user', '-uploaded_at', '-id'], name='lockerfile_user_uploaded_idx'),
+        ]
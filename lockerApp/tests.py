@@ -1,3 +1,324 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import zipfile
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from PIL import Image
+
+from pixelockproject.urls import urlpatterns as project_urlpatterns
+
+from transferApp.kdf import KdfBusy
+from transferApp.utils import encrypt_file, generate_key
+from . import views
+from .listing import files_page
+from .models import LockerBlob, LockerFile, LockerUser
+from .utils import (
+    COOKIE_SESSION_KEY, dedup_stats, file_data_key, rotate_master_key, set_pin, unlock_master_key,
+)
+
+
+@override_settings(KDF_PROFILE='scrypt')
+class LockerFileTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.client.post('/locker/', {'email': 'owner@example.com', 'pin': '1234'})
+
+    def upload(self, name, data):
+        self.client.post('/locker/dashboard/', {'file': SimpleUploadedFile(name, data)})
+        return LockerFile.objects.latest('id')
+
+    def test_upload_is_stored_encrypted_and_downloads_intact(self):
+        data = b'raw photo bytes' * 5000
+        locker_file = self.upload('IMG_0001.JPG', data)
+        with locker_file.file.open('rb') as f:
+            self.assertNotIn(b'raw photo bytes', f.read())
+
+        response = self.client.get(f'/locker/download/{locker_file.id}/')
+        self.assertEqual(response['Content-Length'], str(len(data)))
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_range_download(self):
+        data = bytes(range(256)) * 1000
+        locker_file = self.upload('clip.mov', data)
+        response = self.client.get(f'/locker/download/{locker_file.id}/', HTTP_RANGE='bytes=65530-65545')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), data[65530:65546])
+
+    def download(self, locker_file):
+        response = self.client.get(f'/locker/download/{locker_file.id}/')
+        return b''.join(response.streaming_content)
+
+    def test_new_files_only_store_a_wrapped_key(self):
+        locker_file = self.upload('a.jpg', b'abc')
+        self.assertEqual(locker_file.key, '')
+        self.assertTrue(locker_file.wrapped_key)
+
+    def test_pin_change_and_master_rotation_keep_files_readable(self):
+        locker_file = self.upload('a.jpg', b'abc')
+        user = LockerUser.objects.get()
+        master_key = unlock_master_key(user, '1234')
+
+        set_pin(user, '9999', master_key)
+        user.save()
+        self.assertIsNone(unlock_master_key(user, '1234'))
+        self.assertEqual(unlock_master_key(user, '9999'), master_key)
+
+        rotate_master_key(user, master_key, '9999')
+        self.client.post('/locker/dashboard/', {'logout': '1'})
+        self.client.post('/locker/', {'email': 'owner@example.com', 'pin': '9999'})
+        self.assertEqual(self.download(locker_file), b'abc')
+
+    def test_failed_rotation_leaves_every_file_key_under_the_old_master_key(self):
+        locker_file = self.upload('a.jpg', b'abc')
+        user = LockerUser.objects.get()
+        master_key = unlock_master_key(user, '1234')
+        with mock.patch.object(LockerUser, 'save', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                rotate_master_key(user, master_key, '1234')
+        locker_file.refresh_from_db()
+        self.assertEqual(unlock_master_key(LockerUser.objects.get(), '1234'), master_key)
+        self.assertEqual(self.download(locker_file), b'abc')
+
+    def test_upload_with_a_rotated_away_master_key_logs_out(self):
+        locker_file = self.upload('a.jpg', b'abc')
+        user = LockerUser.objects.get()
+        # Another session rotates the master key; this session still holds the old one
+        rotate_master_key(user, unlock_master_key(user, '1234'), '1234')
+        response = self.client.post('/locker/dashboard/', {'file': SimpleUploadedFile('b.jpg', b'new')})
+        self.assertRedirects(response, '/locker/', fetch_redirect_response=False)
+        self.assertEqual(list(LockerFile.objects.all()), [locker_file])
+
+        self.client.post('/locker/', {'email': 'owner@example.com', 'pin': '1234'})
+        self.assertEqual(self.download(locker_file), b'abc')
+
+    def test_legacy_locker_is_upgraded_on_login(self):
+        user = LockerUser.objects.create(email='old@example.com', pin_hash=make_password('4321'))
+        key, _ = generate_key()
+        encrypted = encrypt_file(BytesIO(b'legacy'), key)
+        encrypted.name = 'old.jpg'
+        locker_file = LockerFile.objects.create(user=user, file=encrypted, filename='old.jpg', key=key.decode())
+
+        self.client.post('/locker/dashboard/', {'logout': '1'})
+        self.client.post('/locker/', {'email': 'old@example.com', 'pin': '4321'})
+        locker_file.refresh_from_db()
+        self.assertEqual(locker_file.key, '')
+        self.assertEqual(self.download(locker_file), b'legacy')
+
+    def test_concurrent_legacy_upgrades_agree_on_one_master_key(self):
+        user = LockerUser.objects.create(email='old@example.com', pin_hash=make_password('4321'))
+        key, _ = generate_key()
+        encrypted = encrypt_file(BytesIO(b'legacy'), key)
+        encrypted.name = 'old.jpg'
+        locker_file = LockerFile.objects.create(user=user, file=encrypted, filename='old.jpg', key=key.decode())
+
+        # Two logins that both read the locker before either upgraded it
+        first, second = LockerUser.objects.get(pk=user.pk), LockerUser.objects.get(pk=user.pk)
+        master_key = unlock_master_key(first, '4321')
+        self.assertEqual(unlock_master_key(second, '4321'), master_key)
+        locker_file.refresh_from_db()
+        self.assertEqual(unlock_master_key(LockerUser.objects.get(pk=user.pk), '4321'), master_key)
+        self.assertEqual(file_data_key(locker_file, master_key), key)
+
+    def test_busy_kdf_at_registration_shows_a_form_error(self):
+        self.client.post('/locker/dashboard/', {'logout': '1'})
+        with mock.patch.object(views, 'create_master_key', side_effect=KdfBusy):
+            response = self.client.post('/locker/', {'email': 'new@example.com', 'pin': '1234'})
+        self.assertContains(response, "The server is busy.")
+        self.assertFalse(LockerUser.objects.filter(email='new@example.com').exists())
+
+    def test_session_without_key_cookie_must_log_in_again(self):
+        locker_file = self.upload('a.jpg', b'abc')
+        del self.client.cookies[COOKIE_SESSION_KEY]
+        response = self.client.get(f'/locker/download/{locker_file.id}/')
+        self.assertRedirects(response, '/locker/')
+
+
+    def test_repeat_upload_shares_one_blob(self):
+        data = b'same photo' * 3000
+        first = self.upload('IMG_0001.JPG', data)
+        second = self.upload('IMG_0001 copy.JPG', data)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(LockerBlob.objects.get().ref_count, 2)
+        # Only the shared blob is on disk; the repeat's ciphertext was discarded
+        stored = [name for _, _, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(self.download(second), data)
+
+        stats = dedup_stats()
+        self.assertEqual(stats['bytes_saved'], len(data))
+        self.assertEqual(stats['ratio'], 2.0)
+
+    def test_blob_is_deleted_with_its_last_file(self):
+        first = self.upload('a.jpg', b'abc')
+        second = self.upload('b.jpg', b'abc')
+        path = first.file.path
+
+        self.client.post('/locker/dashboard/', {'delete': first.id})
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.download(second), b'abc')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/locker/dashboard/', {'delete': second.id})
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(LockerBlob.objects.exists())
+
+    def test_same_content_is_not_shared_between_users(self):
+        self.upload('a.jpg', b'abc')
+        self.client.post('/locker/dashboard/', {'logout': '1'})
+        self.client.post('/locker/', {'email': 'other@example.com', 'pin': '1234'})
+        self.upload('a.jpg', b'abc')
+        self.assertEqual(LockerBlob.objects.count(), 2)
+
+
+    def test_image_uploads_get_an_encrypted_thumbnail(self):
+        image = Image.new('RGB', (800, 600), (10, 120, 200))
+        buffer = BytesIO()
+        image.save(buffer, format='PNG')
+        locker_file = self.upload('big.png', buffer.getvalue())
+
+        with locker_file.blob.thumbnail.open('rb') as f:
+            self.assertTrue(f.read().startswith(b'PXLK'))
+        response = self.client.get(f'/locker/thumbnail/{locker_file.id}/')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        thumbnail = Image.open(BytesIO(response.content))
+        self.assertEqual(thumbnail.size, (256, 192))
+        self.assertContains(self.client.get('/locker/dashboard/'), f'/locker/thumbnail/{locker_file.id}/')
+
+        self.assertEqual(self.client.get(f'/locker/thumbnail/{self.upload("a.txt", b"abc").id}/').status_code, 404)
+
+    @override_settings(IMAGE_REENCODE_FORMAT='webp')
+    def test_repeat_of_a_reencoded_upload_gets_the_new_extension(self):
+        buffer = BytesIO()
+        Image.new('RGB', (32, 32)).save(buffer, format='JPEG')
+        first = self.upload('a.jpg', buffer.getvalue())
+        second = self.upload('b.jpg', buffer.getvalue())
+        self.assertEqual([first.filename, second.filename], ['a.webp', 'b.webp'])
+        self.assertEqual(first.blob_id, second.blob_id)
+
+
+    def test_pages_walk_every_file_once_including_timestamp_ties(self):
+        user = LockerUser.objects.get()
+        now = timezone.now()
+        LockerFile.objects.bulk_create([
+            LockerFile(user=user, file=f'locker_files/{n}.enc', filename=f'{n}.jpg', key='secret')
+            for n in range(7)
+        ])
+        # Several files share one timestamp, so the id has to break ties
+        LockerFile.objects.filter(id__in=list(LockerFile.objects.values_list('id', flat=True)[:4])).update(uploaded_at=now)
+
+        seen, cursor = [], None
+        while True:
+            files, cursor = files_page(user.id, cursor, limit=3)
+            seen += [locker_file.id for locker_file in files]
+            self.assertTrue(all('key' in locker_file.get_deferred_fields() for locker_file in files))
+            if cursor is None:
+                break
+        expected = list(LockerFile.objects.order_by('-uploaded_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_json_listing_pages_and_revalidates(self):
+        for n in range(3):
+            self.upload(f'{n}.txt', b'%d' % n)
+        with mock.patch('lockerApp.listing.PAGE_SIZE', 2):
+            body = self.client.get('/locker/files/').json()
+            response = self.client.get('/locker/files/', {'cursor': body['next_cursor']})
+        self.assertEqual([f['filename'] for f in body['files']], ['2.txt', '1.txt'])
+        self.assertNotIn('key', body['files'][0])
+        self.assertEqual(body['files'][0]['download_url'], f"/locker/download/{body['files'][0]['id']}/")
+        self.assertEqual([f['filename'] for f in response.json()['files']], ['0.txt'])
+        self.assertIsNone(response.json()['next_cursor'])
+
+        etag = self.client.get('/locker/files/')['ETag']
+        self.assertEqual(self.client.get('/locker/files/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.upload('3.txt', b'3')
+        self.assertEqual(self.client.get('/locker/files/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.assertEqual(self.client.get('/locker/files/', {'cursor': 'nonsense'}).status_code, 400)
+
+
+    def test_bulk_upload_stores_every_file(self):
+        images = []
+        for color in ('red', 'green', 'blue'):
+            buffer = BytesIO()
+            Image.new('RGB', (300, 300), color).save(buffer, format='PNG')
+            images.append(SimpleUploadedFile(f'{color}.png', buffer.getvalue()))
+        self.client.post('/locker/dashboard/', {'file': images + [SimpleUploadedFile('note.txt', b'hello')]})
+
+        files = LockerFile.objects.select_related('blob').order_by('id')
+        self.assertEqual([f.filename for f in files], ['red.png', 'green.png', 'blue.png', 'note.txt'])
+        self.assertEqual([bool(f.blob.thumbnail) for f in files], [True, True, True, False])
+        self.assertEqual(self.download(files[3]), b'hello')
+
+    def test_camera_roll_batch_over_djangos_default_limit(self):
+        batch = [SimpleUploadedFile(f'IMG_{n:04d}.JPG', b'photo %d' % (n % 120)) for n in range(150)]
+        self.client.post('/locker/dashboard/', {'file': batch})
+        self.assertEqual(LockerFile.objects.count(), 150)
+        # 30 repeats deduplicated against the first 120
+        self.assertEqual(LockerBlob.objects.count(), 120)
+
+    @override_settings(DATA_UPLOAD_MAX_NUMBER_FILES=120)
+    def test_oversized_batch_is_refused_with_a_message(self):
+        batch = [SimpleUploadedFile(f'IMG_{n:04d}.JPG', b'photo %d' % n) for n in range(150)]
+        response = self.client.post('/locker/dashboard/', {'file': batch}, follow=True)
+        self.assertContains(response, "Too many files. Upload at most 120 at once.")
+        self.assertFalse(LockerFile.objects.exists())
+        self.assertEqual([names for _, _, names in os.walk(self.media_root) if names], [])
+
+    def test_zip_export_streams_selected_files(self):
+        first = self.upload('a.jpg', b'first file' * 10000)
+        second = self.upload('a.jpg', b'second')
+        self.upload('skipped.jpg', b'not selected')
+
+        response = self.client.post('/locker/export/', {'files': [first.id, second.id]})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ['a.jpg', 'a (1).jpg'])
+            self.assertEqual(archive.read('a.jpg'), b'second')
+            self.assertEqual(archive.read('a (1).jpg'), b'first file' * 10000)
+            self.assertIsNone(archive.testzip())
+
+        other = LockerUser.objects.create(email='x@example.com', pin_hash='x')
+        foreign = LockerFile.objects.create(user=other, file='locker_files/x.enc', filename='x')
+        response = self.client.post('/locker/export/', {'files': [foreign.id]})
+        self.assertRedirects(response, '/locker/dashboard/')
+
+
+urlpatterns = [
+    path('locker/download/<int:file_id>/', views.download_locker_file_async),
+    *project_urlpatterns,
+]
+
+
+@override_settings(ROOT_URLCONF='lockerApp.tests', KDF_PROFILE='scrypt')
+class AsyncDownloadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    async def test_async_download_streams_decrypted_file(self):
+        data = b'async locker' * 10000
+        await self.async_client.post('/locker/', {'email': 'owner@example.com', 'pin': '1234'})
+        await self.async_client.post('/locker/dashboard/', {'file': SimpleUploadedFile('a.jpg', data)})
+        locker_file = await LockerFile.objects.aget()
+
+        response = await self.async_client.get(f'/locker/download/{locker_file.id}/')
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), data)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -7,6 +8,11 @@ urlpatterns = [
     path('', views.locker_login_view, name='login'),
  
     path('dashboard/', views.locker_dashboard_view, name='dashboard'),
-    path('download/<int:file_id>/', views.download_locker_file, name='download_file'),
+    path('download/<int:file_id>/',
+         views.download_locker_file_async if settings.ASYNC_VIEWS else views.download_locker_file,
+         name='download_file'),
+    path('thumbnail/<int:file_id>/', views.locker_thumbnail, name='thumbnail'),
+    path('files/', views.locker_files_json, name='files'),
+    path('export/', views.export_locker_files, name='export'),
 ]
  
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""Envelope encryption for the locker.
+
+Every LockerUser has a random master key wrapped by a key derived from their PIN,
+and every LockerFile has its own data key wrapped by that master key. Changing a
+PIN or rotating the master key only rewraps these small key blobs; file
+contents are never re-encrypted.
+
+After login the master key lives in the session wrapped by a random key that is
+only kept in a cookie, so neither the session table nor the cookie alone is enough
+to recover it, and each request only pays for a fast Fernet unwrap.
+
+Uploads are deduplicated per user: the plaintext is hashed while it streams in,
+and a repeat of content the user already stores only adds a LockerFile row that
+points at the existing LockerBlob (and shares its data key).
+"""
+import functools
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.contrib.auth.hashers import check_password
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils.crypto import salted_hmac
+
+from transferApp.images import process_upload, reencoded_filename
+from transferApp.kdf import derive_password_secrets, verify_password
+from transferApp.utils import wrap_key, unwrap_key
+from transferApp.workers import map_in_pool
+
+from .models import LockerBlob, LockerFile, LockerUser
+
+SESSION_MASTER_KEY = 'locker_master_key'
+COOKIE_SESSION_KEY = 'locker_key'
+
+
+def set_pin(user, pin, master_key):
+    """(Re)wraps `master_key` under `pin`. Doesn't save `user`."""
+    pin_key, verifier, salt, params = derive_password_secrets(pin)
+    user.pin_hash = verifier
+    user.kdf_salt = salt
+    user.kdf_params = params
+    user.wrapped_master_key = wrap_key(master_key, pin_key)
+
+
+def create_master_key(user, pin):
+    master_key = Fernet.generate_key()
+    set_pin(user, pin, master_key)
+    return master_key
+
+
+class StaleMasterKey(Exception):
+    """Raised when a session's master key was replaced by a rotation since it logged in."""
+
+
+def _lock_user(user):
+    # Rewrapping file keys, replacing the master key and adding files all hold this row
+    # lock, so no file key is ever wrapped under a master key that is being replaced.
+    # Call inside transaction.atomic(); slow KDF work belongs before it.
+    return LockerUser.objects.select_for_update().get(pk=user.pk)
+
+
+def unlock_master_key(user, pin):
+    """Returns the user's master key, or None if the PIN is wrong.
+
+    Lockers created before envelope encryption are upgraded on their first login.
+    """
+    if user.kdf_params:
+        pin_key = verify_password(pin, user.kdf_salt, user.kdf_params, user.pin_hash)
+        return unwrap_key(user.wrapped_master_key, pin_key) if pin_key else None
+
+    if not check_password(pin, user.pin_hash):
+        return None
+    master_key = create_master_key(user, pin)
+    with transaction.atomic():
+        upgraded = not _lock_user(user).kdf_params
+        if upgraded:
+            wrap_legacy_file_keys(user, master_key)
+            user.save(update_fields=['pin_hash', 'kdf_salt', 'kdf_params', 'wrapped_master_key'])
+    if not upgraded:
+        # A concurrent login upgraded the locker first; its master key is the one
+        user.refresh_from_db()
+        return unlock_master_key(user, pin)
+    return master_key
+
+
+def wrap_legacy_file_keys(user, master_key):
+    """Wraps the plain keys of files from before envelope encryption. Call with the user row locked."""
+    files = list(user.files.exclude(key='').only('id', 'key'))
+    for locker_file in files:
+        locker_file.wrapped_key = wrap_key(locker_file.key.encode(), master_key)
+        locker_file.key = ''
+    LockerFile.objects.bulk_update(files, ['wrapped_key', 'key'])
+
+
+def rotate_master_key(user, master_key, pin):
+    """Replaces the master key and rewraps every file's data key under the new one.
+
+    Raises InvalidToken, changing nothing, if `master_key` isn't the current master key.
+    """
+    new_master_key = create_master_key(user, pin)
+    with transaction.atomic():
+        _lock_user(user)
+        # Read with the lock held: files added meanwhile are rewrapped too
+        files = list(user.files.exclude(wrapped_key=None).only('id', 'wrapped_key'))
+        for locker_file in files:
+            locker_file.wrapped_key = wrap_key(unwrap_key(locker_file.wrapped_key, master_key), new_master_key)
+        LockerFile.objects.bulk_update(files, ['wrapped_key'])
+        user.save(update_fields=['pin_hash', 'kdf_salt', 'kdf_params', 'wrapped_master_key'])
+    return new_master_key
+
+
+def file_data_key(locker_file, master_key):
+    if locker_file.wrapped_key:
+        return unwrap_key(locker_file.wrapped_key, master_key)
+    return locker_file.key.encode()
+
+
+def content_fingerprint(user, content_hash):
+    """Per-user keyed hash of a plaintext SHA-256, so the database never holds raw content hashes."""
+    return salted_hmac(f'lockerApp.blob.{user.pk}', content_hash, algorithm='sha256').hexdigest()
+
+
+def store_uploads(user, uploaded_files, master_key):
+    """Adds EncryptedUploadedFiles to the locker and returns their LockerFiles.
+
+    If the user already stores the same content, the new ciphertext is left
+    unclaimed (the upload handler deletes it) and only metadata is inserted.
+    The image stage of new content runs on the worker pool.
+    """
+    fingerprints = [content_fingerprint(user, uploaded_file.content_hash) for uploaded_file in uploaded_files]
+    known = set(
+        LockerBlob.objects.filter(user=user, content_hash__in=fingerprints).values_list('content_hash', flat=True)
+    )
+    fresh = {}
+    for uploaded_file, fingerprint in zip(uploaded_files, fingerprints):
+        if fingerprint not in known:
+            fresh.setdefault(fingerprint, uploaded_file)
+    # New content gets its thumbnail (and optional strip/re-encode) outside any transaction
+    map_in_pool(functools.partial(process_upload, thumbnail=True), fresh.values())
+
+    return [
+        _record_upload(user, uploaded_file, fingerprint, master_key)
+        for uploaded_file, fingerprint in zip(uploaded_files, fingerprints)
+    ]
+
+
+def _check_master_key(user, master_key):
+    # Any wrapped file key tells whether master_key is still the current one
+    wrapped_key = user.files.exclude(wrapped_key=None).values_list('wrapped_key', flat=True).first()
+    if wrapped_key is None:
+        return
+    try:
+        unwrap_key(wrapped_key, master_key)
+    except InvalidToken:
+        raise StaleMasterKey from None
+
+
+def _record_upload(user, uploaded_file, fingerprint, master_key):
+    try:
+        with transaction.atomic():
+            _lock_user(user)
+            blob = LockerBlob.objects.filter(user=user, content_hash=fingerprint).first()
+            if blob is None:
+                _check_master_key(user, master_key)
+                blob = LockerBlob.objects.create(
+                    user=user, content_hash=fingerprint, file=uploaded_file.claim(), size=uploaded_file.size,
+                    thumbnail=uploaded_file.thumbnail_name, image_format=uploaded_file.image_format,
+                )
+                wrapped_key = wrap_key(uploaded_file.key, master_key)
+                filename = uploaded_file.name
+            else:
+                LockerBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                # Every file of a blob carries the same data key
+                wrapped_key = blob.files.values_list('wrapped_key', flat=True).first()
+                filename = reencoded_filename(uploaded_file.name, blob.image_format)
+            return LockerFile.objects.create(
+                user=user, blob=blob, file=blob.file.name, filename=filename, wrapped_key=wrapped_key,
+            )
+    except IntegrityError:
+        # A concurrent upload of the same content created the blob first
+        uploaded_file.claimed = False
+        return _record_upload(user, uploaded_file, fingerprint, master_key)
+
+
+def delete_locker_file(locker_file):
+    """Deletes a LockerFile, and its ciphertext once no other file references it."""
+    storage = locker_file.file.storage
+    names = [locker_file.file.name]
+    with transaction.atomic():
+        locker_file.delete()
+        if locker_file.blob_id:
+            LockerBlob.objects.filter(pk=locker_file.blob_id).update(ref_count=F('ref_count') - 1)
+            orphans = LockerBlob.objects.filter(pk=locker_file.blob_id, ref_count=0)
+            names += [name for name in orphans.values_list('thumbnail', flat=True) if name]
+            orphaned, _ = orphans.delete()
+        else:
+            orphaned = True
+        if orphaned:
+            transaction.on_commit(lambda: _delete_blobs(storage, names))
+
+
+def _delete_blobs(storage, names):
+    for name in names:
+        storage.delete(name)
+
+
+def dedup_stats(blobs=None):
+    """Returns logical vs stored bytes for `blobs` (default: every locker), the dedup ratio and bytes saved."""
+    blobs = LockerBlob.objects.all() if blobs is None else blobs
+    totals = blobs.aggregate(stored=Sum('size'), logical=Sum(F('size') * F('ref_count')))
+    stored = totals['stored'] or 0
+    logical = totals['logical'] or 0
+    return {
+        'logical_bytes': logical,
+        'stored_bytes': stored,
+        'bytes_saved': logical - stored,
+        'ratio': logical / stored if stored else 1.0,
+    }
+
+
+def remember_master_key(request, response, master_key):
+    cookie_key = Fernet.generate_key()
+    request.session[SESSION_MASTER_KEY] = wrap_key(master_key, cookie_key).decode()
+    response.set_cookie(COOKIE_SESSION_KEY, cookie_key.decode(), httponly=True, samesite='Lax')
+
+
+def _unwrap_session_key(wrapped, cookie_key):
+    if not wrapped or not cookie_key:
+        return None
+    try:
+        return unwrap_key(wrapped, cookie_key)
+    except (InvalidToken, ValueError):
+        return None
+
+
+def session_master_key(request):
+    """Returns the master key cached for this session, or None if it isn't available."""
+    return _unwrap_session_key(request.session.get(SESSION_MASTER_KEY), request.COOKIES.get(COOKIE_SESSION_KEY))
+
+
+async def asession_master_key(request):
+    wrapped = await request.session.aget(SESSION_MASTER_KEY)
+    return _unwrap_session_key(wrapped, request.COOKIES.get(COOKIE_SESSION_KEY))
+
+
+def forget_master_key(request, response):
+    request.session.pop(SESSION_MASTER_KEY, None)
+    response.delete_cookie(COOKIE_SESSION_KEY)
@@ -1,8 +1,38 @@
+from django.conf import settings
+from django.contrib import messages
 from django.shortcuts import render, redirect
-from django.contrib.auth.hashers import make_password, check_password
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import condition, require_GET, require_POST
+from .export import locker_zip_entries
 from .forms import LockerAccessForm
+from .listing import files_page, listing_version
 from .models import LockerUser, LockerFile
-from transferApp.utils import encrypt_file, generate_key
+from .utils import (
+    create_master_key, unlock_master_key, file_data_key, store_uploads, delete_locker_file, dedup_stats,
+    remember_master_key, session_master_key, asession_master_key, forget_master_key, StaleMasterKey,
+)
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from transferApp.kdf import KdfBusy
+from transferApp.upload_handlers import EncryptingUploadHandler, parse_upload
+from transferApp.zipstream import zip_stream
+import uuid
+
+
+def _login(request, user, master_key):
+    request.session['locker_user_id'] = user.id
+    response = redirect('lockerApp:dashboard')
+    remember_master_key(request, response, master_key)
+    return response
+
+
+def _logout(request):
+    request.session.pop('locker_user_id', None)
+    response = redirect('lockerApp:login')
+    forget_master_key(request, response)
+    return response
+
+
 def locker_login_view(request):
     # If already logged in, go straight to dashboard
     if request.session.get('locker_user_id'):
@@ -15,25 +45,26 @@ def locker_login_view(request):
             pin = form.cleaned_data['pin']
             
             try:
-                # SCENARIO 1: User Exists -> Check PIN
-                user = LockerUser.objects.get(email=email)
-                
-                if check_password(pin, user.pin_hash):
-                    # Correct PIN: Login
-                    request.session['locker_user_id'] = user.id
-                    return redirect('lockerApp:dashboard')
+                user = LockerUser.objects.filter(email=email).first()
+                if user is not None:
+                    # SCENARIO 1: User Exists -> Check PIN (and unwrap the master key)
+                    master_key = unlock_master_key(user, pin)
+
+                    if master_key:
+                        # Correct PIN: Login
+                        return _login(request, user, master_key)
+                    else:
+                        # Wrong PIN
+                        form.add_error('pin', "Incorrect PIN for this locker.")
                 else:
-                    # Wrong PIN
-                    form.add_error('pin', "Incorrect PIN for this locker.")
-            
-            except LockerUser.DoesNotExist:
-                # SCENARIO 2: New User -> Create Account & PIN
-                new_user = LockerUser.objects.create(
-                    email=email,
-                    pin_hash=make_password(pin) # Securely hash the PIN
-                )
-                request.session['locker_user_id'] = new_user.id
-                return redirect('lockerApp:dashboard')
+                    # SCENARIO 2: New User -> Create Account, PIN and master key
+                    new_user = LockerUser(email=email)
+                    master_key = create_master_key(new_user, pin)
+                    new_user.save()
+                    return _login(request, new_user, master_key)
+
+            except KdfBusy:
+                form.add_error(None, "The server is busy. Please try again in a moment.")
 
     else:
         form = LockerAccessForm()
@@ -41,7 +72,30 @@ def locker_login_view(request):
     return render(request, 'locker.html', {'form': form})
 
 
+@csrf_exempt
 def locker_dashboard_view(request):
+    # Encrypt uploads while they stream in; this must happen before anything reads
+    # request.POST, so CSRF is checked in _locker_dashboard_view instead.
+    if request.method != 'POST' or not request.session.get('locker_user_id'):
+        return _locker_dashboard_view(request)
+
+    # Blobs are shared between files, so they get a neutral name instead of the upload's
+    handler = EncryptingUploadHandler(
+        request, LockerFile._meta.get_field('file'), filename=f'{uuid.uuid4().hex}.enc',
+    )
+    request.upload_handlers.insert(0, handler)
+    try:
+        if not parse_upload(request):
+            # The body (CSRF token included) was never parsed, so nothing of it can be acted on
+            messages.error(request, f"Too many files. Upload at most {settings.DATA_UPLOAD_MAX_NUMBER_FILES} at once.")
+            return redirect('lockerApp:dashboard')
+        return _locker_dashboard_view(request)
+    finally:
+        handler.discard_unclaimed()
+
+
+@csrf_protect
+def _locker_dashboard_view(request):
     # Ensure user is logged in
     user_id = request.session.get('locker_user_id')
     if not user_id:
@@ -50,71 +104,168 @@ def locker_dashboard_view(request):
     try:
         user = LockerUser.objects.get(id=user_id)
     except LockerUser.DoesNotExist:
-        del request.session['locker_user_id']
-        return redirect('lockerApp:login')
+        return _logout(request)
+
+    # Without the cached master key nothing can be encrypted or read: log in again
+    master_key = session_master_key(request)
+    if not master_key:
+        return _logout(request)
 
     # Handle Logout
     if request.method == 'POST' and 'logout' in request.POST:
-        del request.session['locker_user_id']
-        return redirect('lockerApp:login')
+        return _logout(request)
 
-    # Handle File Upload
+    # Handle File Upload (one or many files per POST)
     if request.method == 'POST' and request.FILES.get('file'):
-            uploaded_file = request.FILES['file']
-            
-            # 1. Generate Key
-            key, _ = generate_key() 
-            
-            # 2. Encrypt
-            encrypted_blob = encrypt_file(uploaded_file, key)
-            
-            # 3. THE FIX: Give the blob the original filename
-            encrypted_blob.name = uploaded_file.name  
-            
-            # 4. Save
-            LockerFile.objects.create(
-                user=user,
-                file=encrypted_blob,
-                filename=uploaded_file.name,
-                key=key.decode()
-            )
+            # The upload handler already encrypted each file with a fresh data key and
+            # wrote the ciphertext to locker_files/; keep those whose content isn't stored yet
+            try:
+                store_uploads(user, request.FILES.getlist('file'), master_key)
+            except StaleMasterKey:
+                # The master key was rotated by another session: this one must log in again
+                return _logout(request)
             return redirect('lockerApp:dashboard')
 
-    # Show Files
-    files = user.files.all().order_by('-uploaded_at')
-    
+    # Handle File Delete
+    if request.method == 'POST' and 'delete' in request.POST:
+        file_id = request.POST['delete']
+        locker_file = user.files.filter(id=file_id).first() if file_id.isdigit() else None
+        if locker_file:
+            delete_locker_file(locker_file)
+        return redirect('lockerApp:dashboard')
+
+    # Show Files, one page at a time
+    try:
+        files, next_cursor = files_page(user.id, request.GET.get('cursor'))
+    except ValueError:
+        return redirect('lockerApp:dashboard')
+
     context = {
         'user_email': user.email,
-        'files': files
+        'files': files,
+        'next_cursor': next_cursor,
+        'dedup': dedup_stats(user.blobs.all()),
     }
     return render(request, 'locker.html', context)
+
+
+def _listing_etag(request):
+    user_id = request.session.get('locker_user_id')
+    if not user_id:
+        return None
+    return f"{user_id}:{listing_version(user_id)}:{request.GET.get('cursor', '')}"
+
+
+# JSON listing for scripts and infinite scroll: same pages as the dashboard, and a
+# 304 when nothing was added or removed since the client's copy
+@require_GET
+@condition(etag_func=_listing_etag)
+def locker_files_json(request):
+    user_id = request.session.get('locker_user_id')
+    if not user_id:
+        return JsonResponse({'success': False, 'message': "Not logged in."}, status=403)
+    try:
+        files, next_cursor = files_page(user_id, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'success': False, 'message': "Invalid cursor."}, status=400)
+
+    response = JsonResponse({
+        'success': True,
+        'files': [
+            {
+                'id': locker_file.id,
+                'filename': locker_file.filename,
+                'uploaded_at': locker_file.uploaded_at.isoformat(),
+                'size': locker_file.blob.size if locker_file.blob else None,
+                'download_url': reverse('lockerApp:download_file', args=[locker_file.id]),
+                'thumbnail_url': (
+                    reverse('lockerApp:thumbnail', args=[locker_file.id])
+                    if locker_file.blob and locker_file.blob.thumbnail else None
+                ),
+            }
+            for locker_file in files
+        ],
+        'next_cursor': next_cursor,
+    })
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 #encrytion logic
 
-from django.http import HttpResponse, Http404
-from transferApp.utils import decrypt_file_data
-import mimetypes
+from django.http import HttpResponse, Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from transferApp.images import THUMBNAIL_CONTENT_TYPE
+from transferApp.utils import decrypted_file_response, async_decrypted_file_response, decrypt_stream
 
 def download_locker_file(request, file_id):
     # 1. Security Check: Is user logged in?
     user_id = request.session.get('locker_user_id')
-    if not user_id:
-        return redirect('lockerApp:login')
+    master_key = session_master_key(request)
+    if not user_id or not master_key:
+        return _logout(request)
 
     try:
         # 2. Get the file (and ensure it belongs to this user!)
         locker_file = LockerFile.objects.get(id=file_id, user_id=user_id)
 
-        # 3. Read the encrypted data from disk
-        with locker_file.file.open('rb') as f:
-            encrypted_data = f.read()
+        # 3. Unwrap the file's data key and stream the decrypted file back as a download
+        key = file_data_key(locker_file, master_key)
+        return decrypted_file_response(request, locker_file.file, key, locker_file.filename)
+
+    except LockerFile.DoesNotExist:
+        raise Http404("File not found or access denied.")
 
-        # 4. Decrypt using the stored key
-        decrypted_data = decrypt_file_data(encrypted_data, locker_file.key.encode())
 
-        # 5. Serve it as a download
-        response = HttpResponse(decrypted_data, content_type=mimetypes.guess_type(locker_file.filename)[0])
-        response['Content-Disposition'] = f'attachment; filename="{locker_file.filename}"'
+@require_POST
+def export_locker_files(request):
+    # Selected files as one ZIP, decrypted file by file into the response stream
+    user_id = request.session.get('locker_user_id')
+    master_key = session_master_key(request)
+    if not user_id or not master_key:
+        return _logout(request)
+
+    file_ids = [file_id for file_id in request.POST.getlist('files') if file_id.isdigit()]
+    locker_files = list(LockerFile.objects.filter(user_id=user_id, id__in=file_ids).order_by('-uploaded_at', '-id'))
+    if not locker_files:
+        return redirect('lockerApp:dashboard')
+
+    response = StreamingHttpResponse(zip_stream(locker_zip_entries(locker_files, master_key)),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="pixelock-locker.zip"'
+    return response
+
+
+def locker_thumbnail(request, file_id):
+    # Small encrypted preview made by the image stage; decrypted whole, it's only a few KB
+    user_id = request.session.get('locker_user_id')
+    master_key = session_master_key(request)
+    if not user_id or not master_key:
+        raise Http404("File not found or access denied.")
+
+    locker_file = LockerFile.objects.filter(id=file_id, user_id=user_id).select_related('blob').first()
+    if locker_file is None or locker_file.blob is None or not locker_file.blob.thumbnail:
+        raise Http404("No preview for this file.")
+
+    key = file_data_key(locker_file, master_key)
+    with locker_file.blob.thumbnail.open('rb') as encrypted:
+        response = HttpResponse(b''.join(decrypt_stream(encrypted, key)), content_type=THUMBNAIL_CONTENT_TYPE)
+    patch_cache_control(response, private=True, max_age=60 * 60)
+    return response
+
+
+async def download_locker_file_async(request, file_id):
+    # ASGI version: async ORM/session access, decryption streamed from worker threads
+    user_id = await request.session.aget('locker_user_id')
+    master_key = await asession_master_key(request)
+    if not user_id or not master_key:
+        await request.session.apop('locker_user_id', None)
+        response = redirect('lockerApp:login')
+        forget_master_key(request, response)
         return response
 
+    try:
+        locker_file = await LockerFile.objects.aget(id=file_id, user_id=user_id)
     except LockerFile.DoesNotExist:
-        raise Http404("File not found or access denied.")
\ No newline at end of file
+        raise Http404("File not found or access denied.")
+
+    key = file_data_key(locker_file, master_key)
+    return await async_decrypted_file_response(request, locker_file.file, key, locker_file.filename)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pixelockproject.settings')
+# Serve the async send/receive/download views when running under ASGI
+os.environ.setdefault('PIXELOCK_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import datetime
 import os
 from pathlib import Path
 
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its 'total' covers everything below (transferApp/metrics.py)
+    'transferApp.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,16 +74,53 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'pixelockproject.wsgi.application'
 
+# Route send/receive/locker downloads to their async views (asgi.py turns this on)
+ASYNC_VIEWS = os.environ.get('PIXELOCK_ASYNC_VIEWS') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PIXELOCK_DB=postgres uses PostgreSQL (needs psycopg) with persistent connections, or
+# psycopg's connection pool (psycopg[pool]) with PIXELOCK_DB_POOL=1. The default SQLite file is switched
+# to WAL mode per connection by transferApp/db.py so concurrent sends don't lock each other out.
+# WAL mode is stored in the file itself, so the bundled db.sqlite3 shows as modified once the server has run.
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('PIXELOCK_SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+if os.environ.get('PIXELOCK_DB', 'sqlite') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('PIXELOCK_DB_NAME', 'pixelock'),
+            'USER': os.environ.get('PIXELOCK_DB_USER', 'pixelock'),
+            'PASSWORD': os.environ.get('PIXELOCK_DB_PASSWORD', ''),
+            'HOST': os.environ.get('PIXELOCK_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('PIXELOCK_DB_PORT', '5432'),
+            # Seconds a connection is reused across requests
+            'CONN_MAX_AGE': int(os.environ.get('PIXELOCK_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('PIXELOCK_DB_POOL') == '1':
+        # The pool replaces persistent connections (Django requires CONN_MAX_AGE=0 with it)
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('PIXELOCK_DB_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('PIXELOCK_DB_POOL_MAX', 10)),
+            'timeout': 10,
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('PIXELOCK_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -129,15 +169,96 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-#for rate limiting
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
     }
 }
+# Password KDF used for new transfers (see transferApp/kdf.py: pbkdf2, scrypt, argon2id).
+# Derivations run on a shared pool so a burst of password checks can't tie up every worker.
+KDF_PROFILE = os.environ.get('PIXELOCK_KDF_PROFILE', 'pbkdf2')
+KDF_MAX_WORKERS = int(os.environ.get('PIXELOCK_KDF_MAX_WORKERS', os.cpu_count() or 2))
+KDF_MAX_QUEUE = int(os.environ.get('PIXELOCK_KDF_MAX_QUEUE', 32))
+
+# Worker threads for per-file crypto/image work of bulk uploads (transferApp/workers.py)
+CRYPTO_MAX_WORKERS = int(os.environ.get('PIXELOCK_CRYPTO_MAX_WORKERS', os.cpu_count() or 2))
+# Threads that encrypt/decrypt the 64KB frames of one large file in parallel (output stays
+# in order). 0 or 1 keeps every stream on the thread that handles it, as before.
+CRYPTO_PARALLEL_WORKERS = int(os.environ.get('PIXELOCK_CRYPTO_PARALLEL_WORKERS', 0))
+# Compress uploads before encrypting them: '' (off), 'zlib', or 'zstd' (needs zstandard).
+# Already compressed formats (JPEG, PNG, WebP, ZIP, video...) are detected and stored as is;
+# compressed files are downloaded without Range support. See transferApp/compression.py.
+COMPRESSION = os.environ.get('PIXELOCK_COMPRESSION', '')
+COMPRESSION_LEVEL = int(os.environ['PIXELOCK_COMPRESSION_LEVEL']) if os.environ.get('PIXELOCK_COMPRESSION_LEVEL') else None
+
+# Files Django parses from one request (its default is 100); must be at least
+# transferApp.forms.MAX_TRANSFER_ITEMS so that many files fit in one transfer. It is
+# also the largest batch of files one locker upload can carry.
+DATA_UPLOAD_MAX_NUMBER_FILES = 500
+
+# Rate limiting (transferApp/ratelimit.py). The SQLite file is shared by every worker
+# process on the host; LocMemBackend only counts within one process.
+RATELIMIT_BACKEND = os.environ.get('PIXELOCK_RATELIMIT_BACKEND', 'transferApp.ratelimit.SQLiteBackend')
+RATELIMIT_DB = os.environ.get('PIXELOCK_RATELIMIT_DB', os.path.join(BASE_DIR, 'ratelimit.sqlite3'))
+
+# Image stage for uploads (transferApp/images.py): strip EXIF/XMP, re-encode to
+# 'webp' or 'avif' ('' keeps the original format), and locker thumbnail size in px (0 = off).
+IMAGE_STRIP_METADATA = os.environ.get('PIXELOCK_IMAGE_STRIP_METADATA') == '1'
+IMAGE_REENCODE_FORMAT = os.environ.get('PIXELOCK_IMAGE_REENCODE_FORMAT', '')
+IMAGE_QUALITY = int(os.environ.get('PIXELOCK_IMAGE_QUALITY', 82))
+IMAGE_THUMBNAIL_SIZE = int(os.environ.get('PIXELOCK_IMAGE_THUMBNAIL_SIZE', 256))
+# Larger files skip the stage (it holds the decoded image in memory)
+IMAGE_MAX_BYTES = int(os.environ.get('PIXELOCK_IMAGE_MAX_BYTES', 50 * 1024 * 1024))
+
+# Text transfers up to this many UTF-8 bytes are stored encrypted in the database row;
+# longer ones are written to a blob and downloaded as message.txt
+INLINE_TEXT_MAX_BYTES = int(os.environ.get('PIXELOCK_INLINE_TEXT_MAX_BYTES', 64 * 1024))
+
+# Transfer history entries (coreApp/history.py) older than this are dropped by the expiry sweeper
+HISTORY_MAX_AGE = datetime.timedelta(days=int(os.environ.get('PIXELOCK_HISTORY_MAX_AGE_DAYS', 14)))
+
+# Hot-path instrumentation (transferApp/metrics.py): addresses allowed to scrape /metrics,
+# and PIXELOCK_TIMING_LOG=1 logs every request's stage timings as one JSON line
+METRICS_ALLOWED_IPS = os.environ.get('PIXELOCK_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {
+        'pixelock.timing': {
+            'handlers': ['console'],
+            'level': 'INFO' if os.environ.get('PIXELOCK_TIMING_LOG') == '1' else 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# Seconds between in-process expiry sweeps (0 = off; use `manage.py purge_expired` from cron instead)
+TRANSFER_SWEEP_INTERVAL = int(os.environ.get('PIXELOCK_SWEEP_INTERVAL', 0))
+
 # URL used to access the media
 MEDIA_URL = '/media/'
 
 # Path where media is stored
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Where encrypted blobs live (transferApp/storage.py). 'local' keeps them under MEDIA_ROOT;
+# 's3' uses an S3-compatible bucket (AWS, MinIO...) that several app nodes can share.
+# S3 credentials come from the usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY variables.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+if os.environ.get('PIXELOCK_STORAGE', 'local') == 's3':
+    STORAGES['default'] = {
+        'BACKEND': 'transferApp.storage.S3Storage',
+        'OPTIONS': {
+            'bucket_name': os.environ.get('PIXELOCK_S3_BUCKET', 'pixelock'),
+            'endpoint_url': os.environ.get('PIXELOCK_S3_ENDPOINT_URL') or None,
+            'region_name': os.environ.get('PIXELOCK_S3_REGION') or None,
+            'location': os.environ.get('PIXELOCK_S3_LOCATION', ''),
+            # Multipart part size; also the chunk size of resumable uploads on S3
+            'part_size': int(os.environ.get('PIXELOCK_S3_PART_SIZE', 8 * 1024 * 1024)),
+            'max_concurrency': int(os.environ.get('PIXELOCK_S3_MAX_CONCURRENCY', 4)),
+        },
+    }
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class TransferappConfig(AppConfig):
     name = 'transferApp'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .db import tune_sqlite
+        from .sweeper import start_sweeper
+        connection_created.connect(tune_sqlite)
+        start_sweeper()
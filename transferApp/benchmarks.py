@@ -0,0 +1,588 @@
+"""Micro-benchmarks for the crypto and transfer hot paths.
+
+Run them with `python manage.py benchmark [name ...]`, adding `--json results.json`
+to keep the rows for comparing commits (`--compare results.json`). Every benchmark
+works in a throwaway MEDIA_ROOT and never touches the real database; 'requests'
+and 'codes' run against a freshly migrated test database.
+"""
+import gzip
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+
+import django
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, override_settings
+from django.test.client import BOUNDARY, encode_multipart
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import codes, compression, db, kdf, ratelimit
+from .models import Transfer, generate_6_digit_code
+from .upload_handlers import EncryptingUploadHandler
+from .utils import decrypt_file_data, decrypt_stream, encrypt_file, encrypt_stream, generate_key, render_qr_code
+
+MB = 1024 * 1024
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark. Each one takes a list of sizes in bytes and returns result rows."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def scratch_media_root():
+    media_root = tempfile.mkdtemp(prefix='pixelock-bench-')
+    try:
+        with override_settings(MEDIA_ROOT=media_root):
+            yield media_root
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def measure(func, *args):
+    """Runs func once and returns (seconds, peak traced bytes)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        func(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def _reset_peak_rss():
+    # Linux only: writing 5 to clear_refs resets the VmHWM high-water mark
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def _proc_status(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def measure_rss(func, *args):
+    """Runs func once and returns (seconds, growth of the peak RSS in bytes).
+
+    Unlike measure(), this sees memory outside Python's allocator (OpenSSL buffers,
+    mmaps...). The peak is None where it can't be measured (no /proc).
+    """
+    if not _reset_peak_rss():
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start, None
+    baseline = _proc_status('VmRSS')
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    return elapsed, max(0, _proc_status('VmHWM') - baseline)
+
+
+def payload_blocks(size, seed=0, block_size=MB):
+    """Yields `size` bytes of seeded pseudo-random data, so every run encrypts the same input."""
+    block = random.Random(seed).randbytes(min(size, block_size))
+    while size > 0:
+        yield block[:size]
+        size -= len(block)
+
+
+def _median_row(rows):
+    """Collapses the repeated runs of one measurement into a row holding their median."""
+    row = dict(rows[0])
+    for field in ('seconds', 'peak_bytes', 'peak_rss'):
+        values = [r[field] for r in rows if r.get(field) is not None]
+        row[field] = statistics.median(values) if values else None
+    row['runs'] = len(rows)
+    if row.get('size') and row['seconds']:
+        row['mb_per_s'] = row['size'] / MB / row['seconds']
+    return row
+
+
+def environment():
+    """Describes where the rows were measured, stored next to them in --json output."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': timezone.now().isoformat(),
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _upload_request(data):
+    return RequestFactory().post('/send/', {'file': SimpleUploadedFile('bench.bin', data)})
+
+
+def _buffered_upload(request):
+    # The pre-streaming path: spool the upload, read it whole, Fernet it, save a copy
+    uploaded_file = request.FILES['file']
+    key, _ = generate_key()
+    encrypted = Fernet(key).encrypt(uploaded_file.read())
+    default_storage.save(f'bench/{uuid.uuid4()}.enc', ContentFile(encrypted))
+
+
+def _streaming_upload(request):
+    handler = EncryptingUploadHandler(
+        request, Transfer._meta.get_field('encrypted_file'), Transfer(), filename=f'{uuid.uuid4()}.enc',
+    )
+    request.upload_handlers.insert(0, handler)
+    request.FILES['file'].claim()
+
+
+@benchmark('upload')
+def bench_upload(sizes):
+    rows = []
+    with scratch_media_root():
+        for size in sizes:
+            data = os.urandom(size)
+            for label, path in (('buffered', _buffered_upload), ('streaming', _streaming_upload)):
+                # The request body is built outside the measured section
+                request = _upload_request(data)
+                seconds, peak = measure(path, request)
+                rows.append({
+                    'benchmark': 'upload', 'variant': label, 'size': size,
+                    'seconds': seconds, 'peak_bytes': peak,
+                    'mb_per_s': size / MB / seconds if seconds else None,
+                })
+    return rows
+
+
+@benchmark('kdf')
+def bench_kdf(sizes):
+    """Cost of one password derivation per profile (sizes are ignored)."""
+    rows = []
+    for name in kdf.available_profiles():
+        params = kdf.PROFILES[name]
+        seconds, peak = measure(kdf.derive_password_secrets, 'correct horse battery staple', None, params)
+        rows.append({'benchmark': 'kdf', 'variant': name, 'seconds': seconds, 'peak_bytes': peak})
+    # What receive_view paid before: check_password plus a second PBKDF2 run
+    password_hash = make_password('correct horse battery staple')
+    seconds, peak = measure(_legacy_password_check, password_hash)
+    rows.append({'benchmark': 'kdf', 'variant': 'legacy-2x', 'seconds': seconds, 'peak_bytes': peak})
+    # generate_key on its own: the PBKDF2 key of pre-KDF-profile transfers
+    seconds, peak = measure(generate_key, 'correct horse battery staple', os.urandom(16))
+    rows.append({'benchmark': 'kdf', 'variant': 'generate_key', 'seconds': seconds, 'peak_bytes': peak})
+    return rows
+
+
+@benchmark('crypto')
+def bench_crypto(sizes, repeat=3):
+    """encrypt_file / decrypt_file_data throughput and peak RSS, median of `repeat` runs.
+
+    decrypt_file_data needs the whole container in memory (it is read before the
+    measured section); 'decrypt_stream' is the streaming path downloads use.
+    """
+    rows = []
+    key, _ = generate_key()
+    with scratch_media_root() as media_root:
+        plain_path = os.path.join(media_root, 'plain.bin')
+        encrypted_path = os.path.join(media_root, 'plain.bin.enc')
+        for size in sizes:
+            with open(plain_path, 'wb') as plain:
+                for block in payload_blocks(size):
+                    plain.write(block)
+            with open(plain_path, 'rb') as plain, encrypt_file(plain, key) as encrypted, \
+                    open(encrypted_path, 'wb') as out:
+                shutil.copyfileobj(encrypted, out, MB)
+
+            runs = {'encrypt_file': [], 'decrypt_file_data': [], 'decrypt_stream': []}
+            for _ in range(repeat):
+                with open(plain_path, 'rb') as plain:
+                    runs['encrypt_file'].append(measure_rss(_encrypt_file, plain, key))
+                with open(encrypted_path, 'rb') as encrypted:
+                    data = encrypted.read()
+                runs['decrypt_file_data'].append(measure_rss(decrypt_file_data, data, key))
+                del data
+                with open(encrypted_path, 'rb') as encrypted:
+                    runs['decrypt_stream'].append(measure_rss(_drain, decrypt_stream(encrypted, key)))
+            for label, results in runs.items():
+                rows.append(_median_row([
+                    {'benchmark': 'crypto', 'variant': label, 'size': size, 'seconds': seconds, 'peak_rss': peak}
+                    for seconds, peak in results
+                ]))
+    return rows
+
+
+@benchmark('parallel')
+def bench_parallel(sizes, repeat=3):
+    """In-memory encrypt_stream / decrypt_stream throughput per CRYPTO_PARALLEL_WORKERS setting.
+
+    'x1' is the serial path and each row's speedup is relative to it. The speedup is
+    bounded by the number of cores, which is recorded in the --json environment.
+    """
+    rows = []
+    key, _ = generate_key()
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    for size in sizes:
+        data = b''.join(payload_blocks(size))
+        encrypted = b''.join(encrypt_stream(BytesIO(data), key))
+        for label, func, source in (('encrypt', encrypt_stream, data), ('decrypt', decrypt_stream, encrypted)):
+            serial = None
+            for workers in counts:
+                with override_settings(CRYPTO_PARALLEL_WORKERS=workers):
+                    row = _median_row([
+                        {'benchmark': 'parallel', 'variant': f'{label} x{workers}', 'size': size,
+                         'seconds': measure_rss(_drain, func(BytesIO(source), key))[0]}
+                        for _ in range(repeat)
+                    ])
+                serial = serial or row['seconds']
+                row['speedup'] = serial / row['seconds']
+                rows.append(row)
+    return rows
+
+
+def _log_text(size, seed=0):
+    """Seeded log-like text of `size` bytes, standing in for text files and documents."""
+    rng = random.Random(seed)
+    words = ('upload', 'transfer', 'chunk', 'frame', 'nonce', 'storage', 'request', 'retry', 'ok', 'user')
+    lines, total = [], 0
+    while total < size:
+        line = (f'2026-01-{rng.randint(1, 28):02d} {rng.randint(0, 86399):05d} '
+                f'{rng.choice(("INFO", "WARN", "DEBUG"))} {" ".join(rng.choices(words, k=8))} id={rng.getrandbits(32)}\n')
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode()[:size]
+
+
+def _photo(size, seed=0):
+    """A seeded photo-like RGB image (smooth gradients plus noise) of about `size` raw bytes."""
+    side = max(16, int((size / 3) ** 0.5))
+    gradient = Image.linear_gradient('L').resize((side, side))
+    noise = Image.frombytes('L', (side, side), random.Random(seed).randbytes(side * side))
+    return Image.merge('RGB', (
+        Image.blend(gradient, noise, 0.1), Image.blend(gradient.rotate(90), noise, 0.1), gradient.rotate(180),
+    ))
+
+
+def _encoded(image, fmt, **params):
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def compression_samples(size, seed=0, max_image_size=16 * MB):
+    """(kind, MIME type, payload) per content type; images are capped at `max_image_size` raw bytes."""
+    photo = _photo(min(size, max_image_size), seed)
+    return (
+        ('text', 'text/plain', _log_text(size, seed)),
+        ('tiff', 'image/tiff', _encoded(photo, 'TIFF')),
+        ('jpeg', 'image/jpeg', _encoded(photo, 'JPEG', quality=90)),
+        ('png', 'image/png', _encoded(photo, 'PNG')),
+        ('webp', 'image/webp', _encoded(photo, 'WEBP', quality=80)),
+        # Not payload_blocks(): zstd's window would find its repeated block
+        ('random', 'application/octet-stream', random.Random(seed).randbytes(size)),
+    )
+
+
+@benchmark('compression')
+def bench_compression(sizes, repeat=3):
+    """Stored size and encrypt/decrypt throughput per content type and COMPRESSION codec.
+
+    The codec goes through the same sniff as uploads, so the JPEG, PNG, WebP and
+    random rows show it skipping them ('skipped'). 'ratio' is stored bytes / plaintext bytes.
+    """
+    rows = []
+    key, _ = generate_key()
+    codecs = ['', 'zlib'] + (['zstd'] if compression.zstandard else [])
+    for size in sizes:
+        for kind, content_type, data in compression_samples(size):
+            for codec in codecs:
+                with override_settings(COMPRESSION=codec):
+                    used = compression.choose_codec(data[:compression.SAMPLE_SIZE], content_type)
+                encrypted = b''.join(encrypt_stream(BytesIO(data), key, codec=used))
+                encrypt = statistics.median(
+                    measure_rss(_drain, encrypt_stream(BytesIO(data), key, codec=used))[0] for _ in range(repeat)
+                )
+                decrypt = statistics.median(
+                    measure_rss(_drain, decrypt_stream(BytesIO(encrypted), key))[0] for _ in range(repeat)
+                )
+                rows.append({
+                    'benchmark': 'compression', 'size': len(data),
+                    'variant': f"{kind} {codec or 'none'}" + (' skipped' if codec and not used else ''),
+                    'seconds': encrypt, 'mb_per_s': len(data) / MB / encrypt,
+                    'decrypt_mb_per_s': len(data) / MB / decrypt, 'ratio': len(encrypted) / len(data),
+                })
+    return rows
+
+
+def _encrypt_file(file_handle, key):
+    encrypt_file(file_handle, key).close()
+
+
+def _drain(chunks):
+    for _ in chunks:
+        pass
+
+
+def _legacy_password_check(password_hash):
+    check_password('correct horse battery staple', password_hash)
+    generate_key('correct horse battery staple', os.urandom(16))
+
+
+def _fill_transfers(codes_to_add):
+    """Adds a Transfer for each of `codes_to_add`.
+
+    bulk_create spends ~0.2 ms a row in the ORM, minutes for a 90% full table, so
+    one Transfer is saved normally and copied in SQL with only its unique columns
+    changed.
+    """
+    if not codes_to_add:
+        return
+    template = Transfer.objects.create(
+        unique_code=codes_to_add[0], original_filename='bench.bin', file_size=0, expires_at=timezone.now(),
+    )
+    meta, quote = Transfer._meta, connection.ops.quote_name
+    unique = ('unique_code', 'unique_id')
+    copied = ', '.join(quote(f.column) for f in meta.concrete_fields if not f.primary_key and f.name not in unique)
+    table = quote(meta.db_table)
+    sql = (
+        f'INSERT INTO {table} ({", ".join(quote(meta.get_field(name).column) for name in unique)}, {copied}) '
+        f'SELECT %s, %s, {copied} FROM {table} WHERE {quote(meta.pk.column)} = %s'
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, [(code, uuid.uuid4().hex, template.pk) for code in codes_to_add[1:]])
+
+
+def _allocate_random_code():
+    # The scheme allocate_code() replaced: draw until a code isn't in the table
+    attempts = 0
+    while True:
+        attempts += 1
+        code = generate_6_digit_code()
+        if not Transfer.objects.filter(unique_code=code).exists():
+            return attempts
+
+
+@benchmark('codes')
+def bench_codes(sizes, allocations=2000):
+    """Per-allocation latency and attempts at increasing Transfer table occupancy (sizes are ignored).
+
+    Runs against a scratch database whose Transfer table holds the codes the
+    counter has already handed out. The old scheme draws random codes until one is
+    free, so it needs 1/(1 - occupancy) attempts, each a query; allocate_code()
+    always needs one.
+    """
+    from .models import CodeAllocator
+
+    rows = []
+    key = os.urandom(32)
+    with scratch_database():
+        CodeAllocator.objects.create(pk=1, key=key, counter=0)
+        filled = 0
+        for occupancy in (0.0, 0.5, 0.9):
+            target = int(codes.CODE_SPACE * occupancy)
+            _fill_transfers([codes.permute_code(n, key) for n in range(filled, target)])
+            filled = target
+
+            start = time.perf_counter()
+            attempts = sum(_allocate_random_code() for _ in range(allocations))
+            rows.append({'benchmark': 'codes', 'variant': f'random@{occupancy:.0%}',
+                         'seconds': (time.perf_counter() - start) / allocations, 'attempts': attempts / allocations})
+
+            # Pick up where the filled table leaves off; the codes drawn are never inserted
+            CodeAllocator.objects.filter(pk=1).update(counter=filled)
+            start = time.perf_counter()
+            for _ in range(allocations):
+                codes.allocate_code()
+            rows.append({'benchmark': 'codes', 'variant': f'counter@{occupancy:.0%}',
+                         'seconds': (time.perf_counter() - start) / allocations, 'attempts': 1.0})
+    return rows
+
+
+@benchmark('ratelimit')
+def bench_ratelimit(sizes, hits=5000):
+    """Per-hit latency of each rate-limit backend (sizes are ignored)."""
+    rows = []
+    with scratch_media_root() as media_root:
+        backends = (
+            ('sqlite', ratelimit.SQLiteBackend(os.path.join(media_root, 'ratelimit.sqlite3'))),
+            ('locmem', ratelimit.LocMemBackend()),
+        )
+        for label, backend in backends:
+            start = time.perf_counter()
+            for n in range(hits):
+                backend.hit(f'bench:{n % 100}', 60, time.time())
+            rows.append({'benchmark': 'ratelimit', 'variant': label,
+                         'seconds': (time.perf_counter() - start) / hits})
+    return rows
+
+
+@benchmark('qr')
+def bench_qr(sizes, renders=200):
+    """Render time and payload size of the PNG and SVG QR codes, uncached and cached (sizes are ignored).
+
+    The SVG's size is also given gzipped, the only form in which it is smaller than the PNG.
+    """
+    rows = []
+    for fmt in ('png', 'svg'):
+        links = [f'https://pixelock.example/r/{n:06d}/' for n in range(renders)]
+        start = time.perf_counter()
+        payloads = [render_qr_code.__wrapped__(link, fmt) for link in links]
+        rows.append({'benchmark': 'qr', 'variant': fmt, 'seconds': (time.perf_counter() - start) / renders,
+                     'bytes': sum(map(len, payloads)) // renders})
+        if fmt == 'svg':
+            # What the SVG costs on the wire behind a gzipping proxy or GZipMiddleware
+            rows.append({'benchmark': 'qr', 'variant': 'svg-gzip',
+                         'bytes': sum(len(gzip.compress(payload)) for payload in payloads) // renders})
+
+        render_qr_code(links[0], fmt)
+        start = time.perf_counter()
+        for _ in range(renders):
+            render_qr_code(links[0], fmt)
+        rows.append({'benchmark': 'qr', 'variant': f'{fmt}-cached',
+                     'seconds': (time.perf_counter() - start) / renders})
+    return rows
+
+
+def _send_writes(path, pragmas, begin, writes, worker, results):
+    """One worker's share of `writes` send-like transactions: code check, transfer insert, session upsert."""
+    connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    ok = errors = 0
+    for pragma in pragmas:
+        connection.execute(pragma)
+    for n in range(writes):
+        code = f'{worker:02d}{n:04d}'
+        try:
+            connection.execute(begin)
+            connection.execute('SELECT 1 FROM transfer WHERE code = ?', (code,)).fetchone()
+            connection.execute('INSERT INTO transfer (code, payload) VALUES (?, ?)', (code, os.urandom(200)))
+            connection.execute('INSERT OR REPLACE INTO session (key, data) VALUES (?, ?)', (f's{worker}', code))
+            connection.execute('COMMIT')
+            ok += 1
+        except sqlite3.OperationalError:
+            # "database is locked": what the user sees as a failed send
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            errors += 1
+    connection.close()
+    results[worker] = ok, errors
+
+
+@benchmark('db')
+def bench_db(sizes, workers=8, writes=200):
+    """Concurrent send-like writes to a scratch SQLite file, default vs tuned (sizes are ignored).
+
+    'default' is SQLite as Django used to open it (rollback journal, deferred
+    transactions); 'wal' applies the same PRAGMAs and BEGIN IMMEDIATE as the
+    settings profile (see transferApp/db.py).
+    """
+    rows = []
+    variants = (
+        ('default', (), 'BEGIN'),
+        ('wal', db.sqlite_pragmas(), 'BEGIN IMMEDIATE'),
+    )
+    with scratch_media_root() as media_root:
+        for label, pragmas, begin in variants:
+            path = os.path.join(media_root, f'{label}.sqlite3')
+            with sqlite3.connect(path) as connection:
+                connection.execute('CREATE TABLE transfer (code TEXT PRIMARY KEY, payload BLOB)')
+                connection.execute('CREATE TABLE session (key TEXT PRIMARY KEY, data TEXT)')
+            results = [(0, 0)] * workers
+            threads = [
+                threading.Thread(target=_send_writes, args=(path, pragmas, begin, writes, worker, results))
+                for worker in range(workers)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start
+            ok, errors = map(sum, zip(*results))
+            rows.append({'benchmark': 'db', 'variant': label, 'seconds': seconds,
+                         'ops_per_s': ok / seconds, 'errors': errors})
+    return rows
+
+
+@contextmanager
+def scratch_database():
+    """Points the default connection at a freshly migrated test database for the duration."""
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def _send(client, body):
+    # An already encoded body; the client only encodes `data` itself for its MULTIPART_CONTENT object
+    response = client.post(reverse('transferApp:send'), body, content_type=f'multipart/form-data; boundary={BOUNDARY}')
+    if response.status_code != 200:
+        raise RuntimeError(f"send returned {response.status_code}")
+
+
+def _receive(client, code):
+    response = client.post(reverse('transferApp:receive'), {'code_or_link': code}, follow=True)
+    if response.status_code != 200 or not response.streaming:
+        raise RuntimeError(f"receive returned {response.status_code}")
+    _drain(response.streaming_content)
+    response.close()
+
+
+@benchmark('requests')
+def bench_requests(sizes, repeat=3):
+    """Full request cycle of send_view / receive_view through the test client, median of `repeat` runs.
+
+    Covers middleware, form handling, encryption, the database and the streamed
+    download; the multipart request body is built outside the measured section.
+    """
+    rows = []
+    overrides = {
+        'ALLOWED_HOSTS': ['testserver'], 'DEBUG': False,
+        'RATELIMIT_BACKEND': 'transferApp.ratelimit.DummyBackend',
+    }
+    with scratch_media_root(), override_settings(**overrides), scratch_database():
+        client = Client()
+        for size in sizes:
+            body = encode_multipart(BOUNDARY, {'file': SimpleUploadedFile('bench.bin', b''.join(payload_blocks(size)))})
+            send, receive = [], []
+            for _ in range(repeat):
+                seconds, peak = measure_rss(_send, client, body)
+                send.append({'benchmark': 'requests', 'variant': 'send', 'size': size,
+                             'seconds': seconds, 'peak_rss': peak})
+                code = Transfer.objects.latest('created_at').unique_code
+                seconds, peak = measure_rss(_receive, client, code)
+                receive.append({'benchmark': 'requests', 'variant': 'receive', 'size': size,
+                                'seconds': seconds, 'peak_rss': peak})
+            rows += [_median_row(send), _median_row(receive)]
+    return rows
@@ -0,0 +1,85 @@
+"""Collision-free allocation of 6-digit transfer codes.
+
+Codes come from a shared counter pushed through a keyed Feistel permutation of
+0..999999, so consecutive transfers get unrelated-looking codes and no code is
+handed out twice until the whole space is used. The permutation key is drawn
+from os.urandom once and stored with the counter. After the counter runs out,
+codes released by the expiry sweeper are reused, oldest first. Each allocation
+is a constant number of queries, however full the table is.
+"""
+import hashlib
+import hmac
+import os
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+CODE_SPACE = 10 ** 6
+_HALF = 1000
+_ROUNDS = 4
+
+
+class CodeSpaceExhausted(Exception):
+    pass
+
+
+def permute_code(counter, key):
+    """Maps counter (0..999999) to a unique code using a 4-round Feistel network over Z_1000 x Z_1000."""
+    left, right = divmod(counter, _HALF)
+    for round_index in range(_ROUNDS):
+        digest = hmac.new(key, f'{round_index}:{right}'.encode(), hashlib.sha256).digest()
+        left, right = right, (left + int.from_bytes(digest[:8], 'big')) % _HALF
+    return f'{left * _HALF + right:06d}'
+
+
+def _next_counter():
+    from .models import CodeAllocator
+
+    allocator, _ = _get_allocator(CodeAllocator)
+    with transaction.atomic():
+        # The UPDATE takes the row lock, so the value read back below is ours alone
+        CodeAllocator.objects.filter(pk=allocator.pk).update(counter=F('counter') + 1)
+        allocator.refresh_from_db(fields=['counter'])
+    return allocator.counter - 1, bytes(allocator.key)
+
+
+def _get_allocator(model):
+    try:
+        return model.objects.get_or_create(pk=1, defaults={'key': os.urandom(32)})
+    except IntegrityError:
+        return model.objects.get(pk=1), False
+
+
+def _pop_recycled_code():
+    from .models import RecycledCode
+
+    while True:
+        recycled = RecycledCode.objects.order_by('released_at').first()
+        if recycled is None:
+            return None
+        # Only the allocator whose DELETE actually removed the row gets the code
+        deleted, _ = RecycledCode.objects.filter(pk=recycled.pk).delete()
+        if deleted:
+            return recycled.code
+
+
+def allocate_code():
+    from .models import Transfer
+
+    while True:
+        counter, key = _next_counter()
+        if counter < CODE_SPACE:
+            code = permute_code(counter, key)
+        else:
+            code = _pop_recycled_code()
+            if code is None:
+                raise CodeSpaceExhausted("All 6-digit transfer codes are in use.")
+        # Only rows created with the old random codes can clash; skip those
+        if not Transfer.objects.filter(unique_code=code).exists():
+            return code
+
+
+def recycle_codes(codes):
+    from .models import RecycledCode
+
+    RecycledCode.objects.bulk_create([RecycledCode(code=code) for code in codes], ignore_conflicts=True)
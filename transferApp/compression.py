@@ -0,0 +1,166 @@
+"""Compression stage inside the chunked container.
+
+With COMPRESSION set ('zlib', or 'zstd' with the zstandard package installed),
+uploads that aren't compressed already are compressed before they are encrypted.
+The codec is recorded in the container header's flags, which every frame
+authenticates, and decrypt_stream undoes it transparently. A compressed
+container's plaintext size can't be derived from its length, so it is served
+without Content-Length or Range support, like legacy blobs; resumable uploads,
+whose chunks land at fixed offsets, are never compressed.
+
+Whether to compress is decided from the start of the upload: JPEG, PNG, WebP and
+other compressed formats are recognised by their first bytes or declared MIME
+type, and anything else (encrypted archives, unknown binaries...) by a quick
+trial compression of the first chunk. Those are stored as they are.
+"""
+import zlib
+
+from cryptography.fernet import InvalidToken
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FLAG_ZLIB = 0x01
+FLAG_ZSTD = 0x02
+CODEC_FLAGS = {'zlib': FLAG_ZLIB, 'zstd': FLAG_ZSTD}
+# Levels used without COMPRESSION_LEVEL. zlib's own default (6) compresses text ~4x
+# slower than level 1 for ~25% less saved, which would make it the upload bottleneck
+DEFAULT_LEVELS = {'zlib': 1, 'zstd': 3}
+COMPRESSION_FLAGS = FLAG_ZLIB | FLAG_ZSTD
+# Leading bytes of an upload the sniff looks at (one container frame)
+SAMPLE_SIZE = 64 * 1024
+# Samples must shrink at least this much in the trial compression to be worth compressing
+COMPRESSIBLE_RATIO = 0.9
+# Largest piece decompression hands out at once, however well the data compressed
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes of formats that are compressed already
+COMPRESSED_SIGNATURES = (
+    b'\xff\xd8\xff',  # JPEG
+    b'\x89PNG\r\n\x1a\n',
+    b'GIF8',
+    b'PK\x03\x04',  # ZIP, and the DOCX/XLSX/ODT/EPUB built on it
+    b'\x1f\x8b',  # gzip
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'BZh',
+    b'\xfd7zXZ\x00',
+    b'7z\xbc\xaf\x27\x1c',
+    b'Rar!',
+    b'\x1a\x45\xdf\xa3',  # Matroska / WebM
+    b'ID3',  # MP3
+    b'OggS',
+    b'fLaC',
+)
+COMPRESSED_TYPES = {
+    'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/avif', 'image/heic', 'image/heif',
+    'application/zip', 'application/gzip', 'application/zstd', 'application/x-bzip2', 'application/x-xz',
+    'application/x-7z-compressed', 'application/vnd.rar',
+}
+COMPRESSED_TYPE_PREFIXES = ('video/', 'audio/')
+
+
+def is_compressed(head, content_type=''):
+    """True if the leading bytes `head` or the MIME type say the data is compressed already."""
+    if head.startswith(COMPRESSED_SIGNATURES):
+        return True
+    # RIFF....WEBP (but not WAV or AVI), and ISO media (MP4, MOV, HEIC, AVIF): ....ftyp
+    if (head[:4] == b'RIFF' and head[8:12] == b'WEBP') or head[4:8] == b'ftyp':
+        return True
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return content_type in COMPRESSED_TYPES or content_type.startswith(COMPRESSED_TYPE_PREFIXES)
+
+
+def is_compressible(sample):
+    """True if a fast trial compression of `sample` saves enough to be worth it."""
+    sample = sample[:SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) <= len(sample) * COMPRESSIBLE_RATIO
+
+
+def choose_codec(head, content_type=''):
+    """Returns the codec to store an upload starting with `head` with, or '' to store it as is.
+
+    `head` should be the first SAMPLE_SIZE bytes (or all of a shorter upload).
+    """
+    codec = settings.COMPRESSION
+    if not codec or is_compressed(head, content_type) or not is_compressible(head):
+        return ''
+    return codec
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise ImproperlyConfigured("zstd compression requires zstandard (pip install zstandard).")
+
+
+def compressor(codec):
+    """Returns a streaming compressor (compress() then flush()) for `codec`."""
+    if codec not in CODEC_FLAGS:
+        raise ImproperlyConfigured(f"Unsupported COMPRESSION codec: {codec}")
+    level = settings.COMPRESSION_LEVEL if settings.COMPRESSION_LEVEL is not None else DEFAULT_LEVELS[codec]
+    if codec == 'zlib':
+        return zlib.compressobj(level)
+    _require_zstd()
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+class _ChunkReader:
+    """Minimal file object over an iterator of bytes, for zstandard's stream_reader."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b''
+                return b''
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _zlib_chunks(chunks):
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk:
+            piece = decompressor.decompress(chunk, DECOMPRESS_CHUNK_SIZE)
+            if piece:
+                yield piece
+            chunk = decompressor.unconsumed_tail
+    if not decompressor.eof:
+        raise InvalidToken
+
+
+def _zstd_chunks(chunks):
+    _require_zstd()
+    reader = zstandard.ZstdDecompressor().stream_reader(_ChunkReader(chunks))
+    while True:
+        piece = reader.read(DECOMPRESS_CHUNK_SIZE)
+        if not piece:
+            return
+        yield piece
+
+
+def decompress_chunks(chunks, flags):
+    """Yields the plaintext of the decrypted frames `chunks` of a container with header `flags`.
+
+    Raises InvalidToken if the compressed stream is malformed or cut short.
+    """
+    try:
+        if flags & FLAG_ZSTD:
+            yield from _zstd_chunks(chunks)
+        else:
+            yield from _zlib_chunks(chunks)
+    except zlib.error as e:
+        raise InvalidToken from e
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise InvalidToken from e
+        raise
@@ -0,0 +1,37 @@
+"""Per-connection database tuning (see the DATABASES profile in settings).
+
+SQLite only allows one writer at a time. In its default rollback-journal mode a
+writer also blocks every reader, and concurrent sends hit "database is locked".
+tune_sqlite() runs on every new connection and switches to WAL, where readers
+never block the writer. It makes writers wait for the lock (busy_timeout) rather
+than fail. It also syncs only at checkpoints, which is still crash-safe in WAL
+mode. Settings also open transactions with BEGIN IMMEDIATE, so a transaction
+that reads then writes takes the write lock up front. Otherwise upgrading its
+read lock could fail without waiting.
+
+journal_mode=WAL is persistent: SQLite records it in the database file's header
+(bytes 18-19) and keeps the -wal and -shm files next to it, so the first
+connection rewrites the file even if nothing else is written. The development
+db.sqlite3 kept in git is converted the first time the server or a management
+command opens it, and git then reports it as modified; that change is expected
+and harmless. Point PIXELOCK_DB_NAME at a copy before opening any database file
+that must stay byte-for-byte unchanged.
+"""
+from django.conf import settings
+
+
+def sqlite_pragmas():
+    return (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f'PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}',
+    )
+
+
+def tune_sqlite(sender, connection, **kwargs):
+    """connection_created receiver."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
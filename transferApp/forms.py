@@ -1,25 +1,67 @@
 from django import forms
 
+# 1GB limit from image
+MAX_FILE_SIZE = 1 * 1024 * 1024 * 1024
+
+# Files one transfer (one code) can carry. Django refuses to parse bodies with more
+# than DATA_UPLOAD_MAX_NUMBER_FILES files, so that setting must be at least this.
+MAX_TRANSFER_ITEMS = 500
+TOO_MANY_FILES = f"Too many files. Send at most {MAX_TRANSFER_ITEMS} at once."
+
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+class MultipleFileField(forms.FileField):
+    """FileField that accepts several files and cleans to a list (empty if none were sent)."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        clean_one = super().clean
+        if isinstance(data, (list, tuple)):
+            return [clean_one(item, initial) for item in data if item]
+        return [clean_one(data, initial)] if data else []
+
 class SendForm(forms.Form):
-    file = forms.FileField(required=False, widget=forms.FileInput(attrs={'class': 'hidden-upload-input'}))
-    text_content = forms.CharField(widget=forms.Textarea, required=False)
+    file = MultipleFileField(required=False, widget=MultipleFileInput(attrs={'class': 'hidden-upload-input'}))
+    text_content = forms.CharField(
+        widget=forms.Textarea(attrs={'rows': 8, 'class': 'form-control bg-black text-white border-secondary'}),
+        required=False,
+    )
     password = forms.CharField(widget=forms.PasswordInput, required=False)
     # Toggle in image 4 suggests option to use 6-digit code vs just a link
     use_6_digit_code = forms.BooleanField(initial=True, required=False)
 
     def clean(self):
         cleaned_data = super().clean()
-        file = cleaned_data.get("file")
+        files = cleaned_data.get("file")
         text = cleaned_data.get("text_content")
 
-        if not file and not text:
+        if not files and not text:
             raise forms.ValidationError("Please provide either a file or text content.")
+        if files and text:
+            raise forms.ValidationError("Send either files or text, not both.")
         
-        if file and file.size > 1 * 1024 * 1024 * 1024: # 1GB limit from image
+        if files and sum(file.size for file in files) > MAX_FILE_SIZE:
              raise forms.ValidationError("File too large. Max size is 1GB.")
+        if files and len(files) > MAX_TRANSFER_ITEMS:
+             raise forms.ValidationError(TOO_MANY_FILES)
         return cleaned_data
 
 class ReceiveForm(forms.Form):
     # Image 3: "Enter code or paste link..."
     code_or_link = forms.CharField(max_length=255, required=True)
     password = forms.CharField(widget=forms.PasswordInput, required=False)
+
+
+class UploadInitForm(forms.Form):
+    # Starts a resumable upload; the chunks are sent separately
+    filename = forms.CharField(max_length=255)
+    size = forms.IntegerField(min_value=1, max_value=MAX_FILE_SIZE,
+                              error_messages={'max_value': "File too large. Max size is 1GB."})
+
+
+class UploadFinalizeForm(forms.Form):
+    password = forms.CharField(required=False)
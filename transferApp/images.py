@@ -0,0 +1,167 @@
+"""Image stage for freshly encrypted uploads.
+
+Photos can have their metadata (EXIF/GPS, XMP, IPTC, comments) stripped, be re-encoded
+to WebP or AVIF, and get a small thumbnail encrypted under the same data key and
+stored next to the main blob. Uploads are encrypted while they stream in, so the
+stage decrypts the stored blob into memory, works on it with Pillow and only ever
+writes ciphertext back. Non-images, animations and files over IMAGE_MAX_BYTES are
+left as uploaded. See the IMAGE_* settings.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .compression import SAMPLE_SIZE, choose_codec
+from .metrics import timed
+from .storage import create_blob
+from .utils import decrypt_stream, encrypt_stream
+
+# Formats the stage decodes; everything else is stored untouched. MPO is the multi-picture
+# JPEG many phone cameras write: its primary frame is kept and saved as a plain JPEG
+IMAGE_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'TIFF', 'BMP', 'AVIF'}
+# IMAGE_REENCODE_FORMAT values -> (Pillow format, file extension)
+REENCODE_FORMATS = {'webp': ('WEBP', '.webp'), 'avif': ('AVIF', '.avif')}
+# Image.info entries that survive stripping: they affect how pixels look, not who/where
+KEEP_INFO = {'icc_profile', 'dpi', 'transparency', 'gamma'}
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_CONTENT_TYPE = 'image/webp'
+EXIF_ORIENTATION = 0x0112
+
+
+def reencoded_filename(filename, fmt):
+    """Swaps the extension of `filename` for the one a re-encode to `fmt` produced ('' keeps it)."""
+    if fmt not in REENCODE_FORMATS:
+        return filename
+    return os.path.splitext(filename)[0] + REENCODE_FORMATS[fmt][1]
+
+
+def _load(storage, name, key):
+    with storage.open(name, 'rb') as encrypted:
+        data = b''.join(decrypt_stream(encrypted, key))
+    try:
+        image = Image.open(BytesIO(data))
+        if image.format not in IMAGE_FORMATS or (image.format != 'MPO' and getattr(image, 'n_frames', 1) > 1):
+            return None
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return None
+    return image
+
+
+def _encode(image, fmt, **params):
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def _rewrite(image, strip, target):
+    """Returns the new encoded bytes of `image`, re-encoded to `target` and/or stripped."""
+    params = {}
+    if image.info.get('icc_profile'):
+        params['icc_profile'] = image.info['icc_profile']
+
+    out = image
+    if strip:
+        # Dropping EXIF drops the orientation tag too, so bake it into the pixels first
+        if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+            out = ImageOps.exif_transpose(image)
+        if hasattr(out, 'tag_v2'):
+            # Pillow's TIFF writer copies XMP, IPTC and Photoshop blocks from the source
+            # file's tags whatever info says; a copy of the pixels carries no tags at all
+            out = out.copy()
+            if 'dpi' in image.info:
+                params['dpi'] = image.info['dpi']
+        out.info = {name: value for name, value in out.info.items() if name in KEEP_INFO}
+    elif image.info.get('exif'):
+        params['exif'] = image.info['exif']
+
+    if target:
+        return _encode(out, REENCODE_FORMATS[target][0], quality=settings.IMAGE_QUALITY, **params)
+    # The MPO's other frames (and the APP2 index pointing at them) are dropped
+    fmt = 'JPEG' if image.format == 'MPO' else image.format
+    if fmt == 'JPEG':
+        if out is image and image.format == 'JPEG':
+            # Same pixels, same quantization tables: no generation loss for a metadata-only strip
+            params.update(quality='keep', subsampling='keep')
+        else:
+            params['quality'] = settings.IMAGE_QUALITY
+    return _encode(out, fmt, **params)
+
+
+def _thumbnail(image, size):
+    thumb = ImageOps.exif_transpose(image)
+    if thumb.mode not in ('RGB', 'RGBA'):
+        thumb = thumb.convert('RGBA' if 'A' in thumb.getbands() else 'RGB')
+    thumb.thumbnail((size, size))
+    return _encode(thumb, THUMBNAIL_FORMAT, quality=70)
+
+
+def _save_encrypted(storage, name, key, data):
+    blob, name = create_blob(storage, name)
+    with blob:
+        # A stripped TIFF or BMP is as compressible as the upload was; JPEG/WebP/AVIF are skipped
+        for block in encrypt_stream(BytesIO(data), key, codec=choose_codec(data[:SAMPLE_SIZE])):
+            blob.write(block)
+    return name
+
+
+def process_image(storage, name, key, filename, size, thumbnail=False):
+    """Runs the image stage over the encrypted blob `name` (plaintext `size` bytes).
+
+    Returns None when there is nothing to do or the file isn't a supported image.
+    Otherwise returns a dict with the blob's 'name' and plaintext 'size' (a new blob
+    replaces the old one when the image was rewritten), the 'filename' to show, the
+    re-encode 'format' ('' if kept) and the 'thumbnail' blob name ('' if none).
+    """
+    strip = settings.IMAGE_STRIP_METADATA
+    target = settings.IMAGE_REENCODE_FORMAT.lower()
+    thumbnail_size = settings.IMAGE_THUMBNAIL_SIZE if thumbnail else 0
+    if target and target not in REENCODE_FORMATS:
+        raise ValueError(f"Unsupported IMAGE_REENCODE_FORMAT: {target}")
+    if not (strip or target or thumbnail_size) or size > settings.IMAGE_MAX_BYTES:
+        return None
+
+    with timed('image', size):
+        image = _load(storage, name, key)
+        if image is None:
+            return None
+
+        result = {'name': name, 'size': size, 'filename': filename, 'format': '', 'thumbnail': ''}
+        if thumbnail_size:
+            result['thumbnail'] = _save_encrypted(
+                storage, os.path.splitext(name)[0] + '.thumb.enc', key, _thumbnail(image, thumbnail_size),
+            )
+        if strip or target:
+            data = _rewrite(image, strip, target)
+            result.update(
+                name=_save_encrypted(storage, name, key, data), size=len(data),
+                filename=reencoded_filename(filename, target), format=target,
+            )
+            storage.delete(name)
+        return result
+
+
+def process_upload(uploaded_file, thumbnail=False):
+    """Runs the image stage over an EncryptedUploadedFile, updating it in place.
+
+    Afterwards `storage_name`, `size` and `name` describe the stored (possibly
+    rewritten) image and `image_format`/`thumbnail_name` are set. Returns True if
+    the upload was an image the stage handled.
+    """
+    result = process_image(
+        uploaded_file.storage, uploaded_file.storage_name, uploaded_file.key,
+        uploaded_file.name, uploaded_file.size, thumbnail=thumbnail,
+    )
+    if result is None:
+        return False
+    if result['name'] != uploaded_file.storage_name:
+        uploaded_file.close()
+        uploaded_file.file = uploaded_file.storage.open(result['name'], 'rb')
+        uploaded_file.storage_name = result['name']
+    uploaded_file.size = result['size']
+    uploaded_file.name = result['filename']
+    uploaded_file.image_format = result['format']
+    uploaded_file.thumbnail_name = result['thumbnail']
+    return True
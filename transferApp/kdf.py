@@ -0,0 +1,113 @@
+"""Password key derivation for transfers.
+
+One slow KDF pass produces a master secret; HKDF then splits it into the
+encryption key and a password verifier, so checking a password and deriving the
+key no longer cost two slow hashes. The parameters used are stored on each
+Transfer, so profiles can be tuned without breaking existing transfers.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from django.conf import settings
+
+from .metrics import timed
+
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # cryptography < 44
+    Argon2id = None
+
+PROFILES = {
+    'pbkdf2': {'algorithm': 'pbkdf2-sha256', 'iterations': 480000},
+    'scrypt': {'algorithm': 'scrypt', 'n': 2 ** 15, 'r': 8, 'p': 1},
+    'argon2id': {'algorithm': 'argon2id', 'iterations': 3, 'lanes': 4, 'memory_cost': 64 * 1024},
+}
+
+
+class KdfBusy(Exception):
+    """Raised when too many derivations are already running or queued."""
+
+
+def available_profiles():
+    return [name for name, params in PROFILES.items()
+            if params['algorithm'] != 'argon2id' or Argon2id is not None]
+
+
+def _master_secret(password, salt, params):
+    algorithm = params['algorithm']
+    if algorithm == 'pbkdf2-sha256':
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=params['iterations'])
+    elif algorithm == 'scrypt':
+        kdf = Scrypt(salt=salt, length=32, n=params['n'], r=params['r'], p=params['p'])
+    elif algorithm == 'argon2id' and Argon2id is not None:
+        kdf = Argon2id(salt=salt, length=32, iterations=params['iterations'],
+                       lanes=params['lanes'], memory_cost=params['memory_cost'])
+    else:
+        raise ValueError(f"Unsupported KDF: {algorithm}")
+    return kdf.derive(password.encode())
+
+
+def _split(master):
+    okm = HKDF(algorithm=hashes.SHA256(), length=64, salt=None, info=b'pixelock password v1').derive(master)
+    key = base64.urlsafe_b64encode(okm[:32])
+    verifier = base64.b64encode(hashlib.sha256(okm[32:]).digest()).decode()
+    return key, verifier
+
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            workers = settings.KDF_MAX_WORKERS
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kdf')
+            # Running plus waiting derivations; anything beyond this fails fast
+            _slots = threading.BoundedSemaphore(workers + settings.KDF_MAX_QUEUE)
+        return _executor, _slots
+
+
+def run_kdf(func, *args):
+    """Runs a slow derivation on the shared bounded pool and waits for the result."""
+    executor, slots = _get_executor()
+    if not slots.acquire(blocking=False):
+        raise KdfBusy
+    try:
+        # Includes time spent queued behind other derivations
+        with timed('kdf'):
+            return executor.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+def derive_password_secrets(password, salt=None, params=None):
+    """Returns (encryption_key, verifier, salt, params) for `password`.
+
+    With no params the configured KDF_PROFILE is used and a new salt is drawn.
+    """
+    if params is None:
+        params = dict(PROFILES[settings.KDF_PROFILE])
+    if salt is None:
+        salt = os.urandom(16)
+    salt = bytes(salt)
+    key, verifier = _split(run_kdf(_master_secret, password, salt, params))
+    return key, verifier, salt, params
+
+
+def verify_password(password, salt, params, expected_verifier):
+    """Returns the encryption key if `password` matches, otherwise None."""
+    key, verifier, _, _ = derive_password_secrets(password, salt, params)
+    if hmac.compare_digest(verifier, expected_verifier):
+        return key
+    return None
@@ -0,0 +1,117 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transferApp.benchmarks import BENCHMARKS, MB, environment
+
+# --sizes shortcuts; 'full' spans 10KB to 1GB and needs a few GB of RAM for decrypt_file_data
+SIZE_PRESETS = {
+    'quick': '10KB,1MB,16MB,64MB',
+    'full': '10KB,100KB,1MB,10MB,100MB,1GB',
+}
+
+
+def parse_size(value):
+    units = {'kb': 1024, 'mb': MB, 'gb': 1024 * MB}
+    value = value.strip().lower()
+    for suffix, factor in units.items():
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+def row_key(row):
+    return row['benchmark'], row.get('variant', ''), row.get('size')
+
+
+class Command(BaseCommand):
+    help = "Runs the crypto/transfer micro-benchmarks and prints one row per measurement."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+        parser.add_argument('--sizes', default='quick',
+                            help=f"Comma separated payload sizes, e.g. 10KB,1MB,1GB, or one of {', '.join(SIZE_PRESETS)}")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the benchmarks that draw random values")
+        parser.add_argument('--json', metavar='PATH', help="Also write the rows and the environment to PATH as JSON")
+        parser.add_argument('--compare', metavar='PATH', help="Compare the timings with an earlier --json file")
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help="Slowdown in percent reported as a regression by --compare")
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+        sizes = SIZE_PRESETS.get(options['sizes'], options['sizes'])
+        sizes = [parse_size(size) for size in sizes.split(',') if size]
+        baseline = self.load(options['compare']) if options['compare'] else None
+
+        random.seed(options['seed'])
+        rows = []
+        for name in names:
+            for row in BENCHMARKS[name](sizes):
+                rows.append(row)
+                self.stdout.write(self.format_row(row))
+
+        if options['json']:
+            with open(options['json'], 'w') as out:
+                json.dump({'environment': environment(), 'sizes': sizes, 'results': rows}, out, indent=2)
+                out.write('\n')
+        if baseline is not None:
+            self.compare(baseline, rows, options['threshold'])
+
+    def load(self, path):
+        try:
+            with open(path) as results:
+                return json.load(results)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Can't read {path}: {e}")
+
+    def compare(self, baseline, rows, threshold):
+        before = {row_key(row): row for row in baseline['results']}
+        commit = baseline.get('environment', {}).get('commit') or 'baseline'
+        self.stdout.write(f"\nCompared with {commit[:12]}:")
+        regressions = 0
+        for row in rows:
+            old = before.get(row_key(row))
+            if not old or not old.get('seconds') or row.get('seconds') is None:
+                continue
+            change = (row['seconds'] / old['seconds'] - 1) * 100
+            regressed = change > threshold
+            regressions += regressed
+            size = f"{row['size'] / MB:.2f} MB" if row.get('size') is not None else ''
+            self.stdout.write(
+                f"{row['benchmark']:<10}  {row.get('variant', ''):<18}  {size:>12}  "
+                f"{old['seconds'] * 1000:>10.3f} -> {row['seconds'] * 1000:>10.3f} ms  {change:>+7.1f}%"
+                + ('  REGRESSION' if regressed else '')
+            )
+        self.stdout.write(f"{regressions} regression(s) over {threshold:g}%")
+
+    def format_row(self, row):
+        parts = [f"{row['benchmark']:<10}", f"{row.get('variant', ''):<18}"]
+        if row.get('size') is not None:
+            parts.append(f"{row['size'] / MB:>9.2f} MB")
+        if row.get('seconds') is not None:
+            parts.append(f"{row['seconds'] * 1000:>10.3f} ms")
+        if row.get('bytes') is not None:
+            parts.append(f"{row['bytes']:>8} B")
+        if row.get('peak_bytes') is not None:
+            parts.append(f"peak {row['peak_bytes'] / MB:>8.2f} MB")
+        if row.get('peak_rss') is not None:
+            parts.append(f"rss +{row['peak_rss'] / MB:>8.2f} MB")
+        if row.get('attempts') is not None:
+            parts.append(f"{row['attempts']:>6.2f} attempts")
+        if row.get('ops_per_s') is not None:
+            parts.append(f"{row['ops_per_s']:>8.0f} ops/s")
+        if row.get('errors') is not None:
+            parts.append(f"{row['errors']:>5} errors")
+        if row.get('mb_per_s'):
+            parts.append(f"{row['mb_per_s']:>8.1f} MB/s")
+        if row.get('decrypt_mb_per_s'):
+            parts.append(f"decrypt {row['decrypt_mb_per_s']:>8.1f} MB/s")
+        if row.get('ratio') is not None:
+            parts.append(f"ratio {row['ratio']:.3f}")
+        if row.get('speedup') is not None:
+            parts.append(f"x{row['speedup']:.2f}")
+        return '  '.join(parts)
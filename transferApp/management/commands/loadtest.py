@@ -0,0 +1,105 @@
+import http.cookiejar
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transferApp.management.commands.benchmark import parse_size
+
+
+class Client:
+    """Minimal cookie + CSRF aware HTTP client for talking to a running server."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.open('GET', '/send/').read()
+
+    @property
+    def csrf_token(self):
+        return next((c.value for c in self.cookies if c.name == 'csrftoken'), '')
+
+    def open(self, method, path, data=None, content_type=None):
+        if isinstance(data, dict):
+            data = urllib.parse.urlencode(data).encode()
+            content_type = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header('Referer', self.base_url + '/')
+        if method != 'GET':
+            request.add_header('X-CSRFToken', self.csrf_token)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        return self.opener.open(request, timeout=300)
+
+
+class Command(BaseCommand):
+    help = (
+        "Opens many concurrent, deliberately slow downloads against a running server. "
+        "Run it once against the WSGI server (manage.py runserver / gunicorn) and once "
+        "against the ASGI app (e.g. uvicorn pixelockproject.asgi:application) to compare. "
+        "Start the server with PIXELOCK_RATELIMIT_BACKEND=transferApp.ratelimit.DummyBackend, "
+        "or the receive rate limit will turn most downloads into 429s."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help="e.g. http://127.0.0.1:8000")
+        parser.add_argument('--size', default='8MB', help="Size of the transfer to download")
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--read-delay', type=float, default=0.01,
+                            help="Seconds each client sleeps per 64KB read, to simulate slow links")
+
+    def handle(self, *args, **options):
+        client = Client(options['base_url'])
+        code = self.create_transfer(client, parse_size(options['size']))
+        self.stdout.write(f"Transfer {code} ready, starting {options['concurrency']} downloads")
+
+        ttfbs, failures = [], []
+        lock = threading.Lock()
+
+        def download(_):
+            try:
+                worker = Client(options['base_url'])
+                start = time.perf_counter()
+                response = worker.open('POST', '/receive/', {'code_or_link': code})
+                first = response.read(64 * 1024)
+                ttfb = time.perf_counter() - start
+                while first:
+                    time.sleep(options['read_delay'])
+                    first = response.read(64 * 1024)
+                with lock:
+                    ttfbs.append(ttfb)
+            except Exception as e:
+                with lock:
+                    failures.append(repr(e))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(download, range(options['concurrency'])))
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"completed {len(ttfbs)}  failed {len(failures)}  wall {elapsed:.2f}s")
+        if ttfbs:
+            ttfbs.sort()
+            p95 = ttfbs[min(len(ttfbs) - 1, int(len(ttfbs) * 0.95))]
+            self.stdout.write(f"ttfb p50 {statistics.median(ttfbs) * 1000:.1f} ms  p95 {p95 * 1000:.1f} ms")
+        for failure in failures[:5]:
+            self.stdout.write(f"  {failure}")
+
+    def create_transfer(self, client, size):
+        init = json.load(client.open('POST', '/send/uploads/', {'filename': 'loadtest.bin', 'size': size}))
+        if not init.get('success'):
+            raise CommandError(f"Upload init failed: {init}")
+        upload_id, chunk_size = init['upload_id'], init['chunk_size']
+        for index in range(init['chunk_count']):
+            length = min(chunk_size, size - index * chunk_size)
+            client.open('PUT', f'/send/uploads/{upload_id}/chunks/{index}/', os.urandom(length),
+                        'application/octet-stream').read()
+        result = json.load(client.open('POST', f'/send/uploads/{upload_id}/finalize/', {}))
+        return result['code']
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from transferApp.sweeper import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Deletes expired transfers, abandoned resumable uploads, their encrypted blobs and old history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        result = purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Purged {result['transfers']} transfers and {result['uploads']} uploads "
+            f"({result['history']} history entries), "
+            f"reclaimed {result['bytes_reclaimed']} bytes in {result['seconds']:.2f}s"
+        )
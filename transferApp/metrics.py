@@ -0,0 +1,170 @@
+"""Per-stage timing of the hot paths, exposed as Server-Timing and Prometheus metrics.
+
+Wrap a stage in `timed('encrypt', nbytes)` (a context manager and decorator) or
+record a measured one with observe(). Each stage feeds two process-wide
+histograms, one of latency and one of bytes processed, which metrics_view
+renders in the Prometheus text format. It also adds to the current request's
+timings, which ServerTimingMiddleware turns into a Server-Timing header and a
+structured log line. Downloads decrypt after the view has returned, so their
+'storage_read' and 'decrypt' stages reach the histograms but not the header.
+
+Metrics are kept in memory per process; scrape every worker, or run one.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import ContextDecorator
+
+# Seconds: 1ms .. 60s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bytes: 1KB .. 1GB in powers of 4
+BYTES_BUCKETS = tuple(1024 * 4 ** n for n in range(11))
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+
+    def snapshot(self, *label_values):
+        """Returns (count, sum) for one label set."""
+        with self._lock:
+            series = self._series.get(label_values)
+            return (sum(series['counts']), series['sum']) if series else (0, 0.0)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, data in series:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), data['counts']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {data["sum"]!r}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+STAGE_SECONDS = Histogram('pixelock_stage_seconds', "Time spent in each hot-path stage.", ('stage',), LATENCY_BUCKETS)
+STAGE_BYTES = Histogram('pixelock_stage_bytes', "Bytes processed by each hot-path stage.", ('stage',), BYTES_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    'pixelock_request_seconds', "Time until the response is returned, per view.", ('view', 'method'), LATENCY_BUCKETS,
+)
+HISTOGRAMS = (STAGE_SECONDS, STAGE_BYTES, REQUEST_SECONDS)
+
+# stage -> [seconds, bytes] for the request being handled (None outside of one)
+_request_timings = contextvars.ContextVar('pixelock_request_timings', default=None)
+_timings_lock = threading.Lock()
+
+
+def start_request():
+    """Starts collecting stage timings for the current request. Returns (timings, token for finish_request())."""
+    timings = {}
+    return timings, _request_timings.set(timings)
+
+
+def finish_request(token):
+    _request_timings.reset(token)
+
+
+def observe(stage, seconds, nbytes=None):
+    STAGE_SECONDS.observe(seconds, stage)
+    if nbytes is not None:
+        STAGE_BYTES.observe(nbytes, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        with _timings_lock:
+            totals = timings.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += nbytes or 0
+
+
+class timed(ContextDecorator):
+    """Times a block or function as `stage`. Set `.nbytes` inside the block if it isn't known up front."""
+
+    def __init__(self, stage, nbytes=None):
+        self.stage = stage
+        self.nbytes = nbytes
+
+    def _recreate_cm(self):
+        # A fresh timer per call, so a decorated function can run in several threads at once
+        return type(self)(self.stage, self.nbytes)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self._started, self.nbytes)
+        return False
+
+
+class TimedReader:
+    """File proxy that counts time and bytes spent in read() as the 'storage_read' stage, reported on close()."""
+
+    def __init__(self, file):
+        self.file = file
+        self.seconds = 0.0
+        self.nbytes = 0
+        self._reported = False
+
+    def read(self, *args):
+        started = time.perf_counter()
+        data = self.file.read(*args)
+        self.seconds += time.perf_counter() - started
+        self.nbytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def close(self):
+        if not self._reported:
+            self._reported = True
+            observe('storage_read', self.seconds, self.nbytes)
+        self.file.close()
+
+
+def timed_chunks(stage, chunks, reader=None):
+    """Yields from `chunks`, reporting the time spent producing them (minus `reader`'s reads) as `stage`."""
+    seconds = 0.0
+    nbytes = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds += time.perf_counter() - started
+            if chunk is None:
+                return
+            nbytes += len(chunk)
+            yield chunk
+    finally:
+        observe(stage, max(0.0, seconds - (reader.seconds if reader else 0.0)), nbytes)
+
+
+def render_metrics():
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
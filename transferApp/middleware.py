@@ -0,0 +1,62 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+logger = logging.getLogger('pixelock.timing')
+
+
+class ServerTimingMiddleware:
+    """Adds a Server-Timing header with the stages a request spent time in and logs it as JSON.
+
+    Place it first in MIDDLEWARE so 'total' covers the rest of the stack. See metrics.py.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        metrics.REQUEST_SECONDS.observe(total, view, request.method)
+
+        entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, (seconds, _) in sorted(timings.items())]
+        response['Server-Timing'] = ', '.join(entries + [f'total;dur={total * 1000:.2f}'])
+        logger.info(json.dumps({
+            'view': view,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'stages': {
+                stage: {'ms': round(seconds * 1000, 2), 'bytes': nbytes}
+                for stage, (seconds, nbytes) in sorted(timings.items())
+            },
+        }))
+        return response
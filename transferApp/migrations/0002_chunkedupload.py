@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:51
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transferApp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('transfer_id', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('original_filename', models.CharField(max_length=255)),
+                ('file_size', models.PositiveIntegerField(help_text='Plaintext size in bytes')),
+                ('chunk_size', models.PositiveIntegerField(default=4194304)),
+                ('storage_name', models.CharField(max_length=255)),
+                ('data_key', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChunkedUploadPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='transferApp.chunkedupload')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('upload', 'index'), name='unique_upload_part')],
+            },
+        ),
+    ]
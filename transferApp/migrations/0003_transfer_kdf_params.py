@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transferApp', '0002_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='kdf_params',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
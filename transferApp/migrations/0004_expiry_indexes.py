@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transferApp', '0003_transfer_kdf_params'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chunkedupload',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['expires_at'], name='transfer_expires_at_idx'),
+        ),
+    ]
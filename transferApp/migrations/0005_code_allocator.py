@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transferApp', '0004_expiry_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeAllocator',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counter', models.PositiveBigIntegerField(default=0)),
+                ('key', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecycledCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=6, unique=True)),
+                ('released_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='unique_code',
+            field=models.CharField(editable=False, max_length=6, unique=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:14
+
+import django.db.models.deletion
+import transferApp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transferApp', '0005_code_allocator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='encrypted_file',
+            field=models.FileField(blank=True, upload_to=transferApp.models.transfer_file_path),
+        ),
+        migrations.CreateModel(
+            name='TransferItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('encrypted_file', models.FileField(upload_to=transferApp.models.transfer_item_path)),
+                ('original_filename', models.CharField(max_length=255)),
+                ('file_size', models.PositiveBigIntegerField(help_text='Size in bytes')),
+                ('wrapped_key', models.BinaryField()),
+                ('transfer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='transferApp.transfer')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('transfer', 'position'), name='unique_transfer_item_position')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transferApp', '0006_transfer_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='encrypted_text',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transferApp', '0008_chunkedupload_multipart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkeduploadpart',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='chunkeduploadpart',
+            name='pending',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -6,6 +6,7 @@ from django.utils import timezone
 import datetime
 
 def generate_6_digit_code():
+    # Superseded by codes.allocate_code (see Transfer.save); kept because migration 0001 references it
     return ''.join(random.choices(string.digits, k=6))
 
 def transfer_file_path(instance, filename):
@@ -13,21 +14,27 @@ def transfer_file_path(instance, filename):
     return f'temp_transfers/{instance.unique_id}/{filename}'
 
 class Transfer(models.Model):
-    # The 6-digit retrieval code
-    unique_code = models.CharField(max_length=6, default=generate_6_digit_code, unique=True, editable=False)
+    # The 6-digit retrieval code, allocated on first save so unsaved instances don't use one up
+    unique_code = models.CharField(max_length=6, unique=True, editable=False)
     # Internal UUID for robust lookup
     unique_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     
-    # The ENCRYPTED file
-    encrypted_file = models.FileField(upload_to=transfer_file_path)
+    # The ENCRYPTED file (empty when the transfer carries several items, see TransferItem)
+    encrypted_file = models.FileField(upload_to=transfer_file_path, blank=True)
     original_filename = models.CharField(max_length=255)
     file_size = models.PositiveIntegerField(help_text="Size in bytes")
+    # Number of TransferItems; 0 for single-file transfers
+    item_count = models.PositiveIntegerField(default=0)
+    # Ciphertext of a short text message kept in the row itself (no blob); see INLINE_TEXT_MAX_BYTES
+    encrypted_text = models.BinaryField(blank=True, null=True)
     
     # Security
     is_password_protected = models.BooleanField(default=False)
     password_hash = models.CharField(max_length=128, blank=True, null=True)
     # Salt used if password protected
     encryption_salt = models.BinaryField(blank=True, null=True)
+    # KDF algorithm/cost the password was derived with (see kdf.py); empty for older transfers
+    kdf_params = models.JSONField(blank=True, null=True)
     # NOTE: In a stricter E2EE setup, we wouldn't store the key on server at all.
     # For this implementation, we store the key needed to decrypt, unless password protected.
     server_key = models.BinaryField(blank=True, null=True)
@@ -35,15 +42,118 @@ class Transfer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            # Lets the expiry sweeper find expired rows without a full table scan
+            models.Index(fields=['expires_at'], name='transfer_expires_at_idx'),
+        ]
+
     def save(self, *args, **kwargs):
+        if not self.unique_code:
+            from .codes import allocate_code
+            self.unique_code = allocate_code()
         if not self.expires_at:
             # Default expiry: 24 hours
             self.expires_at = timezone.now() + datetime.timedelta(hours=24)
         super().save(*args, **kwargs)
 
+    @property
+    def is_text(self):
+        return self.encrypted_text is not None
+
     @property
     def is_expired(self):
         return timezone.now() > self.expires_at
 
     def __str__(self):
         return f"Transfer {self.unique_code}"
+
+
+def transfer_item_path(instance, filename):
+    # Items live in their transfer's folder, so the expiry sweeper removes them together
+    return transfer_file_path(instance.transfer, filename)
+
+class TransferItem(models.Model):
+    """One file of a multi-file transfer. Its data key is wrapped by the transfer's key."""
+    transfer = models.ForeignKey(Transfer, on_delete=models.CASCADE, related_name='items')
+    position = models.PositiveIntegerField()
+    encrypted_file = models.FileField(upload_to=transfer_item_path)
+    original_filename = models.CharField(max_length=255)
+    file_size = models.PositiveBigIntegerField(help_text="Size in bytes")
+    wrapped_key = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['transfer', 'position'], name='unique_transfer_item_position'),
+        ]
+
+
+# 4MB upload chunks = 64 container frames, so every upload chunk maps onto whole frames
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+class ChunkedUpload(models.Model):
+    """A resumable upload in progress. Becomes a Transfer on finalize."""
+    upload_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # Reused as Transfer.unique_id so the blob is already in its final folder
+    transfer_id = models.UUIDField(default=uuid.uuid4, editable=False)
+    original_filename = models.CharField(max_length=255)
+    file_size = models.PositiveIntegerField(help_text="Plaintext size in bytes")
+    chunk_size = models.PositiveIntegerField(default=UPLOAD_CHUNK_SIZE)
+    # Ciphertext written so far (pre-allocated to the final container size)
+    storage_name = models.CharField(max_length=255)
+    # Random data key; wrapped or copied into the Transfer on finalize
+    data_key = models.BinaryField()
+    # Set on storages with multipart uploads (S3): chunks become parts of this upload, and the
+    # container header is kept here because parts can't be read back before the upload completes
+    multipart_id = models.CharField(max_length=255, blank=True)
+    stream_header = models.BinaryField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @property
+    def chunk_count(self):
+        return -(-self.file_size // self.chunk_size)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.file_size - index * self.chunk_size)
+
+    def missing_ranges(self):
+        """Inclusive [first, last] runs of chunk indexes that haven't arrived yet."""
+        received = set(self.parts.filter(pending=False).values_list('index', flat=True))
+        ranges = []
+        for index in range(self.chunk_count):
+            if index in received:
+                continue
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            else:
+                ranges.append([index, index])
+        return ranges
+
+    def __str__(self):
+        return f"Upload {self.upload_id}"
+
+class ChunkedUploadPart(models.Model):
+    """A chunk of a resumable upload, claimed before its frames are written."""
+    upload = models.ForeignKey(ChunkedUpload, on_delete=models.CASCADE, related_name='parts')
+    index = models.PositiveIntegerField()
+    # Hex SHA-256 of the chunk's plaintext. The chunk's frame nonces are fixed, so only
+    # these exact bytes may ever be encrypted into them ('' for parts from before it was kept)
+    digest = models.CharField(max_length=64, blank=True)
+    # Claimed, but no attempt has finished writing the chunk yet
+    pending = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['upload', 'index'], name='unique_upload_part'),
+        ]
+
+
+class CodeAllocator(models.Model):
+    """Single row holding the transfer code counter and its permutation key (see codes.py)."""
+    counter = models.PositiveBigIntegerField(default=0)
+    key = models.BinaryField()
+
+class RecycledCode(models.Model):
+    """Codes of purged transfers, reused once the counter has gone through the whole code space."""
+    code = models.CharField(max_length=6, unique=True)
+    released_at = models.DateTimeField(auto_now_add=True, db_index=True)
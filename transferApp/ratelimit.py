@@ -0,0 +1,193 @@
+"""Atomic sliding-window rate limiting shared across worker processes.
+
+Counters are kept per (limit, identifier) in fixed windows; a request's count is
+the current window plus the previous one weighted by how much of it still
+overlaps the sliding window. The default backend keeps them in a small SQLite
+file (WAL mode, one UPSERT per hit), so every process on the host sees the same
+counts and concurrent hits can't be lost. LocMemBackend is a single-process
+stand-in with the same interface and DummyBackend turns limiting off.
+"""
+import functools
+import sqlite3
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+
+class Limit:
+    def __init__(self, name, count, seconds):
+        self.name = name
+        self.count = count
+        self.seconds = seconds
+
+    def _key(self, identifier):
+        return f'{self.name}:{identifier}'
+
+    def _weighted(self, current, previous, now):
+        elapsed = (now % self.seconds) / self.seconds
+        return current + previous * (1 - elapsed)
+
+    def hit(self, identifier, now=None):
+        """Counts one event and returns True if the limit is now exceeded."""
+        now = time.time() if now is None else now
+        current, previous = get_backend().hit(self._key(identifier), self.seconds, now)
+        return self._weighted(current, previous, now) > self.count
+
+    def exceeded(self, identifier, now=None):
+        now = time.time() if now is None else now
+        current, previous = get_backend().peek(self._key(identifier), self.seconds, now)
+        return self._weighted(current, previous, now) >= self.count
+
+    def reset(self, identifier):
+        get_backend().reset(self._key(identifier))
+
+    # The backends block (the SQLite one on its file lock), so async views count off the event loop
+    async def ahit(self, identifier, now=None):
+        return await sync_to_async(self.hit, thread_sensitive=False)(identifier, now)
+
+    async def aexceeded(self, identifier, now=None):
+        return await sync_to_async(self.exceeded, thread_sensitive=False)(identifier, now)
+
+
+# Any POST to the receive page, per client IP
+RECEIVE_REQUESTS = Limit('receive', 30, 60)
+# Codes that don't exist: someone guessing codes. Blocks that IP from receiving
+BAD_CODES = Limit('bad-code', 10, 15 * 60)
+# Wrong passwords for one transfer, whoever sends them. Locks that transfer
+BAD_PASSWORDS = Limit('bad-password', 5, 15 * 60)
+
+
+class SQLiteBackend:
+    def __init__(self, path=None):
+        self.path = str(path or settings.RATELIMIT_DB)
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS ratelimit ('
+            ' key TEXT NOT NULL, window INTEGER NOT NULL, count INTEGER NOT NULL,'
+            ' PRIMARY KEY (key, window)) WITHOUT ROWID'
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit: every statement below is its own atomic transaction
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def hit(self, key, seconds, now):
+        window = int(now // seconds)
+        connection = self._connection()
+        current = connection.execute(
+            'INSERT INTO ratelimit (key, window, count) VALUES (?, ?, 1) '
+            'ON CONFLICT (key, window) DO UPDATE SET count = count + 1 RETURNING count',
+            (key, window),
+        ).fetchone()[0]
+        if current == 1:
+            # First hit in a new window: drop this key's windows that can no longer matter
+            connection.execute('DELETE FROM ratelimit WHERE key = ? AND window < ?', (key, window - 1))
+        return current, self._count(key, window - 1)
+
+    def peek(self, key, seconds, now):
+        window = int(now // seconds)
+        return self._count(key, window), self._count(key, window - 1)
+
+    def _count(self, key, window):
+        row = self._connection().execute(
+            'SELECT count FROM ratelimit WHERE key = ? AND window = ?', (key, window)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def reset(self, key):
+        self._connection().execute('DELETE FROM ratelimit WHERE key = ?', (key,))
+
+
+class LocMemBackend:
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, seconds, now):
+        window = int(now // seconds)
+        with self._lock:
+            current = self._counts[key, window] = self._counts.get((key, window), 0) + 1
+            return current, self._counts.get((key, window - 1), 0)
+
+    def peek(self, key, seconds, now):
+        window = int(now // seconds)
+        with self._lock:
+            return self._counts.get((key, window), 0), self._counts.get((key, window - 1), 0)
+
+    def reset(self, key):
+        with self._lock:
+            for stored in [stored for stored in self._counts if stored[0] == key]:
+                del self._counts[stored]
+
+
+class DummyBackend:
+    """Counts nothing; for load tests and local debugging."""
+
+    def hit(self, key, seconds, now):
+        return 0, 0
+
+    def peek(self, key, seconds, now):
+        return 0, 0
+
+    def reset(self, key):
+        pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(settings.RATELIMIT_BACKEND)()
+        return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting in ('RATELIMIT_BACKEND', 'RATELIMIT_DB'):
+        _backend = None
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def too_many_requests(limit):
+    response = HttpResponse("Too many attempts. Please try again later.", status=429)
+    response['Retry-After'] = str(limit.seconds)
+    return response
+
+
+def ratelimit(limit, key=client_ip, methods=('POST',)):
+    """View decorator: counts every matching request against `limit` and answers 429 past it."""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method in methods and await limit.ahit(key(request)):
+                    return too_many_requests(limit)
+                return await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method in methods and limit.hit(key(request)):
+                    return too_many_requests(limit)
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,363 @@
+"""Blob storage helpers and an S3-compatible storage backend.
+
+Transfers and locker files go through Django's Storage API, so STORAGES['default']
+decides where ciphertext lives: FileSystemStorage under MEDIA_ROOT (the default),
+or S3Storage on any S3-compatible service (AWS, MinIO, a moto server...) so that
+several app nodes share the same blobs. See the PIXELOCK_STORAGE settings.
+
+Blobs are written through create_blob(), which streams into local files directly
+and into multipart uploads on S3, sending full parts in parallel while the rest
+of the upload is still arriving. Resumable uploads map their chunks onto the
+parts of one multipart upload (see upload_handlers.start_chunked_upload).
+"""
+import io
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+from .utils import STREAM_CHUNK_SIZE
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+MB = 1024 * 1024
+# S3 rejects multipart parts below 5MB (except the last one)
+MIN_PART_SIZE = 5 * MB
+
+
+def local_path(storage, name):
+    """Returns the filesystem path of `name`, or None if `storage` isn't local."""
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+class _SavingWriter:
+    """Write-only blob for storages without a streaming writer: spools, then saves on close()."""
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self._file = tempfile.SpooledTemporaryFile(max_size=8 * MB)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._file.seek(0)
+        self.storage.save(self.name, File(self._file))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def create_blob(storage, name):
+    """Creates a new blob for `name` (or a free variant of it) and returns (writer, name).
+
+    The writer is a write-only file object; the blob exists once it is closed.
+    """
+    if local_path(storage, name) is None:
+        name = storage.get_available_name(name)
+        open_writer = getattr(storage, 'open_writer', None)
+        return (open_writer(name) if open_writer else _SavingWriter(storage, name)), name
+
+    while True:
+        name = storage.get_available_name(name)
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # 'xb' so two concurrent uploads can't claim the same name
+            return open(path, 'xb'), name
+        except FileExistsError:
+            continue
+
+
+def remove_folder(storage, folder):
+    """Deletes every blob under `folder` and returns how many bytes they held."""
+    path = local_path(storage, folder)
+    if path is None:
+        return storage.delete_prefix(folder.rstrip('/') + '/')
+
+    reclaimed = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    reclaimed += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        return 0
+    shutil.rmtree(path, ignore_errors=True)
+    return reclaimed
+
+
+class S3ObjectFile(io.RawIOBase):
+    """Seekable read-only view of an S3 object; every read is one ranged GET."""
+
+    def __init__(self, storage, name, size):
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        end = min(self._position + len(buffer), self.size)
+        if end <= self._position:
+            return 0
+        data = self.storage.read_range(self.name, self._position, end - 1)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class S3MultipartWriter:
+    """Write-only blob on S3: full parts are uploaded in parallel while writing continues.
+
+    At most `max_concurrency` parts are held in memory. Blobs smaller than one part
+    are sent with a single PUT. A failed upload is aborted so no parts linger.
+    """
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.closed = False
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._in_flight = deque()
+
+    def write(self, data):
+        self._buffer += data
+        part_size = self.storage.part_size
+        while len(self._buffer) >= part_size:
+            self._submit(bytes(self._buffer[:part_size]))
+            del self._buffer[:part_size]
+        return len(data)
+
+    def _submit(self, data):
+        if self._upload_id is None:
+            self._upload_id = self.storage.create_multipart(self.name)
+        while len(self._in_flight) >= self.storage.max_concurrency:
+            self._in_flight.popleft().result()
+        number = len(self._parts) + 1
+        future = self.storage.executor.submit(self.storage.upload_part, self.name, self._upload_id, number, data)
+        self._parts.append((number, future))
+        self._in_flight.append(future)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._upload_id is None:
+                self.storage.put_object(self.name, bytes(self._buffer))
+                return
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+            parts = [{'PartNumber': number, 'ETag': future.result()} for number, future in self._parts]
+            self.storage.complete_multipart(self.name, self._upload_id, parts)
+        except BaseException:
+            if self._upload_id is not None:
+                self.storage.abort_multipart(self.name, self._upload_id)
+            raise
+        finally:
+            self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@deconstructible
+class S3Storage(Storage):
+    """Storage on an S3-compatible bucket (needs boto3).
+
+    Credentials come from boto3's usual chain (AWS_ACCESS_KEY_ID... or a profile).
+    `endpoint_url` points it at MinIO or another S3-compatible service. Parts are
+    `part_size` bytes, a multiple of the container chunk size so resumable upload
+    chunks line up with whole frames, and up to `max_concurrency` go at once.
+    """
+
+    def __init__(self, bucket_name='pixelock', endpoint_url=None, region_name=None, location='',
+                 part_size=8 * MB, max_concurrency=4, read_buffer_size=8 * MB):
+        if boto3 is None:
+            raise ImproperlyConfigured("S3Storage requires boto3 (pip install boto3).")
+        if part_size < MIN_PART_SIZE or part_size % STREAM_CHUNK_SIZE:
+            raise ImproperlyConfigured(
+                f"S3 part_size must be at least {MIN_PART_SIZE} bytes and a multiple of {STREAM_CHUNK_SIZE}."
+            )
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self.location = location.strip('/')
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.read_buffer_size = read_buffer_size
+        self._client = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 clients are thread-safe; one per storage keeps its connection pool warm
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client(
+                    's3', endpoint_url=self.endpoint_url, region_name=self.region_name,
+                    config=Config(max_pool_connections=max(10, self.max_concurrency * 2)),
+                )
+            return self._client
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='pixelock-s3')
+            return self._executor
+
+    def _key(self, name):
+        name = name.replace('\\', '/').lstrip('/')
+        return f'{self.location}/{name}' if self.location else name
+
+    def _is_missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    # Storage API
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError("S3Storage files are read-only; write blobs with create_blob().")
+        raw = S3ObjectFile(self, name, self.size(name))
+        return File(io.BufferedReader(raw, buffer_size=self.read_buffer_size), name)
+
+    def _save(self, name, content):
+        with self.open_writer(name) as writer:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks(self.part_size):
+                writer.write(chunk)
+        return name
+
+    def open_writer(self, name):
+        return S3MultipartWriter(self, name)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self._key(name))
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=self._key(name))
+        except ClientError as e:
+            if self._is_missing(e):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=self._key(name))['ContentLength']
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def listdir(self, path):
+        prefix = self._key(path).rstrip('/') + '/' if path else self._key('')
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'):
+            directories += [entry['Prefix'][len(prefix):].rstrip('/') for entry in page.get('CommonPrefixes', [])]
+            files += [entry['Key'][len(prefix):] for entry in page.get('Contents', [])]
+        return directories, files
+
+    # Object and multipart operations used by the writers and resumable uploads
+
+    def read_range(self, name, start, end):
+        response = self.client.get_object(Bucket=self.bucket_name, Key=self._key(name), Range=f'bytes={start}-{end}')
+        return response['Body'].read()
+
+    def put_object(self, name, data):
+        self.client.put_object(Bucket=self.bucket_name, Key=self._key(name), Body=data)
+
+    def create_multipart(self, name):
+        return self.client.create_multipart_upload(Bucket=self.bucket_name, Key=self._key(name))['UploadId']
+
+    def upload_part(self, name, upload_id, number, data):
+        """Uploads part `number` (1-based; re-uploading a number replaces it) and returns its ETag."""
+        return self.client.upload_part(
+            Bucket=self.bucket_name, Key=self._key(name), UploadId=upload_id, PartNumber=number, Body=data,
+        )['ETag']
+
+    def complete_multipart(self, name, upload_id, parts=None):
+        """Joins the parts into the object. Without `parts`, every uploaded part is used in order."""
+        if parts is None:
+            parts = []
+            paginator = self.client.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=self.bucket_name, Key=self._key(name), UploadId=upload_id):
+                parts += [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in page.get('Parts', [])]
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self._key(name), UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])},
+        )
+
+    def abort_multipart(self, name, upload_id):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self._key(name), UploadId=upload_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+    def delete_prefix(self, prefix):
+        """Deletes every object under `prefix` and returns how many bytes they held."""
+        reclaimed = 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self._key(prefix)):
+            objects = page.get('Contents', [])
+            if objects:
+                reclaimed += sum(entry['Size'] for entry in objects)
+                self.client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': entry['Key']} for entry in objects], 'Quiet': True},
+                )
+        return reclaimed
@@ -0,0 +1,95 @@
+"""Purges expired transfers (and abandoned resumable uploads) with their blobs.
+
+Rows are fetched in small batches through the expires_at index and every blob
+folder under temp_transfers/<unique_id>/ is removed in one go. Codes of purged
+transfers are handed back to the code allocator, and old transfer history
+entries are dropped too. Run it with
+`python manage.py purge_expired`, or set TRANSFER_SWEEP_INTERVAL to run it
+periodically inside the server process.
+"""
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from coreApp.history import prune_history
+
+from .codes import recycle_codes
+from .models import ChunkedUpload, Transfer
+from .storage import remove_folder
+
+logger = logging.getLogger(__name__)
+
+# Resumable uploads that haven't been finalized within this window are dropped
+STALE_UPLOAD_AGE = datetime.timedelta(hours=24)
+
+
+def _purge(queryset, id_field, batch_size, storage, code_field=None):
+    deleted = reclaimed = 0
+    fields = ['pk', id_field] + ([code_field] if code_field else [])
+    while True:
+        batch = list(queryset.values_list(*fields)[:batch_size])
+        if not batch:
+            return deleted, reclaimed
+        for row in batch:
+            reclaimed += remove_folder(storage, f'temp_transfers/{row[1]}')
+        with transaction.atomic():
+            queryset.model.objects.filter(pk__in=[row[0] for row in batch]).delete()
+            if code_field:
+                recycle_codes(row[2] for row in batch)
+        deleted += len(batch)
+
+
+def purge_expired(batch_size=500, now=None):
+    """Deletes expired transfers, stale uploads and old history. Returns counts, bytes reclaimed and time spent."""
+    started = time.perf_counter()
+    now = now or timezone.now()
+    storage = Transfer._meta.get_field('encrypted_file').storage
+
+    transfers, transfer_bytes = _purge(
+        Transfer.objects.filter(expires_at__lte=now).order_by('expires_at'), 'unique_id', batch_size, storage,
+        code_field='unique_code',
+    )
+    stale_uploads = ChunkedUpload.objects.filter(created_at__lte=now - STALE_UPLOAD_AGE).order_by('created_at')
+    # Parts of unfinished multipart uploads aren't objects yet, so deleting the folder misses them
+    for name, multipart_id in stale_uploads.exclude(multipart_id='').values_list('storage_name', 'multipart_id'):
+        storage.abort_multipart(name, multipart_id)
+    uploads, upload_bytes = _purge(stale_uploads, 'transfer_id', batch_size, storage)
+    return {
+        'transfers': transfers,
+        'uploads': uploads,
+        'history': prune_history(now),
+        'bytes_reclaimed': transfer_bytes + upload_bytes,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+_sweeper = None
+
+
+def _sweep_forever(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            result = purge_expired()
+            if result['transfers'] or result['uploads']:
+                logger.info("Expiry sweep: %(transfers)d transfers, %(uploads)d uploads, "
+                            "%(bytes_reclaimed)d bytes in %(seconds).2fs", result)
+        except Exception:
+            logger.exception("Expiry sweep failed")
+        finally:
+            close_old_connections()
+
+
+def start_sweeper(interval=None):
+    """Starts the background sweeper thread once per process (no-op if the interval is 0)."""
+    global _sweeper
+    interval = settings.TRANSFER_SWEEP_INTERVAL if interval is None else interval
+    if not interval or _sweeper is not None:
+        return
+    _sweeper = threading.Thread(target=_sweep_forever, args=(interval,), name='transfer-sweeper', daemon=True)
+    _sweeper.start()
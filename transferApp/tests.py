@@ -1,3 +1,996 @@
-from django.test import TestCase
+import asyncio
+import os
+import re
+import random
+import shutil
+import tempfile
+import datetime
+import json
+import threading
+import time
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from cryptography.fernet import Fernet, InvalidToken
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.urls import path
+from PIL import Image, TiffImagePlugin, TiffTags
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from coreApp.models import HistoryEntry
+from pixelockproject.urls import urlpatterns as project_urlpatterns
+
+from . import codes, compression, kdf, metrics, ratelimit, views
+from .storage import S3Storage, create_blob
+from .sweeper import purge_expired
+from .models import Transfer, TransferItem, ChunkedUpload, CodeAllocator, RecycledCode, UPLOAD_CHUNK_SIZE
+from .utils import (
+    generate_key, encrypt_stream, decrypt_stream, encrypt_file, decrypt_file_data,
+    decrypted_size, decrypt_range, parse_range_header, render_qr_code, _make_qr,
+)
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(
+            MEDIA_ROOT=self.media_root, RATELIMIT_DB=os.path.join(self.media_root, 'ratelimit.sqlite3'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+
+class StreamEncryptionTests(TestCase):
+    def setUp(self):
+        self.key, _ = generate_key()
+
+    def encrypt(self, data, chunk_size=16):
+        return b''.join(encrypt_stream(BytesIO(data), self.key, chunk_size=chunk_size))
+
+    def test_round_trip_across_chunk_boundaries(self):
+        for size in (0, 1, 15, 16, 17, 64, 100):
+            data = bytes(range(256)) * (size // 256 + 1)
+            data = data[:size]
+            encrypted = self.encrypt(data)
+            self.assertEqual(b''.join(decrypt_stream(BytesIO(encrypted), self.key)), data)
+
+    def test_encrypt_file_round_trip(self):
+        data = b'x' * 200000
+        encrypted = encrypt_file(BytesIO(data), self.key)
+        self.assertEqual(decrypt_file_data(encrypted.read(), self.key), data)
+
+    def test_legacy_fernet_blob_still_decrypts(self):
+        token = Fernet(self.key).encrypt(b'old transfer')
+        self.assertEqual(decrypt_file_data(token, self.key), b'old transfer')
+
+    def test_truncated_container_is_rejected(self):
+        encrypted = self.encrypt(b'a' * 40)
+        # Dropping the whole final frame must not pass as a shorter file
+        with self.assertRaises(InvalidToken):
+            decrypt_file_data(encrypted[:-(8 + 16)], self.key)
+
+    def test_wrong_key_is_rejected(self):
+        encrypted = self.encrypt(b'secret')
+        other_key, _ = generate_key()
+        with self.assertRaises(InvalidToken):
+            decrypt_file_data(encrypted, other_key)
+
+    def test_decrypted_size_matches_plaintext(self):
+        for size in (0, 5, 16, 33, 48):
+            encrypted = self.encrypt(b'z' * size)
+            self.assertEqual(decrypted_size(BytesIO(encrypted), len(encrypted)), size)
+        token = Fernet(self.key).encrypt(b'old')
+        self.assertIsNone(decrypted_size(BytesIO(token), len(token)))
+
+    def test_decrypt_range_matches_plaintext_slices(self):
+        data = os.urandom(70)
+        encrypted = self.encrypt(data)
+        for start in range(len(data)):
+            for end in range(start, len(data)):
+                chunks = decrypt_range(BytesIO(encrypted), self.key, start, end, len(encrypted))
+                self.assertEqual(b''.join(chunks), data[start:end + 1])
+
+    def test_parallel_frames_match_the_serial_format(self):
+        data = os.urandom(1000)
+        serial = self.encrypt(data)
+        with override_settings(CRYPTO_PARALLEL_WORKERS=3):
+            parallel = self.encrypt(data)
+            # Frames come back in order: each mode reads what the other wrote
+            self.assertEqual(decrypt_file_data(serial, self.key), data)
+            self.assertEqual(b''.join(decrypt_range(BytesIO(serial), self.key, 10, 900, len(serial))), data[10:901])
+            with self.assertRaises(InvalidToken):
+                decrypt_file_data(serial[:-1], self.key)
+        self.assertEqual(len(parallel), len(serial))
+        self.assertEqual(decrypt_file_data(parallel, self.key), data)
+
+    def test_compressed_containers_round_trip(self):
+        data = b'log line 42: nothing to report\n' * 20000
+        for codec in ['zlib'] + (['zstd'] if compression.zstandard else []):
+            for size in (0, 1, 16, 17, 1000):
+                encrypted = b''.join(encrypt_stream(BytesIO(data[:size]), self.key, chunk_size=16, codec=codec))
+                self.assertEqual(decrypt_file_data(encrypted, self.key), data[:size])
+            encrypted = b''.join(encrypt_stream(BytesIO(data), self.key, codec=codec))
+            self.assertLess(len(encrypted), len(data) // 10)
+            self.assertEqual(decrypt_file_data(encrypted, self.key), data)
+            # The plaintext size can't be derived from a compressed container
+            self.assertIsNone(decrypted_size(BytesIO(encrypted), len(encrypted)))
+        # The codec flag is authenticated with every frame
+        tampered = bytearray(encrypted)
+        tampered[5] = 0
+        with self.assertRaises(InvalidToken):
+            decrypt_file_data(bytes(tampered), self.key)
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range_header('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range_header('bytes=-5', 100), (95, 99))
+        self.assertEqual(parse_range_header('bytes=50-500', 100), (50, 99))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range_header('items=0-1', 100))
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=100-', 100)
+
+
+class ReceiveDownloadTests(MediaRootMixin, TestCase):
+    def send(self, data, **extra):
+        self.client.post('/send/', {'file': SimpleUploadedFile('photo.jpg', data), **extra})
+        return Transfer.objects.latest('created_at')
+
+    def download_url(self, transfer, **post):
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code, **post})
+        self.assertEqual(response.status_code, 303)
+        return response['Location']
+
+    def test_receive_streams_decrypted_file(self):
+        data = b'pixel' * 50000
+        transfer = self.send(data)
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code}, follow=True)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], str(len(data)))
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_random_ranges_return_identical_bytes(self):
+        data = os.urandom(300000)
+        transfer = self.send(data)
+        url = self.download_url(transfer)
+        rng = random.Random(1234)
+        for _ in range(25):
+            start = rng.randrange(len(data))
+            end = rng.randrange(start, len(data))
+            response = self.client.get(url, HTTP_RANGE=f'bytes={start}-{end}')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(data)}')
+            body = b''.join(response.streaming_content)
+            self.assertEqual(len(body), int(response['Content-Length']))
+            self.assertEqual(body, data[start:end + 1])
+
+    def test_stale_if_range_and_unsatisfiable_ranges(self):
+        data = b'0123456789' * 10
+        url = self.download_url(self.send(data))
+        response = self.client.get(url, HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE=etag)
+        self.assertEqual(b''.join(response.streaming_content), b'01234')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=500-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(data)}')
+
+    def test_send_page_references_qr_instead_of_inlining_it(self):
+        response = self.client.post('/send/', {'file': SimpleUploadedFile('b.jpg', b'data')})
+        transfer = Transfer.objects.latest('created_at')
+        self.assertContains(response, f'src="/r/{transfer.unique_code}/qr.png"')
+        self.assertNotContains(response, 'data:image/png;base64')
+
+    def test_password_protected_round_trip(self):
+        data = b'secret photo'
+        transfer = self.send(data, password='hunter22')
+        response = self.client.post(
+            '/receive/', {'code_or_link': transfer.unique_code, 'password': 'hunter22'}, follow=True,
+        )
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_download_link_serves_ranges_without_rederiving_the_key(self):
+        data = b'secret photo' * 1000
+        transfer = self.send(data, password='hunter22')
+        url = self.download_url(transfer, password='hunter22')
+        self.assertNotIn('hunter22', url)
+        with mock.patch.object(views, 'password_decryption_key') as derive:
+            # More ranged requests than RECEIVE_REQUESTS allows per minute
+            for start in range(0, 40 * 100, 100):
+                response = self.client.get(url, HTTP_RANGE=f'bytes={start}-{start + 99}')
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b''.join(response.streaming_content), data[start:start + 100])
+            derive.assert_not_called()
+        response = self.client.head(url)
+        self.assertEqual(response['Content-Length'], str(len(data)))
+
+        other = self.send(b'other photo', password='hunter22')
+        self.assertEqual(self.client.get(url.replace(transfer.unique_code, other.unique_code)).status_code, 403)
+        self.assertEqual(self.client.get(url[:-4] + 'AAAA').status_code, 403)
+        self.assertEqual(self.client.get(f'/r/{transfer.unique_code}/download/').status_code, 403)
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+
+class QrCodeTests(TestCase):
+    def svg_modules(self, svg):
+        # Replays the path's absolute/relative moves and horizontal strokes into dark cells
+        path = re.search(rb' d="([^"]+)"', svg).group(1).decode()
+        cells, x, y = set(), 0, 0.0
+        for command, a, b in re.findall(r'([Mmh])(-?[\d.]+)(?: (-?[\d.]+))?', path):
+            if command == 'M':
+                x, y = int(a), float(b)
+            elif command == 'm':
+                x, y = x + int(a), y + int(b)
+            else:
+                cells.update((int(y), column) for column in range(x, x + int(a)))
+                x += int(a)
+        return cells
+
+    def test_svg_matches_qr_matrix(self):
+        link = 'http://testserver/r/123456/'
+        matrix = _make_qr(link).get_matrix()
+        expected = {(y, x) for y, row in enumerate(matrix) for x, dark in enumerate(row) if dark}
+        self.assertEqual(self.svg_modules(render_qr_code(link, 'svg')), expected)
+
+    def test_qr_endpoint_is_cacheable(self):
+        response = self.client.get('/r/123456/qr.svg')
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        self.assertEqual(
+            response.content, render_qr_code('http://testserver/r/123456/', 'svg'),
+        )
+        response = self.client.get('/r/123456/qr.svg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/r/123456/qr.png')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertEqual(self.client.get('/r/123456/qr.gif').status_code, 404)
+        self.assertEqual(self.client.get('/r/12ab56/qr.svg').status_code, 404)
+
+
+class MultiFileTransferTests(MediaRootMixin, TestCase):
+    def send_files(self, files, **extra):
+        uploads = [SimpleUploadedFile(name, data) for name, data in files]
+        self.client.post('/send/', {'file': uploads, **extra})
+        return Transfer.objects.get()
+
+    def test_one_code_and_one_kdf_run_for_many_files(self):
+        files = [(f'IMG_{n}.jpg', os.urandom(1000 + n)) for n in range(5)]
+        with mock.patch.object(views, 'derive_password_secrets', wraps=views.derive_password_secrets) as derive:
+            transfer = self.send_files(files, password='pw')
+        derive.assert_called_once()
+        self.assertEqual(transfer.item_count, 5)
+        self.assertEqual(transfer.file_size, sum(len(data) for _, data in files))
+        self.assertEqual(
+            list(transfer.items.order_by('position').values_list('original_filename', flat=True)),
+            [name for name, _ in files],
+        )
+
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'pw'})
+        self.assertContains(response, 'IMG_3.jpg')
+        self.assertContains(response, 'value="all"')
+        # The list posts back a short-lived token, not the password, and isn't cached
+        self.assertNotContains(response, 'value="pw"')
+        self.assertIn('no-store', response['Cache-Control'])
+        token = re.search(r'name="token" value="([^"]+)"', response.content.decode())[1]
+
+        post = {'code_or_link': transfer.unique_code, 'token': token}
+        response = self.client.post('/receive/', {**post, 'item': '3'}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), files[3][1])
+        self.assertIn('IMG_3.jpg', response['Content-Disposition'])
+
+        response = self.client.post('/receive/', {**post, 'item': 'all'}, follow=True)
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual([archive.read(name) for name, _ in files], [data for _, data in files])
+
+    def test_download_token_is_bound_to_its_transfer_and_expires(self):
+        transfer = self.send_files([('a.jpg', b'a'), ('b.jpg', b'b')], password='pw')
+        other = Transfer.objects.create(original_filename='c.jpg', file_size=1, is_password_protected=True)
+        token = views.download_token(transfer, views.password_decryption_key(transfer, 'pw'))
+        self.assertIsNotNone(views.download_token_key(transfer, token))
+        self.assertIsNone(views.download_token_key(other, token))
+        self.assertIsNone(views.download_token_key(transfer, token[:-4] + 'AAAA'))
+        with mock.patch('time.time', return_value=time.time() + views.DOWNLOAD_TOKEN_MAX_AGE + 60):
+            response = self.client.post('/receive/', {
+                'code_or_link': transfer.unique_code, 'token': token, 'item': '0',
+            })
+        self.assertContains(response, "Password Protected")
+
+    def test_more_files_than_djangos_default_limit(self):
+        transfer = self.send_files([(f'IMG_{n}.txt', b'%d' % n) for n in range(150)])
+        self.assertEqual(transfer.item_count, 150)
+
+    @override_settings(DATA_UPLOAD_MAX_NUMBER_FILES=120)
+    def test_too_many_files_show_a_form_error(self):
+        uploads = [SimpleUploadedFile(f'IMG_{n}.txt', b'x') for n in range(150)]
+        response = self.client.post('/send/', {'file': uploads})
+        self.assertContains(response, "Too many files", status_code=400)
+        self.assertFalse(Transfer.objects.exists())
+        self.assertEqual([names for _, _, names in os.walk(self.media_root) if names], [])
+
+    def test_single_file_keeps_the_flat_layout(self):
+        transfer = self.send_files([('one.jpg', b'only')])
+        self.assertEqual(transfer.item_count, 0)
+        self.assertFalse(transfer.items.exists())
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), b'only')
+
+    def test_items_are_purged_with_their_transfer(self):
+        transfer = self.send_files([('a.jpg', b'a'), ('b.jpg', b'b')])
+        purge_expired(now=transfer.expires_at)
+        self.assertFalse(TransferItem.objects.exists())
+        self.assertEqual([name for _, _, names in os.walk(self.media_root) for name in names
+                          if name.endswith('.enc')], [])
+
+
+class TextTransferTests(MediaRootMixin, TestCase):
+    def media_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_short_text_round_trips_through_the_row(self):
+        self.client.post('/send/', {'text_content': 'wifi: hunter2 ünïcode'})
+        transfer = Transfer.objects.get()
+        self.assertTrue(transfer.is_text)
+        self.assertFalse(transfer.encrypted_file)
+        self.assertNotIn('hunter2'.encode(), bytes(transfer.encrypted_text))
+        self.assertEqual(self.media_files(), [])
+
+        with self.assertNumQueries(1):
+            transfer = Transfer.objects.get(unique_code=transfer.unique_code)
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code}, follow=True)
+        self.assertContains(response, 'wifi: hunter2 ünïcode')
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertEqual(HistoryEntry.objects.latest('id').kind, 'received')
+
+    def test_password_protected_text(self):
+        self.client.post('/send/', {'text_content': 'door code 4711', 'password': 'pw'})
+        code = Transfer.objects.get().unique_code
+        response = self.client.post('/receive/', {'code_or_link': code, 'password': 'nope'})
+        self.assertNotContains(response, 'door code 4711')
+        response = self.client.post('/receive/', {'code_or_link': code, 'password': 'pw'}, follow=True)
+        self.assertContains(response, 'door code 4711')
+
+    @override_settings(INLINE_TEXT_MAX_BYTES=8)
+    def test_long_text_becomes_a_file(self):
+        self.client.post('/send/', {'text_content': 'longer than eight bytes'})
+        transfer = Transfer.objects.get()
+        self.assertFalse(transfer.is_text)
+        self.assertEqual(transfer.original_filename, 'message.txt')
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), b'longer than eight bytes')
+
+    def test_files_and_text_together_are_rejected(self):
+        response = self.client.post('/send/', {
+            'text_content': 'note', 'file': SimpleUploadedFile('a.jpg', b'a'),
+        })
+        self.assertContains(response, "Send either files or text, not both.")
+        self.assertFalse(Transfer.objects.exists())
+        self.assertEqual(self.media_files(), [])
+
+
+class EncryptingUploadTests(MediaRootMixin, TestCase):
+    def stored_files(self):
+        return [
+            os.path.join(root, name)
+            for root, _, names in os.walk(self.media_root) for name in names
+        ]
+
+    def test_upload_is_written_once_as_ciphertext(self):
+        data = b'plain' * 30000
+        self.client.post('/send/', {'file': SimpleUploadedFile('photo.jpg', data)})
+        transfer = Transfer.objects.get()
+        self.assertEqual(self.stored_files(), [transfer.encrypted_file.path])
+        self.assertTrue(transfer.encrypted_file.name.startswith(f'temp_transfers/{transfer.unique_id}/'))
+        with open(transfer.encrypted_file.path, 'rb') as f:
+            self.assertNotIn(b'plainplain', f.read())
+        self.assertEqual(transfer.file_size, len(data))
+
+    @override_settings(COMPRESSION='zlib')
+    def test_compressible_uploads_are_compressed(self):
+        document = b'quarterly report, page 1\n' * 8000
+        self.client.post('/send/', {'file': SimpleUploadedFile('report.txt', document)})
+        transfer = Transfer.objects.get()
+        self.assertLess(transfer.encrypted_file.size, len(document) // 10)
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), document)
+
+        # Already compressed formats are stored as they are, going by their bytes or MIME type
+        self.assertEqual(compression.choose_codec(jpeg_with_exif()[:compression.SAMPLE_SIZE]), '')
+        self.assertEqual(compression.choose_codec(b'RIFF\x00\x10\x00\x00WEBPVP8 '), '')
+        self.assertEqual(compression.choose_codec(b'', 'image/png'), '')
+        self.assertEqual(compression.choose_codec(b'II*\x00' + bytes(1000), 'image/tiff'), 'zlib')
+        self.assertEqual(compression.choose_codec(os.urandom(1000), 'application/octet-stream'), '')
+
+    def test_rejected_upload_leaves_no_blob(self):
+        # Empty files fail form validation after the handler has already written them
+        self.client.post('/send/', {'file': SimpleUploadedFile('empty.jpg', b'')})
+        self.assertFalse(Transfer.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+def jpeg_with_exif(size=(64, 48), orientation=1):
+    image = Image.new('RGB', size, (200, 30, 30))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x010F] = 'PhoneMaker'
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', exif=exif.tobytes(), comment=b'taken at home')
+    return buffer.getvalue()
+
+
+def mpo_with_exif(size=(64, 48)):
+    # Multi-picture JPEG as phone cameras write it: a primary image, a second frame, EXIF with GPS
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'
+    exif.get_ifd(0x8825)[2] = (51.0, 30.0, 0.0)
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(
+        buffer, format='MPO', save_all=True, append_images=[Image.new('RGB', size, (30, 30, 200))],
+        exif=exif.tobytes(),
+    )
+    return buffer.getvalue()
+
+
+class ImageStageTests(MediaRootMixin, TestCase):
+    def send_and_receive(self, data, name='photo.jpg'):
+        self.client.post('/send/', {'file': SimpleUploadedFile(name, data)})
+        transfer = Transfer.objects.latest('created_at')
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code}, follow=True)
+        return transfer, b''.join(response.streaming_content)
+
+    @override_settings(IMAGE_STRIP_METADATA=True)
+    def test_strip_removes_exif_and_comments_and_keeps_orientation(self):
+        transfer, received = self.send_and_receive(jpeg_with_exif(orientation=6))
+        image = Image.open(BytesIO(received))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(len(image.getexif()), 0)
+        self.assertNotIn('comment', image.info)
+        # Rotated 90 degrees into the pixels instead of by the dropped tag
+        self.assertEqual(image.size, (48, 64))
+        self.assertEqual(transfer.file_size, len(received))
+
+    @override_settings(IMAGE_STRIP_METADATA=True)
+    def test_strip_saves_the_primary_frame_of_an_mpo_without_metadata(self):
+        data = mpo_with_exif()
+        self.assertEqual(Image.open(BytesIO(data)).n_frames, 2)
+        transfer, received = self.send_and_receive(data)
+        image = Image.open(BytesIO(received))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(len(image.getexif()), 0)
+        self.assertNotIn(b'PhoneMaker', received)
+        # The primary (red) frame, not the second (blue) one
+        self.assertGreater(image.getpixel((10, 10))[0], 150)
+        self.assertEqual(transfer.file_size, len(received))
+
+    @override_settings(IMAGE_STRIP_METADATA=True)
+    def test_strip_removes_tiff_xmp_iptc_and_photoshop_blocks(self):
+        tags = TiffImagePlugin.ImageFileDirectory_v2()
+        tags[TiffImagePlugin.XMP] = b'<x:xmpmeta>GPS 51.5N</x:xmpmeta>'
+        tags[TiffImagePlugin.IPTC_NAA_CHUNK] = b'\x1c\x02\x78\x00\x0bhome garden'
+        tags.tagtype[TiffImagePlugin.IPTC_NAA_CHUNK] = TiffTags.UNDEFINED
+        tags[TiffImagePlugin.PHOTOSHOP_CHUNK] = b'8BIM\x04\x04\x00\x00\x00\x00\x00\x00'
+        tags[0x010F] = 'PhoneMaker'
+        buffer = BytesIO()
+        Image.new('RGB', (32, 24), (10, 200, 10)).save(buffer, format='TIFF', tiffinfo=tags, dpi=(300, 300))
+        self.assertIn(b'home garden', buffer.getvalue())
+
+        _, received = self.send_and_receive(buffer.getvalue(), name='scan.tif')
+        image = Image.open(BytesIO(received))
+        self.assertEqual(image.format, 'TIFF')
+        for tag in (TiffImagePlugin.XMP, TiffImagePlugin.IPTC_NAA_CHUNK, TiffImagePlugin.PHOTOSHOP_CHUNK, 0x010F):
+            self.assertNotIn(tag, image.tag_v2)
+        self.assertNotIn(b'home garden', received)
+        self.assertEqual(image.info['dpi'], (300, 300))
+        self.assertEqual(image.getpixel((0, 0)), (10, 200, 10))
+
+    @override_settings(IMAGE_REENCODE_FORMAT='webp')
+    def test_reencode_to_webp_renames_and_replaces_the_blob(self):
+        transfer, received = self.send_and_receive(jpeg_with_exif())
+        self.assertEqual(Image.open(BytesIO(received)).format, 'WEBP')
+        self.assertEqual(transfer.original_filename, 'photo.webp')
+        stored = [name for _, _, names in os.walk(self.media_root) for name in names if name.endswith('.enc')]
+        self.assertEqual(stored, [os.path.basename(transfer.encrypted_file.name)])
+
+    @override_settings(IMAGE_STRIP_METADATA=True, IMAGE_REENCODE_FORMAT='webp')
+    def test_non_images_are_stored_as_uploaded(self):
+        transfer, received = self.send_and_receive(b'not really a jpeg', name='notes.jpg')
+        self.assertEqual(received, b'not really a jpeg')
+        self.assertEqual(transfer.original_filename, 'notes.jpg')
+
+
+class ResumableUploadTests(MediaRootMixin, TestCase):
+    def put_chunk(self, upload_id, index, data):
+        return self.client.put(
+            f'/send/uploads/{upload_id}/chunks/{index}/', data, content_type='application/octet-stream'
+        )
+
+    def test_out_of_order_chunks_resume_and_finalize(self):
+        data = os.urandom(UPLOAD_CHUNK_SIZE + 1000)
+        init = self.client.post('/send/uploads/', {'filename': 'big.raw', 'size': len(data)}).json()
+        upload_id = init['upload_id']
+        self.assertEqual(init['chunk_count'], 2)
+
+        self.assertEqual(self.put_chunk(upload_id, 1, data[UPLOAD_CHUNK_SIZE:]).status_code, 200)
+        status = self.client.get(f'/send/uploads/{upload_id}/').json()
+        self.assertEqual(status['missing'], [[0, 0]])
+        self.assertEqual(self.client.post(f'/send/uploads/{upload_id}/finalize/').status_code, 409)
+
+        # A retried chunk with the same bytes just overwrites its own frames
+        self.put_chunk(upload_id, 0, data[:UPLOAD_CHUNK_SIZE])
+        self.assertEqual(self.put_chunk(upload_id, 0, data[:UPLOAD_CHUNK_SIZE]).status_code, 200)
+        result = self.client.post(f'/send/uploads/{upload_id}/finalize/', {'password': 'pw'}).json()
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+        response = self.client.post('/receive/', {'code_or_link': result['code'], 'password': 'pw'}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_chunk_with_wrong_length_is_rejected(self):
+        init = self.client.post('/send/uploads/', {'filename': 'a.txt', 'size': 10}).json()
+        response = self.put_chunk(init['upload_id'], 0, b'too short')
+        self.assertEqual(response.status_code, 400)
+        status = self.client.get(f"/send/uploads/{init['upload_id']}/").json()
+        self.assertFalse(status['complete'])
+
+    def test_chunk_sent_again_with_other_bytes_is_refused(self):
+        # Its frames' nonces are fixed, so encrypting other bytes into them would reuse them
+        init = self.client.post('/send/uploads/', {'filename': 'a.txt', 'size': 10}).json()
+        upload_id = init['upload_id']
+        self.assertEqual(self.put_chunk(upload_id, 0, b'0123456789').status_code, 200)
+        with open(os.path.join(self.media_root, ChunkedUpload.objects.get().storage_name), 'rb') as blob:
+            ciphertext = blob.read()
+
+        response = self.put_chunk(upload_id, 0, b'9876543210')
+        self.assertEqual(response.status_code, 409)
+        with open(os.path.join(self.media_root, ChunkedUpload.objects.get().storage_name), 'rb') as blob:
+            self.assertEqual(blob.read(), ciphertext)
+
+        result = self.client.post(f'/send/uploads/{upload_id}/finalize/').json()
+        response = self.client.post('/receive/', {'code_or_link': result['code']}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_concurrent_finalize_answers_with_the_same_transfer(self):
+        init = self.client.post('/send/uploads/', {'filename': 'a.txt', 'size': 10}).json()
+        finalize = f"/send/uploads/{init['upload_id']}/finalize/"
+        self.put_chunk(init['upload_id'], 0, b'0123456789')
+        other = []
+        process_image = views.process_image
+
+        def race(*args, **kwargs):
+            # The other call saves its transfer while this one is still in the image stage
+            if not other:
+                other.append(None)
+                other[0] = self.client.post(finalize).json()
+            return process_image(*args, **kwargs)
+
+        with mock.patch.object(views, 'process_image', side_effect=race):
+            result = self.client.post(finalize).json()
+        self.assertTrue(result['success'])
+        self.assertEqual(result, other[0])
+        self.assertEqual(Transfer.objects.count(), 1)
+        response = self.client.post('/receive/', {'code_or_link': result['code']}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_interrupted_chunk_keeps_its_claim_until_written(self):
+        init = self.client.post('/send/uploads/', {'filename': 'a.txt', 'size': 10}).json()
+        upload_id = init['upload_id']
+        with mock.patch('transferApp.upload_handlers._write_chunk', side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.put_chunk(upload_id, 0, b'0123456789')
+        status = self.client.get(f'/send/uploads/{upload_id}/').json()
+        self.assertEqual(status['missing'], [[0, 0]])
+        # The retry must still be the bytes the failed attempt may have half written
+        self.assertEqual(self.put_chunk(upload_id, 0, b'abcdefghij').status_code, 409)
+        self.assertEqual(self.put_chunk(upload_id, 0, b'0123456789').status_code, 200)
+        self.assertTrue(self.client.get(f'/send/uploads/{upload_id}/').json()['complete'])
+
+
+@skipUnless(mock_aws, "needs boto3 and moto")
+class S3StorageTests(MediaRootMixin, TestCase):
+    part_size = 5 * 1024 * 1024
+
+    def setUp(self):
+        super().setUp()
+        credentials = mock.patch.dict(os.environ, {
+            'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1',
+        })
+        credentials.start()
+        self.addCleanup(credentials.stop)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='pixelock-test')
+        override = override_settings(STORAGES={
+            'default': {
+                'BACKEND': 'transferApp.storage.S3Storage',
+                'OPTIONS': {'bucket_name': 'pixelock-test', 'part_size': self.part_size, 'max_concurrency': 2},
+            },
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def keys(self):
+        return [entry['Key'] for entry in self.s3.list_objects_v2(Bucket='pixelock-test').get('Contents', [])]
+
+    def test_writer_uploads_large_blobs_in_parts(self):
+        storage = S3Storage(bucket_name='pixelock-test', part_size=self.part_size)
+        data = os.urandom(2 * self.part_size + 1000)
+        writer, name = create_blob(storage, 'blobs/a.enc')
+        with mock.patch.object(storage, 'upload_part', wraps=storage.upload_part) as upload_part:
+            with writer:
+                for offset in range(0, len(data), 100000):
+                    writer.write(data[offset:offset + 100000])
+        self.assertEqual(upload_part.call_count, 3)
+        with storage.open(name) as blob:
+            blob.seek(self.part_size - 10)
+            self.assertEqual(blob.read(20), data[self.part_size - 10:self.part_size + 10])
+
+    def test_send_and_range_receive_through_the_bucket(self):
+        data = os.urandom(200000)
+        self.client.post('/send/', {'file': SimpleUploadedFile('a.raw', data)})
+        transfer = Transfer.objects.get()
+        self.assertEqual(self.keys(), [transfer.encrypted_file.name])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'temp_transfers')))
+
+        response = self.client.post(
+            '/receive/', {'code_or_link': transfer.unique_code}, HTTP_RANGE='bytes=70000-70099', follow=True,
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), data[70000:70100])
+
+    def test_resumable_chunks_are_multipart_parts(self):
+        data = os.urandom(self.part_size + 1000)
+        init = self.client.post('/send/uploads/', {'filename': 'big.raw', 'size': len(data)}).json()
+        self.assertEqual(init['chunk_size'], self.part_size)
+        upload_id = init['upload_id']
+        for index in (1, 0, 0):
+            chunk = data[index * self.part_size:(index + 1) * self.part_size]
+            self.client.put(f'/send/uploads/{upload_id}/chunks/{index}/', chunk,
+                            content_type='application/octet-stream')
+        result = self.client.post(f'/send/uploads/{upload_id}/finalize/').json()
+        response = self.client.post('/receive/', {'code_or_link': result['code']}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_sweeper_deletes_objects_and_aborts_stale_uploads(self):
+        self.client.post('/send/', {'file': SimpleUploadedFile('a.jpg', b'x' * 1000)})
+        self.client.post('/send/uploads/', {'filename': 'a.bin', 'size': 10})
+        Transfer.objects.update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        ChunkedUpload.objects.update(created_at=timezone.now() - datetime.timedelta(days=2))
+
+        result = purge_expired()
+        self.assertEqual((result['transfers'], result['uploads']), (1, 1))
+        self.assertGreater(result['bytes_reclaimed'], 1000)
+        self.assertEqual(self.keys(), [])
+        self.assertNotIn('Uploads', self.s3.list_multipart_uploads(Bucket='pixelock-test'))
+
+
+class PasswordKdfTests(MediaRootMixin, TestCase):
+    cheap_scrypt = {'algorithm': 'scrypt', 'n': 2 ** 10, 'r': 8, 'p': 1}
+
+    def test_verifier_and_key_come_from_one_derivation(self):
+        key, verifier, salt, params = kdf.derive_password_secrets('pw', params=self.cheap_scrypt)
+        self.assertEqual(kdf.verify_password('pw', salt, params, verifier), key)
+        self.assertIsNone(kdf.verify_password('nope', salt, params, verifier))
+        self.assertNotIn(verifier.encode(), key)
+
+    @override_settings(KDF_PROFILE='scrypt')
+    def test_new_transfers_record_their_kdf_profile(self):
+        self.client.post('/send/', {'file': SimpleUploadedFile('a.jpg', b'data'), 'password': 'pw'})
+        transfer = Transfer.objects.get()
+        self.assertEqual(transfer.kdf_params, kdf.PROFILES['scrypt'])
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'pw'}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), b'data')
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'bad'})
+        self.assertContains(response, "Incorrect password.")
+
+    def test_legacy_password_transfer_still_decrypts(self):
+        key, salt = generate_key('pw')
+        transfer = Transfer(original_filename='old.txt', file_size=3, is_password_protected=True,
+                            password_hash=make_password('pw'), encryption_salt=salt)
+        transfer.encrypted_file.save('old.enc', encrypt_file(BytesIO(b'old'), key))
+        response = self.client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'pw'}, follow=True)
+        self.assertEqual(b''.join(response.streaming_content), b'old')
+
+    def test_saturated_pool_fails_fast(self):
+        with mock.patch.object(kdf, '_get_executor', return_value=(None, threading.BoundedSemaphore(1))) as get:
+            get.return_value[1].acquire()
+            with self.assertRaises(kdf.KdfBusy):
+                kdf.derive_password_secrets('pw', params=self.cheap_scrypt)
+
+
+class ExpirySweeperTests(MediaRootMixin, TestCase):
+    def send(self, data):
+        self.client.post('/send/', {'file': SimpleUploadedFile('a.jpg', data)})
+        return Transfer.objects.latest('created_at')
+
+    def test_purges_expired_transfers_and_their_blobs(self):
+        expired = self.send(b'x' * 1000)
+        expired_folder = os.path.dirname(expired.encrypted_file.path)
+        Transfer.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        live = self.send(b'y' * 10)
+
+        result = purge_expired(batch_size=1)
+        self.assertEqual(result['transfers'], 1)
+        self.assertGreater(result['bytes_reclaimed'], 1000)
+        self.assertFalse(os.path.exists(expired_folder))
+        self.assertEqual(list(Transfer.objects.all()), [live])
+        self.assertTrue(os.path.exists(live.encrypted_file.path))
+
+    def test_drops_abandoned_uploads(self):
+        self.client.post('/send/uploads/', {'filename': 'a.bin', 'size': 10})
+        ChunkedUpload.objects.update(created_at=timezone.now() - datetime.timedelta(days=2))
+        out = StringIO()
+        call_command('purge_expired', stdout=out)
+        self.assertIn('Purged 0 transfers and 1 uploads', out.getvalue())
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'temp_transfers')), [])
+
+    def test_purged_codes_are_recycled(self):
+        transfer = self.send(b'x')
+        Transfer.objects.update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        purge_expired()
+        self.assertTrue(RecycledCode.objects.filter(code=transfer.unique_code).exists())
+
+
+class DatabaseTuningTests(TestCase):
+    def test_sqlite_connections_are_tuned(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+            # 1 = NORMAL
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+
+    def test_file_databases_switch_to_wal(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        with tempfile.TemporaryDirectory() as folder:
+            database = connections['default']
+            wrapper = type(database)({**database.settings_dict, 'NAME': os.path.join(folder, 'db.sqlite3')}, 'wal')
+            try:
+                with wrapper.cursor() as cursor:
+                    self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            finally:
+                wrapper.close()
+
+
+class InstrumentationTests(MediaRootMixin, TestCase):
+    def stages(self, response):
+        return {entry.split(';')[0] for entry in response['Server-Timing'].split(', ')}
+
+    def test_send_reports_its_stages(self):
+        response = self.client.post('/send/', {'file': SimpleUploadedFile('a.jpg', b'x' * 5000), 'password': 'pw'})
+        self.assertTrue({'keygen', 'encrypt', 'storage_write', 'kdf', 'total'} <= self.stages(response))
+
+    def test_download_stages_reach_the_histograms(self):
+        self.client.post('/send/', {'file': SimpleUploadedFile('a.jpg', b'x' * 5000)})
+        before = {stage: metrics.STAGE_SECONDS.snapshot(stage)[0] for stage in ('decrypt', 'storage_read')}
+        response = self.client.post('/receive/', {'code_or_link': Transfer.objects.get().unique_code}, follow=True)
+        b''.join(response.streaming_content)
+        response.close()
+        for stage, count in before.items():
+            self.assertEqual(metrics.STAGE_SECONDS.snapshot(stage)[0], count + 1)
+        self.assertGreaterEqual(metrics.STAGE_BYTES.snapshot('decrypt')[1], 5000)
+
+    def test_metrics_endpoint_is_local_only(self):
+        metrics.observe('kdf', 0.003)
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('pixelock_stage_seconds_bucket{stage="kdf",le="0.005"}', response.content.decode())
+        self.assertIn('# TYPE pixelock_request_seconds histogram', response.content.decode())
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 404)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', "Test.", ('stage',), (0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, 'a')
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'test_seconds_bucket{stage="a",le="0.1"} 1',
+            'test_seconds_bucket{stage="a",le="1"} 3',
+            'test_seconds_bucket{stage="a",le="+Inf"} 4',
+            'test_seconds_sum{stage="a"} 6.05',
+            'test_seconds_count{stage="a"} 4',
+        ])
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_json_results_can_be_compared(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'results.json')
+            call_command('benchmark', 'crypto', sizes='10KB', json=path, stdout=StringIO())
+            with open(path) as results:
+                results = json.load(results)
+            self.assertEqual(results['sizes'], [10240])
+            self.assertIn('commit', results['environment'])
+            variants = {row['variant'] for row in results['results']}
+            self.assertEqual(variants, {'encrypt_file', 'decrypt_file_data', 'decrypt_stream'})
+            self.assertTrue(all(row['seconds'] > 0 and row['runs'] == 3 for row in results['results']))
+
+            out = StringIO()
+            call_command('benchmark', 'crypto', sizes='10KB', compare=path, threshold=1e9, stdout=out)
+            self.assertIn('0 regression(s)', out.getvalue())
+            self.assertIn('encrypt_file', out.getvalue().split('Compared with')[1])
+
+
+class CodeAllocationTests(TestCase):
+    def test_permutation_is_collision_free(self):
+        key = os.urandom(32)
+        allocated = {codes.permute_code(counter, key) for counter in range(20000)}
+        self.assertEqual(len(allocated), 20000)
+        self.assertTrue(all(len(code) == 6 and code.isdigit() for code in allocated))
+
+    def test_transfers_get_distinct_codes_in_order(self):
+        first = Transfer.objects.create(original_filename='a', file_size=1)
+        second = Transfer.objects.create(original_filename='b', file_size=1)
+        key = bytes(CodeAllocator.objects.get().key)
+        self.assertEqual([first.unique_code, second.unique_code],
+                         [codes.permute_code(0, key), codes.permute_code(1, key)])
+
+    def test_codes_taken_by_legacy_rows_are_skipped(self):
+        CodeAllocator.objects.create(pk=1, key=b'k' * 32)
+        Transfer.objects.create(original_filename='old', file_size=1, unique_code=codes.permute_code(0, b'k' * 32))
+        self.assertEqual(codes.allocate_code(), codes.permute_code(1, b'k' * 32))
+
+    def test_recycled_codes_are_used_after_the_counter_runs_out(self):
+        CodeAllocator.objects.create(pk=1, key=b'k' * 32, counter=codes.CODE_SPACE)
+        codes.recycle_codes(['123456'])
+        self.assertEqual(codes.allocate_code(), '123456')
+        with self.assertRaises(codes.CodeSpaceExhausted):
+            codes.allocate_code()
+
+
+class RateLimitTests(MediaRootMixin, TestCase):
+    def test_concurrent_hits_from_separate_connections_are_all_counted(self):
+        path = os.path.join(self.media_root, 'shared.sqlite3')
+        limit = ratelimit.Limit('test', 10 ** 6, 60)
+
+        def worker():
+            # Each backend (like each worker process) opens its own connection
+            backend = ratelimit.SQLiteBackend(path)
+            for _ in range(200):
+                backend.hit(limit._key('ip'), limit.seconds, 1000.0)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(ratelimit.SQLiteBackend(path).peek(limit._key('ip'), 60, 1000.0), (1600, 0))
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        limit = ratelimit.Limit('test', 10, 60)
+        for _ in range(10):
+            limit.hit('ip', now=59.0)
+        self.assertTrue(limit.exceeded('ip', now=60.0))
+        # Half way through the next window only half of the old hits still count
+        self.assertFalse(limit.exceeded('ip', now=90.0))
+        self.assertTrue(limit.exceeded('ip', now=59.0))
+        limit.reset('ip')
+        self.assertFalse(limit.exceeded('ip', now=59.0))
+
+    def test_guessing_codes_blocks_the_client(self):
+        for _ in range(ratelimit.BAD_CODES.count):
+            response = self.client.post('/receive/', {'code_or_link': '000000'})
+            self.assertContains(response, "Invalid code.")
+        response = self.client.post('/receive/', {'code_or_link': '000000'})
+        self.assertContains(response, "Too many failed attempts", status_code=429)
+
+    def test_wrong_passwords_lock_the_transfer(self):
+        self.client.post('/send/', {'file': SimpleUploadedFile('a.jpg', b'data'), 'password': 'pw'})
+        transfer = Transfer.objects.get()
+        for _ in range(ratelimit.BAD_PASSWORDS.count):
+            self.client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'nope'})
+        # Locked even for the right password, and without running the KDF
+        with mock.patch.object(views, 'password_decryption_key') as decrypt:
+            response = self.client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'pw'})
+        self.assertContains(response, "locked for 15 minutes", status_code=429)
+        decrypt.assert_not_called()
+
+    def test_receive_requests_are_limited_per_ip(self):
+        with override_settings(RATELIMIT_BACKEND='transferApp.ratelimit.LocMemBackend'):
+            for _ in range(ratelimit.RECEIVE_REQUESTS.count):
+                self.client.post('/receive/', {'code_or_link': 'bad'})
+            response = self.client.post('/receive/', {'code_or_link': 'bad'})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '60')
+            # Another client is unaffected
+            response = self.client.post('/receive/', {'code_or_link': 'bad'}, REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(response.status_code, 200)
+
+
+# Async views mounted the way ASGI deployments (PIXELOCK_ASYNC_VIEWS=1) route them
+urlpatterns = [
+    path('send/', views.send_view_async),
+    path('receive/', views.receive_view_async),
+    path('r/<str:code>/download/', views.download_view_async),
+    *project_urlpatterns,
+]
+
+
+async def read_streaming(response):
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+@override_settings(ROOT_URLCONF='transferApp.tests', KDF_PROFILE='scrypt')
+class AsyncViewTests(MediaRootMixin, TestCase):
+    async def test_async_send_and_receive_round_trip(self):
+        data = os.urandom(200000)
+        response = await self.async_client.post(
+            '/send/', {'file': SimpleUploadedFile('photo.jpg', data), 'password': 'pw'}
+        )
+        self.assertContains(response, "Transfer Ready!")
+        transfer = await Transfer.objects.aget()
+
+        response = await self.async_client.post(
+            '/receive/', {'code_or_link': transfer.unique_code, 'password': 'pw'}, follow=True
+        )
+        self.assertTrue(response.is_async)
+        self.assertEqual(await read_streaming(response), data)
+
+        response = await self.async_client.post(
+            '/receive/', {'code_or_link': transfer.unique_code, 'password': 'pw'},
+            headers={'Range': 'bytes=10-19'}, follow=True,
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await read_streaming(response), data[10:20])
+
+    async def test_async_multi_file_zip(self):
+        await self.async_client.post('/send/', {'file': [SimpleUploadedFile('a.jpg', b'aa'),
+                                                         SimpleUploadedFile('b.jpg', b'bb')]})
+        transfer = await Transfer.objects.aget()
+        response = await self.async_client.post(
+            '/receive/', {'code_or_link': transfer.unique_code, 'item': 'all'}, follow=True,
+        )
+        with zipfile.ZipFile(BytesIO(await read_streaming(response))) as archive:
+            self.assertEqual(archive.read('b.jpg'), b'bb')
+
+    async def test_async_text_transfer(self):
+        await self.async_client.post('/send/', {'text_content': 'hello async'})
+        transfer = await Transfer.objects.aget()
+        response = await self.async_client.post('/receive/', {'code_or_link': transfer.unique_code})
+        self.assertContains(response, 'hello async')
+
+    async def test_async_receive_rejects_wrong_password(self):
+        await self.async_client.post('/send/', {'file': SimpleUploadedFile('a.jpg', b'data'), 'password': 'pw'})
+        transfer = await Transfer.objects.aget()
+        response = await self.async_client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'x'})
+        self.assertContains(response, "Incorrect password.")
+
+    async def test_async_rate_limits_count_off_the_event_loop(self):
+        calls = []
+
+        def record(backend, key, seconds, now):
+            try:
+                asyncio.get_running_loop()
+                calls.append((key, 'event loop'))
+            except RuntimeError:
+                calls.append((key, 'worker thread'))
+            return 0, 0
+
+        await self.async_client.post('/send/', {'file': SimpleUploadedFile('a.jpg', b'data'), 'password': 'pw'})
+        transfer = await Transfer.objects.aget()
+        with mock.patch.object(ratelimit.SQLiteBackend, 'hit', autospec=True, side_effect=record), \
+                mock.patch.object(ratelimit.SQLiteBackend, 'peek', autospec=True, side_effect=record):
+            await self.async_client.post('/receive/', {'code_or_link': 'NOPE99'})
+            await self.async_client.post('/receive/', {'code_or_link': transfer.unique_code, 'password': 'x'})
+        self.assertEqual({prefix.split(':')[0] for prefix, _ in calls}, {'receive', 'bad-code', 'bad-password'})
+        self.assertEqual({where for _, where in calls}, {'worker thread'})
@@ -0,0 +1,267 @@
+import hashlib
+import time
+import uuid
+from io import BytesIO
+
+from django.core.exceptions import TooManyFilesSent
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .metrics import observe, timed
+from .compression import SAMPLE_SIZE, choose_codec
+from .models import ChunkedUpload, ChunkedUploadPart, Transfer
+from .storage import create_blob, local_path
+from .utils import (
+    FrameCipher, FramePipeline, StreamEncryptor, HEADER_SIZE, encrypted_size, generate_key, new_stream_header,
+    read_exact,
+)
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """An upload that was encrypted on the fly and already sits at its final storage path.
+
+    `size` is the plaintext size (so form size checks still apply), `key` is the
+    per-file data key and `content_hash` the hex SHA-256 of the plaintext. Call
+    claim() to get the name the model's FileField should point at.
+    """
+
+    def __init__(self, file, name, content_type, size, charset, key, storage_name, storage, content_hash=None):
+        super().__init__(file, name, content_type, size, charset)
+        self.key = key
+        self.content_hash = content_hash
+        # Set by transferApp.images.process_upload
+        self.image_format = ''
+        self.thumbnail_name = ''
+        self.storage_name = storage_name
+        self.storage = storage
+        self.claimed = False
+
+    def claim(self):
+        """Marks the ciphertext as owned by a model row and returns its storage name."""
+        self.claimed = True
+        return self.storage_name
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """Encrypts the `file` field chunk by chunk as the request body arrives.
+
+    Ciphertext is written straight to the path `field` would have picked for
+    `instance`, so the plaintext never touches disk and the blob is written once.
+    Must be installed before request.POST/FILES are read (see send_view), and
+    discard_unclaimed() should run once the view is done.
+    """
+
+    def __init__(self, request, field, instance=None, filename=None, field_name='file'):
+        super().__init__(request)
+        self.field = field
+        self.instance = instance
+        self.filename = filename
+        self.target_field_name = field_name
+        self.storage = field.storage
+        self.activated = False
+        self.uploaded_files = []
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.activated = field_name == self.target_field_name
+        if not self.activated:
+            return
+
+        with timed('keygen'):
+            self.key, _ = generate_key()
+        # Created with the first chunk, once the sniff can see what the file is (compression.py)
+        self.encryptor = None
+        self.hasher = hashlib.sha256()
+        # Summed over the chunks and reported per file in file_complete
+        self.encrypt_seconds = self.write_seconds = 0.0
+        # `filename` may be a callable so every file of a multi-file upload gets its own name
+        filename = self.filename() if callable(self.filename) else self.filename
+        name = self.field.generate_filename(self.instance, filename or self.file_name)
+        self.destination, self.storage_name = create_blob(self.storage, name)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.activated:
+            return raw_data
+        started = time.perf_counter()
+        if self.encryptor is None:
+            self.encryptor = StreamEncryptor(self.key, codec=choose_codec(raw_data[:SAMPLE_SIZE], self.content_type))
+        self.hasher.update(raw_data)
+        encrypted = self.encryptor.update(raw_data)
+        encrypted_at = time.perf_counter()
+        self.destination.write(encrypted)
+        self.encrypt_seconds += encrypted_at - started
+        self.write_seconds += time.perf_counter() - encrypted_at
+
+    def file_complete(self, file_size):
+        if not self.activated:
+            return None
+        started = time.perf_counter()
+        if self.encryptor is None:
+            self.encryptor = StreamEncryptor(self.key)
+        encrypted = self.encryptor.finalize()
+        encrypted_at = time.perf_counter()
+        self.destination.write(encrypted)
+        self.destination.close()
+        observe('encrypt', self.encrypt_seconds + encrypted_at - started, file_size)
+        observe('storage_write', self.write_seconds + time.perf_counter() - encrypted_at, file_size)
+        uploaded_file = EncryptedUploadedFile(
+            file=self.storage.open(self.storage_name, 'rb'),
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            key=self.key,
+            storage_name=self.storage_name,
+            storage=self.storage,
+            content_hash=self.hasher.hexdigest(),
+        )
+        self.uploaded_files.append(uploaded_file)
+        return uploaded_file
+
+    def upload_interrupted(self):
+        if self.activated and not self.destination.closed:
+            self.destination.close()
+            self.storage.delete(self.storage_name)
+
+    def discard_unclaimed(self):
+        """Deletes ciphertext the view never attached to a model (invalid form, CSRF failure...)."""
+        for uploaded_file in self.uploaded_files:
+            if not uploaded_file.claimed:
+                uploaded_file.close()
+                self.storage.delete(uploaded_file.storage_name)
+                if uploaded_file.thumbnail_name:
+                    self.storage.delete(uploaded_file.thumbnail_name)
+
+
+def parse_upload(request):
+    """Runs the multipart parser, and with it the upload handlers, before anything reads request.POST.
+
+    Returns False if the body carried more files than DATA_UPLOAD_MAX_NUMBER_FILES.
+    request.POST and request.FILES are then empty, and the files encrypted so far are
+    left to the handler's discard_unclaimed().
+    """
+    try:
+        request.POST, request.FILES
+    except TooManyFilesSent:
+        return False
+    return True
+
+
+# Resumable uploads: every upload chunk is encrypted into its own run of frames, so
+# chunks can arrive in any order (or in parallel) and a retried chunk overwrites
+# itself. The frames' nonces depend only on their position, so a retry must carry
+# the same bytes: AES-GCM under a reused nonce leaks the XOR of the two plaintexts.
+# Each chunk's digest is recorded before it is first encrypted and any retry with
+# other bytes is refused. On local storage the container is pre-allocated at its
+# final size and chunks are written in place; on storages with multipart uploads
+# (S3) each chunk is one part, and finalize_chunked_upload joins them.
+
+class ChunkMismatch(Exception):
+    """Raised when a chunk is sent again with different bytes than the first time."""
+
+
+def start_chunked_upload(filename, size):
+    key, _ = generate_key()
+    upload = ChunkedUpload(original_filename=filename, file_size=size, data_key=key)
+    field = Transfer._meta.get_field('encrypted_file')
+    name = field.generate_filename(Transfer(unique_id=upload.transfer_id), f"{uuid.uuid4()}.enc")
+    if local_path(field.storage, name) is None:
+        # Parts can't be smaller than the storage's part size (bar the last one)
+        upload.chunk_size = field.storage.part_size
+        upload.storage_name = field.storage.get_available_name(name)
+        upload.stream_header = new_stream_header()
+        upload.multipart_id = field.storage.create_multipart(upload.storage_name)
+    else:
+        blob, upload.storage_name = create_blob(field.storage, name)
+        with blob:
+            blob.write(new_stream_header())
+            blob.truncate(encrypted_size(size))
+    upload.save()
+    return upload
+
+
+def _encrypt_chunk(upload, frames, index, stream, out):
+    length = upload.chunk_length(index)
+    frames_per_chunk = upload.chunk_size // frames.chunk_size
+    last_frame = max(1, -(-upload.file_size // frames.chunk_size)) - 1
+    frame_index = index * frames_per_chunk
+
+    pipeline = FramePipeline()
+    remaining = length
+    try:
+        while remaining:
+            data = read_exact(stream, min(frames.chunk_size, remaining))
+            if not data:
+                raise ValueError(f"Chunk {index} must be {length} bytes.")
+            for frame in pipeline.submit(frames.encrypt, frame_index, data, frame_index == last_frame):
+                out.write(frame)
+            remaining -= len(data)
+            frame_index += 1
+        for frame in pipeline.finish():
+            out.write(frame)
+    finally:
+        pipeline.cancel()
+    if stream.read(1):
+        raise ValueError(f"Chunk {index} must be {length} bytes.")
+
+
+def _claim_chunk(upload, index, data):
+    digest = hashlib.sha256(data).hexdigest()
+    part, _ = ChunkedUploadPart.objects.get_or_create(
+        upload=upload, index=index, defaults={'digest': digest, 'pending': True},
+    )
+    if part.digest != digest:
+        raise ChunkMismatch(f"Chunk {index} was already sent with different content.")
+    return part
+
+
+def write_upload_chunk(upload, index, stream):
+    """Encrypts upload chunk `index` from `stream` into its frames of the upload's blob.
+
+    Raises ValueError if the index is out of range or the body has the wrong length,
+    and ChunkMismatch if the chunk was sent before with other bytes.
+    """
+    if not 0 <= index < upload.chunk_count:
+        raise ValueError("Chunk index out of range.")
+    length = upload.chunk_length(index)
+    # Held in memory (one chunk, UPLOAD_CHUNK_SIZE or the storage's part size) so its
+    # digest is known before a single frame is encrypted
+    data = read_exact(stream, length)
+    if len(data) != length or stream.read(1):
+        raise ValueError(f"Chunk {index} must be {length} bytes.")
+    part = _claim_chunk(upload, index, data)
+    _write_chunk(upload, index, BytesIO(data))
+    if part.pending:
+        part.pending = False
+        part.save(update_fields=['pending'])
+
+
+def _write_chunk(upload, index, stream):
+    storage = Transfer._meta.get_field('encrypted_file').storage
+
+    with timed('upload_chunk', upload.chunk_length(index)):
+        if upload.multipart_id:
+            header = bytes(upload.stream_header)
+            part = BytesIO()
+            if index == 0:
+                # The first part starts the container
+                part.write(header)
+            _encrypt_chunk(upload, FrameCipher(upload.data_key, header), index, stream, part)
+            storage.upload_part(upload.storage_name, upload.multipart_id, index + 1, part.getvalue())
+            return
+
+        with open(storage.path(upload.storage_name), 'r+b') as blob:
+            frames = FrameCipher(upload.data_key, blob.read(HEADER_SIZE))
+            blob.seek(frames.frame_offset(index * (upload.chunk_size // frames.chunk_size)))
+            _encrypt_chunk(upload, frames, index, stream, blob)
+
+
+def finalize_chunked_upload(upload):
+    """Makes the blob of a complete resumable upload readable under upload.storage_name."""
+    if upload.multipart_id:
+        storage = Transfer._meta.get_field('encrypted_file').storage
+        storage.complete_multipart(upload.storage_name, upload.multipart_id)
+        # A retried finalize must not try to complete it again
+        upload.multipart_id = ''
+        upload.save(update_fields=['multipart_id'])
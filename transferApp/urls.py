@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -5,7 +6,15 @@ app_name = 'transferApp'
 
 urlpatterns = [
     path('', views.landing_page, name='home'),  # Main landing page
-    path('send/', views.send_view, name='send'),
-    path('receive/', views.receive_view, name='receive'),
+    path('send/', views.send_view_async if settings.ASYNC_VIEWS else views.send_view, name='send'),
+    path('receive/', views.receive_view_async if settings.ASYNC_VIEWS else views.receive_view, name='receive'),
     path('r/<str:code>/', views.receive_direct_view, name='receive_direct'),
+    path('r/<str:code>/qr.<str:fmt>', views.qr_code_view, name='qr_code'),
+    path('r/<str:code>/download/', views.download_view_async if settings.ASYNC_VIEWS else views.download_view,
+         name='download'),
+    path('send/uploads/', views.upload_init_view, name='upload_init'),
+    path('send/uploads/<uuid:upload_id>/', views.upload_status_view, name='upload_status'),
+    path('send/uploads/<uuid:upload_id>/chunks/<int:index>/', views.upload_chunk_view, name='upload_chunk'),
+    path('send/uploads/<uuid:upload_id>/finalize/', views.upload_finalize_view, name='upload_finalize'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,11 +1,45 @@
 import os
+import asyncio
 import base64
-from cryptography.fernet import Fernet
+import functools
+import hashlib
+import itertools
+import mimetypes
+import struct
+import tempfile
+from collections import deque
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import qrcode
 from io import BytesIO
-from django.core.files.base import ContentFile
+from asgiref.sync import sync_to_async
+from django.core.files import File
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .compression import CODEC_FLAGS, COMPRESSION_FLAGS, compressor, decompress_chunks
+from .metrics import TimedReader, timed, timed_chunks
+from .workers import frame_pool
+
+# Chunked container ("PXLK" v1):
+#   header = MAGIC | version | flags | chunk_size | nonce_prefix
+#   frames = AES-GCM(chunk) for every plaintext chunk, each frame chunk_size + 16 bytes
+#            except the last one, which may be shorter (and is empty for empty input).
+# The frame nonce is nonce_prefix | frame index | final flag, so frames can't be
+# reordered, dropped or truncated without failing authentication.
+# `flags` records the compression codec of the framed bytes (see compression.py).
+STREAM_MAGIC = b'PXLK'
+STREAM_VERSION = 1
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_TAG_SIZE = 16
+_HEADER = struct.Struct('>4sBBI7s')
+HEADER_SIZE = _HEADER.size
+# Frames per frame-pool task in parallel mode (1MB of 64KB frames, see FramePipeline)
+FRAMES_PER_TASK = 16
+
 
 def generate_key(password=None, salt=None):
     """Generates a Fernet key. If password is provided, derives key using PBKDF2."""
@@ -23,20 +57,421 @@ def generate_key(password=None, salt=None):
     else:
         return Fernet.generate_key(), None
 
-def encrypt_file(file_handle, key):
-    
-    f = Fernet(key)
-    file_data = file_handle.read()
-    encrypted_data = f.encrypt(file_data)
-    return ContentFile(encrypted_data)
+
+def _as_bytes(key):
+    # BinaryField values come back as memoryview on some backends
+    if isinstance(key, str):
+        return key.encode()
+    return bytes(key)
+
+
+def _stream_cipher(key):
+    """Derives the AES-256-GCM key for the chunked container from a Fernet-style key."""
+    raw_key = base64.urlsafe_b64decode(_as_bytes(key))
+    subkey = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'pixelock stream v1',
+    ).derive(raw_key)
+    return AESGCM(subkey)
+
+
+def new_stream_header(chunk_size=STREAM_CHUNK_SIZE, flags=0):
+    return _HEADER.pack(STREAM_MAGIC, STREAM_VERSION, flags, chunk_size, os.urandom(7))
+
+
+def encrypted_size(plaintext_size, chunk_size=STREAM_CHUNK_SIZE):
+    """Size of the chunked container for a plaintext of `plaintext_size` bytes."""
+    frames = max(1, -(-plaintext_size // chunk_size))
+    return HEADER_SIZE + plaintext_size + frames * STREAM_TAG_SIZE
+
+
+class FrameCipher:
+    """Encrypts/decrypts individual frames of a chunked container.
+
+    Frames are independent, so they can be produced or read in any order; this is
+    what resumable uploads and range downloads build on.
+    """
+
+    def __init__(self, key, header):
+        if len(header) < HEADER_SIZE or not header.startswith(STREAM_MAGIC):
+            raise InvalidToken
+        _, version, self.flags, self.chunk_size, self._prefix = _HEADER.unpack(header[:HEADER_SIZE])
+        if version != STREAM_VERSION:
+            raise InvalidToken
+        self.header = header[:HEADER_SIZE]
+        self.frame_size = self.chunk_size + STREAM_TAG_SIZE
+        self._cipher = _stream_cipher(key)
+
+    def _nonce(self, index, final):
+        return self._prefix + struct.pack('>I', index) + (b'\x01' if final else b'\x00')
+
+    def frame_offset(self, index):
+        return HEADER_SIZE + index * self.frame_size
+
+    def encrypt(self, index, chunk, final):
+        return self._cipher.encrypt(self._nonce(index, final), bytes(chunk), self.header)
+
+    def decrypt(self, index, frame, final):
+        try:
+            return self._cipher.decrypt(self._nonce(index, final), frame, self.header)
+        except InvalidTag:
+            raise InvalidToken
+
+
+class FramePipeline:
+    """Runs frame jobs (FrameCipher.encrypt/decrypt calls) and hands their results back in order.
+
+    With CRYPTO_PARALLEL_WORKERS set, jobs are grouped into tasks of FRAMES_PER_TASK
+    frames (one 64KB frame is too little work to be worth a thread hop) and up to the
+    pool's window of tasks per pipeline run at once, so one large stream keeps
+    several cores busy. Otherwise, and for streams of a single frame, jobs run inline.
+    """
+
+    def __init__(self):
+        self._executor, self._window = frame_pool()
+        self._batch = []
+        self._pending = deque()
+
+    def _flush(self):
+        if self._batch:
+            self._pending.append(self._executor.submit(_run_jobs, self._batch))
+            self._batch = []
+
+    def submit(self, func, *args):
+        """Queues func(*args); returns the results that are ready, oldest first."""
+        if self._executor is None:
+            return [func(*args)]
+        self._batch.append((func, args))
+        if len(self._batch) >= FRAMES_PER_TASK:
+            self._flush()
+        ready = []
+        while self._pending and (len(self._pending) > self._window or self._pending[0].done()):
+            ready += self._pending.popleft().result()
+        return ready
+
+    def finish(self, func=None, *args):
+        """Runs a last job (if given) and returns every result still outstanding."""
+        if self._executor is None or not (self._pending or self._batch):
+            return [func(*args)] if func is not None else []
+        if func is not None:
+            self._batch.append((func, args))
+        self._flush()
+        try:
+            return [result for future in self._pending for result in future.result()]
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._batch = []
+
+
+def _run_jobs(jobs):
+    return [func(*args) for func, args in jobs]
+
+
+def read_exact(file_handle, size):
+    """Reads up to `size` bytes, only returning short at end of file."""
+    parts = []
+    remaining = size
+    while remaining:
+        data = file_handle.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+class StreamEncryptor:
+    """Incremental writer for the chunked container.
+
+    Feed plaintext with update() in pieces of any size and call finalize() once;
+    both return the container bytes that are ready to be written out. With a
+    `codec` ('zlib' or 'zstd') the plaintext is compressed before it is framed.
+    """
+
+    def __init__(self, key, chunk_size=STREAM_CHUNK_SIZE, codec=''):
+        self._frames = FrameCipher(key, new_stream_header(chunk_size, flags=CODEC_FLAGS[codec] if codec else 0))
+        self._compressor = compressor(codec) if codec else None
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._index = 0
+        self._started = False
+        self._pipeline = FramePipeline()
+
+    def _frame(self, chunk, final):
+        # `chunk` is a copy, so frames still in the pipeline don't see the buffer change
+        index, self._index = self._index, self._index + 1
+        if final:
+            return self._pipeline.finish(self._frames.encrypt, index, chunk, final)
+        return self._pipeline.submit(self._frames.encrypt, index, chunk, final)
+
+    def _take_header(self):
+        if self._started:
+            return b''
+        self._started = True
+        return self._frames.header
+
+    def update(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        return self._push(data)
+
+    def _push(self, data):
+        self._buffer += data
+        out = [self._take_header()]
+        # Keep at least one byte back so the last frame can carry the final flag
+        while len(self._buffer) > self._chunk_size:
+            out += self._frame(self._buffer[:self._chunk_size], final=False)
+            del self._buffer[:self._chunk_size]
+        return b''.join(out)
+
+    def finalize(self):
+        out = [self._push(self._compressor.flush()) if self._compressor is not None else self._take_header()]
+        out += self._frame(bytes(self._buffer), final=True)
+        self._buffer = bytearray()
+        return b''.join(out)
+
+
+def encrypt_stream(file_handle, key, chunk_size=STREAM_CHUNK_SIZE, codec=''):
+    """Yields the chunked container for `file_handle`, holding one chunk in memory at a time."""
+    encryptor = StreamEncryptor(key, chunk_size, codec)
+    while True:
+        data = file_handle.read(chunk_size)
+        if not data:
+            break
+        block = encryptor.update(data)
+        if block:
+            yield block
+    yield encryptor.finalize()
+
+
+def decrypt_stream(file_handle, key):
+    """Yields plaintext chunks from a chunked container or a legacy Fernet blob.
+
+    Raises cryptography.fernet.InvalidToken if the data is corrupt, truncated or the key is wrong.
+    """
+    head = read_exact(file_handle, HEADER_SIZE)
+    if not head.startswith(STREAM_MAGIC):
+        # Legacy whole-file Fernet token (transfers created before the chunked format)
+        yield Fernet(_as_bytes(key)).decrypt(head + file_handle.read())
+        return
+
+    frames = FrameCipher(key, head)
+    if frames.flags & COMPRESSION_FLAGS:
+        yield from decompress_chunks(_decrypt_frames(file_handle, frames), frames.flags)
+    else:
+        yield from _decrypt_frames(file_handle, frames)
+
+
+def _decrypt_frames(file_handle, frames):
+    pipeline = FramePipeline()
+    index = 0
+    frame = read_exact(file_handle, frames.frame_size)
+    if not frame:
+        raise InvalidToken
+    try:
+        while True:
+            next_frame = read_exact(file_handle, frames.frame_size) if len(frame) == frames.frame_size else b''
+            if not next_frame:
+                yield from pipeline.finish(frames.decrypt, index, frame, True)
+                break
+            yield from pipeline.submit(frames.decrypt, index, frame, False)
+            frame = next_frame
+            index += 1
+    finally:
+        pipeline.cancel()
+
+
+def decrypt_field_file(field_file, key):
+    """Yields the plaintext of a stored FieldFile, opening it only once iteration starts."""
+    with field_file.open('rb') as encrypted:
+        yield from decrypt_stream(encrypted, key)
+
+
+def decrypted_size(file_handle, total_size):
+    """Returns the plaintext length of a chunked container without decrypting it.
+
+    Returns None for legacy Fernet blobs and compressed containers. The file
+    position is left unchanged.
+    """
+    position = file_handle.tell()
+    head = read_exact(file_handle, HEADER_SIZE)
+    file_handle.seek(position)
+    if len(head) < HEADER_SIZE or not head.startswith(STREAM_MAGIC):
+        return None
+    _, _, flags, chunk_size, _ = _HEADER.unpack(head)
+    if flags & COMPRESSION_FLAGS:
+        return None
+    body = total_size - HEADER_SIZE
+    frames = max(1, -(-body // (chunk_size + STREAM_TAG_SIZE)))
+    return body - frames * STREAM_TAG_SIZE
+
+
+def decrypt_range(file_handle, key, start, end, total_size):
+    """Yields plaintext bytes start..end (inclusive) of a chunked container.
+
+    Only the frames covering the range are read and decrypted.
+    """
+    file_handle.seek(0)
+    frames = FrameCipher(key, read_exact(file_handle, HEADER_SIZE))
+    last_frame = max(1, -(-(total_size - HEADER_SIZE) // frames.frame_size)) - 1
+    first_index, last_index = start // frames.chunk_size, end // frames.chunk_size
+
+    def decrypt_part(index, frame):
+        chunk = frames.decrypt(index, frame, final=index == last_frame)
+        chunk_start = index * frames.chunk_size
+        return chunk[max(start - chunk_start, 0):end - chunk_start + 1]
+
+    pipeline = FramePipeline()
+    file_handle.seek(frames.frame_offset(first_index))
+    try:
+        for index in range(first_index, last_index):
+            yield from pipeline.submit(decrypt_part, index, read_exact(file_handle, frames.frame_size))
+        yield from pipeline.finish(decrypt_part, last_index, read_exact(file_handle, frames.frame_size))
+    finally:
+        pipeline.cancel()
+
+
+def parse_range_header(header, length):
+    """Parses a single `bytes=` range into inclusive (start, end).
+
+    Returns None when the header should be ignored (absent, malformed or multi-range)
+    and raises ValueError when the range can't be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, sep, last = header[len('bytes='):].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else length - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(length - int(last), 0), length - 1
+    except ValueError:
+        return None
+    if start > end and first and last:
+        return None
+    if start >= length or end < start:
+        raise ValueError
+    return start, min(end, length - 1)
+
+
+def decrypted_file_response(request, field_file, key, filename):
+    """Streams a decrypted FieldFile back to the client chunk by chunk.
+
+    Single `Range` requests (honouring `If-Range`) get a 206 that only decrypts
+    the frames covering the range. The first chunk is decrypted before the
+    response is built, so a wrong key or a corrupt header raises InvalidToken
+    here rather than halfway through the download.
+    """
+    encrypted = TimedReader(field_file.open('rb'))
+    total_size = field_file.size
+    etag = f'"{hashlib.sha256(f"{field_file.name}:{total_size}".encode()).hexdigest()[:32]}"'
+    status, byte_range = 200, None
+    try:
+        length = decrypted_size(encrypted, total_size)
+        if length is not None and request.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = parse_range_header(request.headers.get('Range'), length)
+            except ValueError:
+                encrypted.close()
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{length}'
+                return response
+        if byte_range:
+            status = 206
+            chunks = decrypt_range(encrypted, key, byte_range[0], byte_range[1], total_size)
+        else:
+            chunks = decrypt_stream(encrypted, key)
+        chunks = timed_chunks('decrypt', chunks, encrypted)
+        first = next(chunks, b'')
+    except Exception:
+        encrypted.close()
+        raise
+
+    content_type, _ = mimetypes.guess_type(filename)
+    response = StreamingHttpResponse(
+        itertools.chain([first], chunks),
+        content_type=content_type or 'application/octet-stream',
+        status=status,
+    )
+    response._resource_closers.append(encrypted.close)
+    if length is not None:
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Content-Length'] = str(length)
+    if byte_range:
+        response['Content-Range'] = f'bytes {byte_range[0]}-{byte_range[1]}/{length}'
+        response['Content-Length'] = str(byte_range[1] - byte_range[0] + 1)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+async def iterate_in_thread(iterator):
+    # Each step reads and decrypts one frame on a worker thread, keeping the event loop free
+    done = object()
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, done)
+        if chunk is done:
+            break
+        yield chunk
+
+
+async def async_decrypted_file_response(request, field_file, key, filename):
+    """ASGI variant of decrypted_file_response: file I/O and decryption run off the event loop."""
+    response = await sync_to_async(decrypted_file_response, thread_sensitive=False)(
+        request, field_file, key, filename
+    )
+    if response.streaming:
+        response.streaming_content = iterate_in_thread(iter(response.streaming_content))
+    return response
+
+
+def encrypt_file(file_handle, key, codec=''):
+    """Encrypts into an anonymous temp file so memory use stays bounded by the chunk size."""
+    encrypted = tempfile.TemporaryFile()
+    with timed('encrypt') as timer:
+        for block in encrypt_stream(file_handle, key, codec=codec):
+            encrypted.write(block)
+        timer.nbytes = encrypted.tell()
+    encrypted.seek(0)
+    return File(encrypted)
+
+
+@timed('encrypt')
+def encrypt_bytes(data, key, codec=''):
+    """Returns the chunked container for a small in-memory payload (see decrypt_file_data)."""
+    return b''.join(encrypt_stream(BytesIO(data), key, codec=codec))
+
+
+def wrap_key(key, wrapping_key):
+    """Encrypts a data key under another key (e.g. one derived from a password)."""
+    return Fernet(_as_bytes(wrapping_key)).encrypt(_as_bytes(key))
+
+
+def unwrap_key(wrapped_key, wrapping_key):
+    return Fernet(_as_bytes(wrapping_key)).decrypt(_as_bytes(wrapped_key))
+
 
 def decrypt_file_data(encrypted_data, key):
-   
-    f = Fernet(key)
-    return f.decrypt(encrypted_data)
+    with timed('decrypt', len(encrypted_data)):
+        return b''.join(decrypt_stream(BytesIO(encrypted_data), key))
+
+
+# Rendered QR codes kept per (link, format); a code is rendered once however often its page is viewed
+QR_CACHE_SIZE = 1024
+
 
-def generate_qr_code(data):
-    
+def _make_qr(data):
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -45,8 +480,47 @@ def generate_qr_code(data):
     )
     qr.add_data(data)
     qr.make(fit=True)
+    return qr
+
+
+def _qr_svg(matrix):
+    # Each horizontal run of dark modules is one 1-unit-wide stroke through the row's
+    # middle, moved to relative to the end of the previous run; the <img> scales it
+    size = len(matrix)
+    runs = []
+    x = y = 0
+    for row_index, row in enumerate(matrix):
+        column = 0
+        while column < size:
+            if not row[column]:
+                column += 1
+                continue
+            start = column
+            while column < size and row[column]:
+                column += 1
+            runs.append(f'm{start - x} {row_index - y}h{column - start}' if runs else f'M{start} {row_index}.5h{column - start}')
+            x, y = column, row_index
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path stroke="#000" d="{"".join(runs)}"/></svg>'
+    ).encode()
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+@timed('qr')
+def render_qr_code(data, fmt='png'):
+    """Returns the QR code for `data` as PNG or SVG bytes.
+
+    The PNG is the smaller of the two (about 0.7KB against 1.6KB for a transfer
+    link); the SVG only wins once gzipped (about 0.45KB).
+    """
+    qr = _make_qr(data)
+    if fmt == 'svg':
+        return _qr_svg(qr.get_matrix())
+    if fmt != 'png':
+        raise ValueError(f"Unsupported QR format: {fmt}")
 
     img = qr.make_image(fill_color="black", back_color="white")
     buffer = BytesIO()
     img.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode()
+    return buffer.getvalue()
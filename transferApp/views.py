@@ -1,76 +1,303 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, Http404
+from django.shortcuts import render, get_object_or_404
+from django.http import HttpResponse, HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
-from django.contrib.auth.hashers import make_password, check_password
+from django.contrib.auth.hashers import check_password
 from django.conf import settings
 from django.utils import timezone
-import os
-import mimetypes
+from django.utils.crypto import salted_hmac
+from django.utils.http import urlencode
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from asgiref.sync import sync_to_async
+from cryptography.fernet import Fernet, InvalidToken
+from django.views.decorators.http import condition, require_GET, require_POST, require_http_methods, require_safe
+from django.utils.cache import add_never_cache_headers, patch_cache_control
+from django.db import transaction as db_transaction
+import base64
+import hashlib
+from io import BytesIO
 import uuid
 
-from .forms import SendForm, ReceiveForm
-from .models import Transfer
-from .utils import generate_key, encrypt_file, decrypt_file_data, generate_qr_code
+from coreApp import history
 
+from .compression import SAMPLE_SIZE, choose_codec
+from .forms import SendForm, ReceiveForm, UploadInitForm, UploadFinalizeForm, TOO_MANY_FILES
+from .images import process_image, process_upload
+from .kdf import KdfBusy, derive_password_secrets, run_kdf, verify_password
+from .metrics import render_metrics, timed
+from .models import Transfer, TransferItem, ChunkedUpload
+from .ratelimit import BAD_CODES, BAD_PASSWORDS, RECEIVE_REQUESTS, client_ip, ratelimit
+from .upload_handlers import (
+    ChunkMismatch, EncryptingUploadHandler, finalize_chunked_upload, parse_upload, start_chunked_upload,
+    write_upload_chunk,
+)
+from .utils import (
+    generate_key, wrap_key, unwrap_key, decrypted_file_response, async_decrypted_file_response, render_qr_code,
+    decrypt_field_file, iterate_in_thread, encrypt_bytes, encrypt_file, decrypt_file_data,
+)
+from .workers import map_in_pool
+from .zipstream import zip_stream
+
+def set_transfer_key(transfer, encryption_key, password=None):
+    """Stores what the receiver needs to recover the data key of `transfer`."""
+    transfer.is_password_protected = bool(password)
+    if password:
+        # One KDF pass gives both the verifier and the key that wraps the data key
+        password_key, verifier, salt, params = derive_password_secrets(password)
+        transfer.password_hash = verifier
+        transfer.encryption_salt = salt
+        transfer.kdf_params = params
+        transfer.server_key = wrap_key(encryption_key, password_key)
+    else:
+        # No password, we must temporarily store the key to allow decryption
+        transfer.server_key = encryption_key
+
+
+def build_transfer(transfer, uploaded_files, password=None):
+    """Points `transfer` at its encrypted uploads and returns the unsaved TransferItems.
+
+    A single file is stored on the transfer itself and its data key is the transfer
+    key. Several files become items whose data keys are wrapped by one fresh
+    transfer key, so a password still costs one KDF run. Raises KdfBusy.
+    """
+    if len(uploaded_files) == 1:
+        uploaded_file = uploaded_files[0]
+        transfer.original_filename = uploaded_file.name
+        transfer.file_size = uploaded_file.size
+        set_transfer_key(transfer, uploaded_file.key, password)
+        # Point the model at the ciphertext the upload handler already wrote
+        transfer.encrypted_file.name = uploaded_file.claim()
+        return []
+
+    transfer_key = Fernet.generate_key()
+    set_transfer_key(transfer, transfer_key, password)
+    transfer.original_filename = f"{len(uploaded_files)} files"
+    transfer.file_size = sum(uploaded_file.size for uploaded_file in uploaded_files)
+    transfer.item_count = len(uploaded_files)
+    return [
+        TransferItem(
+            transfer=transfer,
+            position=position,
+            encrypted_file=uploaded_file.claim(),
+            original_filename=uploaded_file.name,
+            file_size=uploaded_file.size,
+            wrapped_key=wrap_key(uploaded_file.key, transfer_key),
+        )
+        for position, uploaded_file in enumerate(uploaded_files)
+    ]
+
+
+def build_text_transfer(transfer, text, password=None):
+    """Encrypts a text message into `transfer` and returns its (empty) item list.
+
+    Messages up to INLINE_TEXT_MAX_BYTES are kept in the row, so sending one is a
+    single insert and receiving it a single select, with no storage I/O. Longer
+    ones become an ordinary single-file transfer of message.txt. Raises KdfBusy.
+    """
+    data = text.encode('utf-8')
+    key, _ = generate_key()
+    set_transfer_key(transfer, key, password)
+    transfer.original_filename = 'message.txt'
+    transfer.file_size = len(data)
+    codec = choose_codec(data[:SAMPLE_SIZE], 'text/plain')
+    if len(data) <= settings.INLINE_TEXT_MAX_BYTES:
+        transfer.encrypted_text = encrypt_bytes(data, key, codec)
+    else:
+        encrypted = encrypt_file(BytesIO(data), key, codec)
+        with timed('storage_write', len(data)):
+            transfer.encrypted_file.save(f"{uuid.uuid4()}.enc", encrypted, save=False)
+    return []
+
+
+def save_transfer(transfer, items):
+    with db_transaction.atomic():
+        transfer.save()
+        TransferItem.objects.bulk_create(items)
+
+
+def transfer_download(request, form, transfer, decryption_key):
+    """Answers a receive POST once the transfer's key is known.
+
+    Inline text is shown on the page. Files aren't streamed in answer to the POST:
+    it redirects to their download_url(), a GET that browsers and download managers
+    can resume or split into ranges. Multi-file transfers show their item list
+    first; the receiver then posts back `item` with a position, or 'all' for every
+    item streamed as one zip.
+    """
+    if transfer.is_text:
+        text = decrypt_file_data(bytes(transfer.encrypted_text), decryption_key).decode('utf-8')
+        response = render(request, 'receive.html', {'form': form, 'transfer': transfer, 'text': text})
+        add_never_cache_headers(response)
+        return response
+    if not transfer.item_count:
+        return _download_redirect(transfer, decryption_key)
+
+    items = list(transfer.items.order_by('position'))
+    choice = request.POST.get('item', '')
+    if choice == 'all' or any(str(item.position) == choice for item in items):
+        return _download_redirect(transfer, decryption_key, choice)
+    context = {'form': form, 'transfer': transfer, 'items': items}
+    if transfer.is_password_protected:
+        # The list posts back this token with each pick instead of the password
+        context['download_token'] = download_token(transfer, decryption_key)
+    response = render(request, 'receive.html', context)
+    add_never_cache_headers(response)
+    return response
+
+
+def transfer_file_response(request, transfer, decryption_key, choice=''):
+    """Streams the file of `transfer`, its item at position `choice`, or all its items as a zip ('all').
+
+    Returns None if `choice` doesn't name an item of a multi-file transfer.
+    """
+    if not transfer.item_count:
+        return decrypted_file_response(request, transfer.encrypted_file, decryption_key, transfer.original_filename)
+
+    items = list(transfer.items.order_by('position'))
+    if choice == 'all':
+        date_time = timezone.localtime(transfer.created_at).timetuple()[:6]
+        entries = (
+            (item.original_filename, date_time,
+             decrypt_field_file(item.encrypted_file, unwrap_key(item.wrapped_key, decryption_key)))
+            for item in items
+        )
+        response = StreamingHttpResponse(zip_stream(entries), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="pixelock-{transfer.unique_code}.zip"'
+        return response
+
+    item = next((item for item in items if str(item.position) == choice), None)
+    if item is None:
+        return None
+    return decrypted_file_response(
+        request, item.encrypted_file, unwrap_key(item.wrapped_key, decryption_key), item.original_filename
+    )
+
+
+# Seconds a download link (or item list) keeps working after the password was checked
+DOWNLOAD_TOKEN_MAX_AGE = 60 * 60
+
+
+def _download_fernet():
+    return Fernet(base64.urlsafe_b64encode(
+        salted_hmac('transferApp.views.download_token', 'fernet', algorithm='sha256').digest()
+    ))
+
+
+def download_token(transfer, decryption_key):
+    """Returns a token that stands in for the code and password of `transfer` for DOWNLOAD_TOKEN_MAX_AGE seconds.
+
+    The data key is encrypted under a key derived from SECRET_KEY, so neither the
+    item list nor a download link ever carries the password.
+    """
+    return _download_fernet().encrypt(f'{transfer.unique_code}:'.encode() + decryption_key).decode()
+
+
+def download_token_key(transfer, token):
+    """Returns the data key a download_token() for `transfer` carries, or None if it isn't valid (any more)."""
+    if not token:
+        return None
+    try:
+        payload = _download_fernet().decrypt(token.encode(), ttl=DOWNLOAD_TOKEN_MAX_AGE)
+    except InvalidToken:
+        return None
+    code, _, decryption_key = payload.partition(b':')
+    return decryption_key if code == transfer.unique_code.encode() else None
+
+
+def download_url(transfer, decryption_key, item=''):
+    """GET link serving transfer_file_response() without the code check, rate limits or KDF run again."""
+    query = {'token': download_token(transfer, decryption_key)}
+    if item:
+        query['item'] = item
+    return f"{reverse('transferApp:download', args=[transfer.unique_code])}?{urlencode(query)}"
+
+
+def _download_redirect(transfer, decryption_key, item=''):
+    # 303: the browser follows up with a GET of the link, whatever the method was
+    response = HttpResponseRedirect(download_url(transfer, decryption_key, item), status=303)
+    add_never_cache_headers(response)
+    return response
+
+
+def password_decryption_key(transfer, password):
+    """Returns the data key of a password-protected transfer, or None if the password is wrong."""
+    if transfer.kdf_params:
+        password_key = verify_password(password, transfer.encryption_salt, transfer.kdf_params, transfer.password_hash)
+        return unwrap_key(transfer.server_key, password_key) if password_key else None
+
+    # Older transfers: Django password hash plus a separate PBKDF2 run
+    if not check_password(password, transfer.password_hash):
+        return None
+    key, _ = run_kdf(generate_key, password, bytes(transfer.encryption_salt))
+    if transfer.server_key:
+        # Data key wrapped by the password key
+        key = unwrap_key(transfer.server_key, key)
+    return key
+
+
+@csrf_exempt
 def send_view(request):
+    # The upload handler has to be installed before CSRF middleware reads request.POST,
+    # so CSRF is checked in _send_view instead.
+    if request.method != 'POST':
+        return _send_view(request)
+
+    transfer = Transfer()
+    handler = EncryptingUploadHandler(
+        request,
+        Transfer._meta.get_field('encrypted_file'),
+        transfer,
+        filename=lambda: f"{uuid.uuid4()}.enc",
+    )
+    request.upload_handlers.insert(0, handler)
+    request.pending_transfer = transfer
+    try:
+        if not parse_upload(request):
+            return render(request, 'send.html', {'form': SendForm(), 'upload_error': TOO_MANY_FILES}, status=400)
+        return _send_view(request)
+    finally:
+        handler.discard_unclaimed()
+
+
+@csrf_protect
+def _send_view(request):
     # Matches Image 4 template
     if request.method == 'POST':
         form = SendForm(request.POST, request.FILES)
         if form.is_valid():
-            uploaded_file = form.cleaned_data.get('file')
+            uploaded_files = form.cleaned_data.get('file')
+            text = form.cleaned_data.get('text_content')
             password = form.cleaned_data.get('password')
-            # text_content handling omitted for brevity, focusing on image encryption as requested
-
-            if uploaded_file:
-                # 1. Generate Encryption Key/Salt
-                encryption_key, salt = generate_key(password if password else None)
-
-                # 2. Encrypt the file
-                encrypted_file_content = encrypt_file(uploaded_file, encryption_key)
-
-                # 3. Create Transfer Object
-                transfer = Transfer(
-                    original_filename=uploaded_file.name,
-                    file_size=uploaded_file.size,
-                    is_password_protected=bool(password),
-                    encryption_salt=salt,
-                )
-
-                if password:
-                    transfer.password_hash = make_password(password)
-                    # Key is derived from password on receipt, don't store it.
+
+            # 1. Create Transfer Object (its unique_id already named the blobs' folder)
+            transfer = request.pending_transfer
+            try:
+                if uploaded_files:
+                    # Each file was encrypted with a fresh data key while it was uploaded.
+                    # Photos may be stripped of metadata / re-encoded (see the IMAGE_* settings)
+                    map_in_pool(process_upload, uploaded_files)
+                    items = build_transfer(transfer, uploaded_files, password)
                 else:
-                    # No password, we must temporarily store the key to allow decryption
-                    transfer.server_key = encryption_key
-                
-                # Save encrypted file to model
-                transfer.encrypted_file.save(f"{uuid.uuid4()}.enc", encrypted_file_content)
-                transfer.save()
-
-                # Generate sharing links/QR
-                download_link = request.build_absolute_uri(
-                    reverse('transferApp:receive_direct', args=[transfer.unique_code])
-                )
-                qr_image_base64 = generate_qr_code(download_link)
-
-                # Update session history (optional, based on Image 1)
-                history = request.session.get('transfer_history', [])
-                history.insert(0, {
-                    'type': 'sent',
-                    'filename': transfer.original_filename,
-                    'size': transfer.file_size,
-                    'date': timezone.now().isoformat()
-                })
-                request.session['transfer_history'] = history[:50] # Keep last 50
-
-                context = {
-                    'success': True,
-                    'transfer': transfer,
-                    'download_link': download_link,
-                    'qr_image': qr_image_base64
-                }
-                # Use the same send template, but with success state data
-                return render(request, 'send.html', context)
+                    items = build_text_transfer(transfer, text, password)
+            except KdfBusy:
+                form.add_error(None, "The server is busy. Please try again in a moment.")
+                return render(request, 'send.html', {'form': form}, status=503)
+            save_transfer(transfer, items)
+
+            # 2. Generate sharing link; the page loads its QR code from qr_code_view
+            download_link = request.build_absolute_uri(
+                reverse('transferApp:receive_direct', args=[transfer.unique_code])
+            )
+
+            # Update history (optional, based on Image 1)
+            history.record(request, 'sent', transfer)
+
+            context = {
+                'success': True,
+                'transfer': transfer,
+                'download_link': download_link,
+            }
+            # Use the same send template, but with success state data
+            return render(request, 'send.html', context)
 
     else:
         form = SendForm()
@@ -78,10 +305,15 @@ def send_view(request):
     return render(request, 'send.html', {'form': form})
 
 
+@ratelimit(RECEIVE_REQUESTS)
 def receive_view(request):
     # Matches Image 3 template
     if request.method == 'POST':
         form = ReceiveForm(request.POST)
+        if BAD_CODES.exceeded(client_ip(request)):
+            # This IP has been guessing codes
+            form.add_error('code_or_link', "Too many failed attempts. Try again in 15 minutes.")
+            return render(request, 'receive.html', {'form': form}, status=429)
         if form.is_valid():
             code_input = form.cleaned_data.get('code_or_link')
             password_input = form.cleaned_data.get('password')
@@ -92,6 +324,7 @@ def receive_view(request):
             try:
                 transfer = Transfer.objects.get(unique_code=code)
             except Transfer.DoesNotExist:
+                 BAD_CODES.hit(client_ip(request))
                  form.add_error('code_or_link', "Invalid code.")
                  return render(request, 'receive.html', {'form': form})
 
@@ -99,42 +332,45 @@ def receive_view(request):
                  form.add_error('code_or_link', "This transfer has expired.")
                  return render(request, 'receive.html', {'form': form})
 
+            token_key = download_token_key(transfer, request.POST.get('token'))
+            if token_key is not None:
+                # A pick from the item list, which proved the password when it was shown
+                decryption_key = token_key
             # Password Verification
-            if transfer.is_password_protected:
+            elif transfer.is_password_protected:
                 if not password_input:
                     # Re-render form asking for password
                     return render(request, 'receive.html', {'form': form, 'password_required': True})
-                
-                if not check_password(password_input, transfer.password_hash):
+
+                if BAD_PASSWORDS.exceeded(transfer.unique_code):
+                    form.add_error('password', "Too many wrong passwords. This transfer is locked for 15 minutes.")
+                    return render(request, 'receive.html', {'form': form, 'password_required': True}, status=429)
+
+                try:
+                    decryption_key = password_decryption_key(transfer, password_input)
+                except KdfBusy:
+                    form.add_error(None, "The server is busy. Please try again in a moment.")
+                    return render(request, 'receive.html', {'form': form, 'password_required': True}, status=503)
+
+                if decryption_key is None:
+                    BAD_PASSWORDS.hit(transfer.unique_code)
                     form.add_error('password', "Incorrect password.")
                     return render(request, 'receive.html', {'form': form, 'password_required': True})
-                
-                # Regenerate key from password
-                decryption_key, _ = generate_key(password_input, transfer.encryption_salt)
             else:
                 # Use stored server key
                 decryption_key = transfer.server_key
 
-            # Decrypt and serve
+            # Show the text or item list, or redirect to the file's download link
             try:
-                with open(transfer.encrypted_file.path, 'rb') as f:
-                    encrypted_data = f.read()
-                
-                decrypted_data = decrypt_file_data(encrypted_data, decryption_key)
-
-                # Serve file
-                content_type, _ = mimetypes.guess_type(transfer.original_filename)
-                response = HttpResponse(decrypted_data, content_type=content_type or 'application/octet-stream')
-                response['Content-Disposition'] = f'attachment; filename="{transfer.original_filename}"'
-                
-                # Update history
-                history = request.session.get('transfer_history', [])
-                history.insert(0, {'type': 'received', 'filename': transfer.original_filename, 'size': transfer.file_size, 'date': timezone.now().isoformat()})
-                request.session['transfer_history'] = history[:50]
+                response = transfer_download(request, form, transfer, decryption_key)
+
+                # Downloads are recorded by download_view
+                if transfer.is_text:
+                    history.record(request, 'received', transfer)
 
                 return response
 
-            except Exception as e:
+            except Exception:
                 # Handle decryption failure
                 return HttpResponse("Error decrypting file. The transfer may be corrupted.", status=500)
 
@@ -151,43 +387,305 @@ def receive_direct_view(request, code):
     form = ReceiveForm(initial={'code_or_link': code})
     return render(request, 'receive.html', {'form': form})
 
-#this here is the code for rate limiting which will prevent a ip enter wrong pin mltiple times and then block that ip for some time
+QR_CONTENT_TYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
 
-from django.core.cache import cache
-from django.shortcuts import render, redirect
 
-def receive_file(request):
-    # 1. Get User IP
-    user_ip = request.META.get('REMOTE_ADDR')
-    
-    # 2. Check if this IP is blocked
-    if cache.get(f"block_{user_ip}"):
-        return render(request, 'error.html', {'message': "Too many failed attempts. Try again in 15 minutes."})
+def _qr_etag(request, code, fmt):
+    link = request.build_absolute_uri(reverse('transferApp:receive_direct', args=[code]))
+    return hashlib.sha256(f'{fmt}:{link}'.encode()).hexdigest()[:32]
 
-    if request.method == 'POST':
-        code = request.POST.get('code_or_link')
-        
+
+# QR code of a transfer's direct link. The image only depends on the link, so it is
+# rendered on first request, kept in render_qr_code's LRU cache and cached by browsers.
+@require_GET
+@condition(etag_func=_qr_etag)
+def qr_code_view(request, code, fmt):
+    if fmt not in QR_CONTENT_TYPES or not (len(code) == 6 and code.isdigit()):
+        raise Http404("Unknown QR code.")
+    link = request.build_absolute_uri(reverse('transferApp:receive_direct', args=[code]))
+    response = HttpResponse(render_qr_code(link, fmt), content_type=QR_CONTENT_TYPES[fmt])
+    patch_cache_control(response, public=True, max_age=24 * 60 * 60, immutable=True)
+    return response
+
+# Prometheus scrape endpoint (see metrics.py); only answers addresses in METRICS_ALLOWED_IPS
+@require_GET
+def metrics_view(request):
+    if client_ip(request) not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+#resumable uploads: init -> PUT/POST numbered chunks (any order, retry freely) -> finalize
+
+@require_POST
+def upload_init_view(request):
+    form = UploadInitForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+
+    upload = start_chunked_upload(form.cleaned_data['filename'], form.cleaned_data['size'])
+    return JsonResponse({
+        'success': True,
+        'upload_id': str(upload.upload_id),
+        'chunk_size': upload.chunk_size,
+        'chunk_count': upload.chunk_count,
+    }, status=201)
+
+
+@require_http_methods(['PUT', 'POST'])
+def upload_chunk_view(request, upload_id, index):
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+    try:
+        write_upload_chunk(upload, index, request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except ChunkMismatch as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=409)
+    return JsonResponse({'success': True, 'index': index})
+
+
+@require_GET
+def upload_status_view(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+    missing = upload.missing_ranges()
+    return JsonResponse({
+        'upload_id': str(upload.upload_id),
+        'chunk_size': upload.chunk_size,
+        'chunk_count': upload.chunk_count,
+        'missing': missing,
+        'complete': not missing,
+    })
+
+
+@require_POST
+def upload_finalize_view(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+    missing = upload.missing_ranges()
+    if missing:
+        return JsonResponse({'success': False, 'message': "Upload incomplete.", 'missing': missing}, status=409)
+
+    form = UploadFinalizeForm(request.POST)
+    password = form.cleaned_data.get('password') if form.is_valid() else None
+    transfer = Transfer(
+        unique_id=upload.transfer_id,
+        original_filename=upload.original_filename,
+        file_size=upload.file_size,
+    )
+    transfer.encrypted_file.name = upload.storage_name
+    try:
+        set_transfer_key(transfer, bytes(upload.data_key), password)
+    except KdfBusy:
+        return JsonResponse({'success': False, 'message': "Server busy, retry finalize."}, status=503)
+    finalize_chunked_upload(upload)
+    # After the last point a retry could be asked for: the stage may replace the blob
+    image = process_image(
+        transfer.encrypted_file.storage, upload.storage_name, bytes(upload.data_key),
+        upload.original_filename, upload.file_size,
+    )
+    if image:
+        transfer.encrypted_file.name = image['name']
+        transfer.original_filename = image['filename']
+        transfer.file_size = image['size']
+    with db_transaction.atomic():
+        # Two finalize calls for one upload can both get this far: the row lock lets one
+        # save the transfer, and the other then finds the upload gone and answers with it
+        claimed = ChunkedUpload.objects.select_for_update().filter(pk=upload.pk).exists()
+        if claimed:
+            transfer.save()
+            upload.delete()
+        else:
+            rewritten = transfer.encrypted_file
+            transfer = get_object_or_404(Transfer, unique_id=upload.transfer_id)
+            if rewritten.name != transfer.encrypted_file.name:
+                rewritten.storage.delete(rewritten.name)
+
+    if claimed:
+        history.record(request, 'sent', transfer)
+    download_link = request.build_absolute_uri(
+        reverse('transferApp:receive_direct', args=[transfer.unique_code])
+    )
+    return JsonResponse({'success': True, 'code': transfer.unique_code, 'download_link': download_link})
+
+#async (ASGI) versions of send/receive: ORM calls are awaited and body parsing,
+#KDFs, crypto and file I/O run on worker threads so the event loop stays free
+
+async def arender(request, template_name, context=None, status=None):
+    return await sync_to_async(render)(request, template_name, context, status=status)
+
+
+@csrf_exempt
+async def send_view_async(request):
+    if request.method != 'POST':
+        return await arender(request, 'send.html', {'form': SendForm()})
+
+    transfer = Transfer()
+    handler = EncryptingUploadHandler(
+        request,
+        Transfer._meta.get_field('encrypted_file'),
+        transfer,
+        filename=lambda: f"{uuid.uuid4()}.enc",
+    )
+    request.upload_handlers.insert(0, handler)
+    request.pending_transfer = transfer
+    try:
+        # Parse before the CSRF check so the upload is encrypted on a worker thread
+        if not await sync_to_async(parse_upload, thread_sensitive=False)(request):
+            context = {'form': SendForm(), 'upload_error': TOO_MANY_FILES}
+            return await arender(request, 'send.html', context, status=400)
+        return await _send_view_async(request)
+    finally:
+        handler.discard_unclaimed()
+
+
+@csrf_protect
+async def _send_view_async(request):
+    form = SendForm(request.POST, request.FILES)
+    if form.is_valid():
+        uploaded_files = form.cleaned_data.get('file')
+        text = form.cleaned_data.get('text_content')
+        password = form.cleaned_data.get('password')
+
+        transfer = request.pending_transfer
         try:
-            # Try to find the file...
-            transfer = Transfer.objects.get(unique_code=code)
-            
-            # SUCCESS: Clear any previous bad attempts
-            cache.delete(f"attempts_{user_ip}")
-            return render(request, 'download.html', {'transfer': transfer})
-            
-        except Transfer.DoesNotExist:
-            # FAILURE: Increment attempt counter
-            key = f"attempts_{user_ip}"
-            attempts = cache.get(key, 0) + 1
-            cache.set(key, attempts, 300) # Store for 5 minutes
-            
-            # If 5 fails, BLOCK them for 15 mins
-            if attempts >= 3:
-                cache.set(f"block_{user_ip}", True, 900) 
-                
-            return render(request, 'receive.html', {'error': "Invalid Code."})
-            
-    return render(request, 'receive.html')
+            if uploaded_files:
+                await sync_to_async(map_in_pool, thread_sensitive=False)(process_upload, uploaded_files)
+                items = await sync_to_async(build_transfer, thread_sensitive=False)(transfer, uploaded_files, password)
+            else:
+                items = await sync_to_async(build_text_transfer, thread_sensitive=False)(transfer, text, password)
+        except KdfBusy:
+            form.add_error(None, "The server is busy. Please try again in a moment.")
+            return await arender(request, 'send.html', {'form': form}, status=503)
+        await sync_to_async(save_transfer)(transfer, items)
+
+        download_link = request.build_absolute_uri(
+            reverse('transferApp:receive_direct', args=[transfer.unique_code])
+        )
+        await history.arecord(request, 'sent', transfer)
+
+        return await arender(request, 'send.html', {
+            'success': True,
+            'transfer': transfer,
+            'download_link': download_link,
+        })
+
+    return await arender(request, 'send.html', {'form': form})
+
+
+@ratelimit(RECEIVE_REQUESTS)
+async def receive_view_async(request):
+    if request.method != 'POST':
+        return await arender(request, 'receive.html', {'form': ReceiveForm()})
+
+    form = ReceiveForm(request.POST)
+    if await BAD_CODES.aexceeded(client_ip(request)):
+        form.add_error('code_or_link', "Too many failed attempts. Try again in 15 minutes.")
+        return await arender(request, 'receive.html', {'form': form}, status=429)
+    if not form.is_valid():
+        return await arender(request, 'receive.html', {'form': form})
+
+    code_input = form.cleaned_data.get('code_or_link')
+    password_input = form.cleaned_data.get('password')
+    code = code_input.split('/')[-1] if '/' in code_input else code_input
+
+    try:
+        transfer = await Transfer.objects.aget(unique_code=code)
+    except Transfer.DoesNotExist:
+        await BAD_CODES.ahit(client_ip(request))
+        form.add_error('code_or_link', "Invalid code.")
+        return await arender(request, 'receive.html', {'form': form})
+
+    if transfer.is_expired:
+        form.add_error('code_or_link', "This transfer has expired.")
+        return await arender(request, 'receive.html', {'form': form})
+
+    token_key = download_token_key(transfer, request.POST.get('token'))
+    if token_key is not None:
+        decryption_key = token_key
+    elif transfer.is_password_protected:
+        if not password_input:
+            return await arender(request, 'receive.html', {'form': form, 'password_required': True})
+        if await BAD_PASSWORDS.aexceeded(transfer.unique_code):
+            form.add_error('password', "Too many wrong passwords. This transfer is locked for 15 minutes.")
+            return await arender(request, 'receive.html', {'form': form, 'password_required': True}, status=429)
+        try:
+            decryption_key = await sync_to_async(password_decryption_key, thread_sensitive=False)(
+                transfer, password_input
+            )
+        except KdfBusy:
+            form.add_error(None, "The server is busy. Please try again in a moment.")
+            return await arender(request, 'receive.html', {'form': form, 'password_required': True}, status=503)
+        if decryption_key is None:
+            await BAD_PASSWORDS.ahit(transfer.unique_code)
+            form.add_error('password', "Incorrect password.")
+            return await arender(request, 'receive.html', {'form': form, 'password_required': True})
+    else:
+        decryption_key = transfer.server_key
+
+    try:
+        response = await sync_to_async(transfer_download)(request, form, transfer, decryption_key)
+    except Exception:
+        return HttpResponse("Error decrypting file. The transfer may be corrupted.", status=500)
+
+    if transfer.is_text:
+        await history.arecord(request, 'received', transfer)
+    return response
+
+
+# Download links (see download_url). Range and If-Range requests are served straight
+# from the token, so resuming or fetching segments in parallel costs no KDF run and
+# isn't counted by RECEIVE_REQUESTS; the token can't be forged or guessed.
+DOWNLOAD_LINK_INVALID = "This download link is invalid or has expired. Enter the code again for a new one."
+
+
+def _download_key(request, transfer):
+    if transfer is None or transfer.is_expired:
+        return None
+    return download_token_key(transfer, request.GET.get('token'))
+
+
+@require_safe
+def download_view(request, code):
+    transfer = Transfer.objects.filter(unique_code=code).first()
+    decryption_key = _download_key(request, transfer)
+    if decryption_key is None:
+        return HttpResponse(DOWNLOAD_LINK_INVALID, status=403)
+    try:
+        response = transfer_file_response(request, transfer, decryption_key, request.GET.get('item', ''))
+    except Exception:
+        return HttpResponse("Error decrypting file. The transfer may be corrupted.", status=500)
+    if response is None:
+        raise Http404("Unknown item.")
+
+    # Update history (once per download, not for every resumed range)
+    if response.status_code == 200 and request.method == 'GET':
+        history.record(request, 'received', transfer)
+    return response
+
+
+@require_safe
+async def download_view_async(request, code):
+    transfer = await Transfer.objects.filter(unique_code=code).afirst()
+    decryption_key = _download_key(request, transfer)
+    if decryption_key is None:
+        return HttpResponse(DOWNLOAD_LINK_INVALID, status=403)
+    try:
+        if transfer.item_count:
+            response = await sync_to_async(transfer_file_response)(
+                request, transfer, decryption_key, request.GET.get('item', '')
+            )
+            if response is not None:
+                response.streaming_content = iterate_in_thread(iter(response.streaming_content))
+        else:
+            response = await async_decrypted_file_response(
+                request, transfer.encrypted_file, decryption_key, transfer.original_filename
+            )
+    except Exception:
+        return HttpResponse("Error decrypting file. The transfer may be corrupted.", status=500)
+    if response is None:
+        raise Http404("Unknown item.")
+
+    if response.status_code == 200 and request.method == 'GET':
+        await history.arecord(request, 'received', transfer)
+    return response
 
 #landing page
 def landing_page(request):
@@ -0,0 +1,64 @@
+"""Shared thread pools for CPU-bound crypto and image work.
+
+AES-GCM (cryptography) and most of Pillow's decode/resize/encode release the GIL,
+so independent files processed on these pools really do run in parallel.
+
+map_in_pool() spreads whole files over one pool; its tasks must not submit to it
+themselves and wait for the result. The frames of a single large file go to a
+second pool (frame_pool(), used by utils.FramePipeline), which any code may wait
+on since frame jobs never submit anything themselves.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Tasks (batches of frames) each frame-pool thread may have queued per stream; bounds its memory
+TASKS_PER_WORKER = 2
+
+_executor = None
+_frame_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.CRYPTO_MAX_WORKERS, thread_name_prefix='crypto')
+        return _executor
+
+
+def map_in_pool(func, items):
+    """Like list(map(func, items)), spread over the pool. Exceptions propagate to the caller."""
+    items = list(items)
+    if len(items) < 2:
+        return [func(item) for item in items]
+    # Each task runs in a copy of the caller's context, so its stage timings reach the request (metrics.py)
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(_get_executor().map(lambda context, item: context.run(func, item), contexts, items))
+
+
+def frame_pool():
+    """Returns (executor, window in tasks) for per-frame encryption, or (None, 0) if it is disabled."""
+    global _frame_executor
+    workers = settings.CRYPTO_PARALLEL_WORKERS
+    if workers < 2:
+        return None, 0
+    with _executor_lock:
+        if _frame_executor is None:
+            _frame_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crypto-frames')
+        return _frame_executor, workers * TASKS_PER_WORKER
+
+
+@receiver(setting_changed)
+def _reset_frame_pool(setting, **kwargs):
+    global _frame_executor
+    if setting == 'CRYPTO_PARALLEL_WORKERS':
+        with _executor_lock:
+            if _frame_executor is not None:
+                _frame_executor.shutdown(wait=False)
+            _frame_executor = None
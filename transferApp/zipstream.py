@@ -0,0 +1,56 @@
+"""Streaming ZIP writer.
+
+Entries are written one after another and whatever the zip writer produced is
+handed on as soon as it exists, so neither the archive nor a whole entry is ever
+held in memory or written to disk. Entries are STORED: photos are already
+compressed, so deflate would only cost CPU.
+"""
+import os
+import zipfile
+
+
+class _ZipBuffer:
+    """Write-only sink for ZipFile. Having no tell()/seek() makes it write data descriptors."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _unique_name(filename, used):
+    name = filename or 'file'
+    stem, ext = os.path.splitext(name)
+    counter = 1
+    while name in used:
+        name = f'{stem} ({counter}){ext}'
+        counter += 1
+    used.add(name)
+    return name
+
+
+def zip_stream(entries):
+    """Yields a ZIP archive of `entries`: (name, date_time, iterable of byte chunks) tuples."""
+    buffer = _ZipBuffer()
+    used = set()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, date_time, chunks in entries:
+            info = zipfile.ZipInfo(_unique_name(name, used), date_time=date_time)
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = buffer.take()
+                    if data:
+                        yield data
+            yield buffer.take()
+    yield buffer.take()